@@ -0,0 +1,275 @@
+# app/admin.py
+"""Admin API: submission search and export, text extracted from submitted
+documents, admission-control and file-cache status, and on-demand CPU and
+memory profiling.
+
+All routes require `Authorization: Bearer <ADMIN_API_TOKEN>`. When the token
+isn't configured the admin API is disabled and every route returns 404.
+"""
+
+import asyncio
+import csv
+import io
+import json
+import os
+import secrets
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.responses import FileResponse, PlainTextResponse, StreamingResponse
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
+
+from . import memory_profile, profiling
+from .storage import ATTACHMENT_COLUMNS, COLUMNS, JSON_COLUMNS, unescape_stored
+from .uploads import path_for_url
+
+MAX_PAGE_SIZE = 200
+EXPORT_BATCH_SIZE = 500
+
+# Leading characters that make spreadsheet apps evaluate a cell as a formula
+FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+bearer_scheme = HTTPBearer(auto_error=False)
+
+
+def require_admin(credentials: Optional[HTTPAuthorizationCredentials] = Depends(bearer_scheme)):
+    """Dependency that checks the admin bearer token in constant time."""
+    admin_token = os.getenv("ADMIN_API_TOKEN")
+    if not admin_token:
+        raise HTTPException(status_code=404, detail="Not found")
+    if credentials is None or not secrets.compare_digest(credentials.credentials, admin_token):
+        raise HTTPException(status_code=401, detail="Unauthorized")
+
+
+router = APIRouter(prefix="/api/admin", dependencies=[Depends(require_admin)])
+
+
+def _parse_date(value: Optional[str], field: str, end_of_range: bool = False) -> Optional[str]:
+    """Accept YYYY-MM-DD or a full ISO timestamp; a bare end date includes that whole day."""
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"{field} must be an ISO date or timestamp")
+    if end_of_range and len(value) == 10:
+        parsed += timedelta(days=1)
+    return parsed.isoformat()
+
+
+def submission_filters(
+    plan: Optional[str] = None,
+    business_type: Optional[str] = None,
+    submission_method: Optional[str] = None,
+    date_from: Optional[str] = Query(None, description="Inclusive start (YYYY-MM-DD or ISO timestamp)"),
+    date_to: Optional[str] = Query(None, description="Exclusive end; a bare date includes that day"),
+) -> Dict[str, Any]:
+    return {
+        'plan': plan,
+        'business_type': business_type,
+        'submission_method': submission_method,
+        'date_from': _parse_date(date_from, 'date_from'),
+        'date_to': _parse_date(date_to, 'date_to', end_of_range=True),
+    }
+
+
+@router.get("/submissions")
+async def list_submissions(
+    request: Request,
+    filters: Dict[str, Any] = Depends(submission_filters),
+    limit: int = Query(50, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[int] = Query(None, ge=1, description="next_cursor from the previous page"),
+):
+    """Newest-first page of submissions with keyset pagination."""
+    store = request.app.state.submission_store
+    items = await store.page(filters, limit=limit, before_id=cursor)
+    next_cursor = items[-1]['id'] if len(items) == limit else None
+    return {"items": items, "count": len(items), "next_cursor": next_cursor}
+
+
+def spreadsheet_safe(value: Any) -> Any:
+    """A CSV cell that opens as text, not a formula (OWASP CSV injection guidance)."""
+    if isinstance(value, str) and value.startswith(FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+
+@router.get("/submissions/export")
+async def export_submissions(
+    request: Request,
+    filters: Dict[str, Any] = Depends(submission_filters),
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$"),
+):
+    """Stream every matching submission as NDJSON or CSV, one batch at a time."""
+    store = request.app.state.submission_store
+    fieldnames = ['id', *COLUMNS]
+
+    async def ndjson_rows():
+        async for batch in store.stream(filters, batch_size=EXPORT_BATCH_SIZE):
+            yield "".join(json.dumps(record, default=str) + "\n" for record in batch)
+
+    async def csv_rows():
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=fieldnames, extrasaction='ignore')
+        writer.writeheader()
+        async for batch in store.stream(filters, batch_size=EXPORT_BATCH_SIZE):
+            for record in batch:
+                for column in JSON_COLUMNS:
+                    if record.get(column) is not None:
+                        record[column] = json.dumps(record[column])
+            # Submitted text is untrusted and admins open these exports in spreadsheets
+            writer.writerows({key: spreadsheet_safe(value) for key, value in record.items()} for record in batch)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        if buffer.tell():
+            yield buffer.getvalue()
+
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    if format == "csv":
+        body, media_type = csv_rows(), "text/csv"
+    else:
+        body, media_type = ndjson_rows(), "application/x-ndjson"
+    return StreamingResponse(
+        body,
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="submissions_{timestamp}.{format}"'},
+    )
+
+
+@router.get("/submissions/{submission_id}/documents")
+async def submission_documents(request: Request, submission_id: int, include_text: bool = True):
+    """Text extracted from a submission's attachments, extracting any not cached yet."""
+    store = request.app.state.submission_store
+    extractor = request.app.state.text_extractor
+    record = await store.find(submission_id)
+    if record is None:
+        raise HTTPException(status_code=404, detail="Submission not found")
+
+    documents = []
+    for column in ATTACHMENT_COLUMNS:
+        if not record.get(column):
+            continue
+        url = unescape_stored(record[column])
+        path = path_for_url(url)
+        if path is None:
+            documents.append({'field': column, 'file_url': url, 'status': 'external'})
+            continue
+        result = await extractor.extract(path, await store.upload_hash(url))
+        document = {'field': column, 'file_url': url, **result}
+        if include_text and result['status'] == 'ok':
+            document['text'] = await asyncio.to_thread(extractor.read_text, result['sha256'])
+        documents.append(document)
+    return {"id": submission_id, "documents": documents}
+
+
+@router.get("/admission")
+async def admission_status(request: Request):
+    """Current per-class concurrency caps, queues and shed counts."""
+    controller = getattr(request.app.state, 'admission', None)
+    if controller is None:
+        raise HTTPException(status_code=404, detail="Admission control is disabled")
+    return controller.snapshot()
+
+
+@router.get("/file-cache")
+async def file_cache_status(request: Request):
+    """Hot-file cache size and hit rate for /api/files."""
+    return request.app.state.file_cache.stats()
+
+
+def require_profiling():
+    if not profiling.PROFILING_ENABLED:
+        raise HTTPException(status_code=404, detail="Not found")
+
+
+@router.get("/profile", dependencies=[Depends(require_profiling)])
+async def sample_profile(
+    seconds: float = Query(10, gt=0, le=profiling.MAX_PROFILE_SECONDS),
+    interval_ms: float = Query(5, ge=1, le=100),
+):
+    """Sample every thread of this worker for `seconds`; returns collapsed stacks.
+
+    Feed the output to flamegraph.pl or load it in speedscope.
+    """
+    sampler = profiling.StackSampler(interval=interval_ms / 1000)
+    try:
+        stacks = await asyncio.to_thread(sampler.run, seconds)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    return PlainTextResponse(
+        profiling.collapsed(stacks),
+        headers={
+            "Content-Disposition": f'attachment; filename="profile_{timestamp}.folded"',
+            "X-Profile-Samples": str(sampler.samples),
+        },
+    )
+
+
+@router.get("/profile/requests/{profile_id}", dependencies=[Depends(require_profiling)])
+async def request_profile(
+    profile_id: str,
+    format: str = Query("text", pattern="^(text|pstats)$"),
+    sort: str = Query("cumulative", pattern="^(cumulative|tottime|ncalls)$"),
+):
+    """A per-request cProfile capture: pstats text, or the raw file for snakeviz."""
+    path = profiling.profile_path(profile_id)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    if format == "pstats":
+        return FileResponse(path, media_type="application/octet-stream", filename=path.name)
+    return PlainTextResponse(await asyncio.to_thread(profiling.profile_report, path, sort))
+
+
+@router.get("/memory", dependencies=[Depends(require_profiling)])
+async def memory_status():
+    """Whether tracemalloc is tracing, how much it sees and which snapshots are kept."""
+    return memory_profile.status()
+
+
+@router.post("/memory/start", dependencies=[Depends(require_profiling)])
+async def memory_start(frames: int = Query(1, ge=1, le=memory_profile.MAX_FRAMES)):
+    """Start tracing allocations; more frames cost more but attribute better."""
+    memory_profile.start(frames)
+    return memory_profile.status()
+
+
+@router.post("/memory/stop", dependencies=[Depends(require_profiling)])
+async def memory_stop():
+    """Stop tracing and free the kept snapshots."""
+    memory_profile.stop()
+    return memory_profile.status()
+
+
+@router.post("/memory/snapshots", dependencies=[Depends(require_profiling)])
+async def memory_snapshot(
+    group_by: str = Query("module", pattern="^(module|lineno|traceback)$"),
+    limit: int = Query(25, ge=1, le=200),
+    charge_to_app: bool = Query(False, description="attribute allocations to the nearest app.* frame"),
+):
+    """Take a snapshot and return its top allocation sites."""
+    try:
+        snapshot_id = await asyncio.to_thread(memory_profile.take_snapshot)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    snapshot = memory_profile.get_snapshot(snapshot_id)
+    top = await asyncio.to_thread(memory_profile.top, snapshot, group_by, limit, charge_to_app)
+    return {"snapshot_id": snapshot_id, "group_by": group_by, "top": top}
+
+
+@router.get("/memory/diff", dependencies=[Depends(require_profiling)])
+async def memory_diff(
+    base: str,
+    target: str,
+    group_by: str = Query("module", pattern="^(module|lineno|traceback)$"),
+    limit: int = Query(25, ge=1, le=200),
+    charge_to_app: bool = False,
+):
+    """Allocation growth between two kept snapshots."""
+    old, new = memory_profile.get_snapshot(base), memory_profile.get_snapshot(target)
+    if old is None or new is None:
+        raise HTTPException(status_code=404, detail="Snapshot not found")
+    changes = await asyncio.to_thread(memory_profile.diff, old, new, group_by, limit, charge_to_app)
+    return {"base": base, "target": target, "group_by": group_by, "changes": changes}
@@ -0,0 +1,313 @@
+# app/admission.py
+"""Adaptive admission control and load shedding by route class.
+
+Every request is sorted into a route class. Each class has its own cap on
+in-flight requests and a bounded wait queue with a deadline, so a pile-up
+of slow SMTP-bound submissions can't take the slots landing-page hits
+need, and vice versa:
+
+    class      routes                                   target  queue (wait)
+    critical   submits, /thank-you, Stripe webhook      5s      64 (15s)
+    uploads    upload, lookup, resumable, file serving  2s      32 (5s)
+    pages      /, /start, /static                       250ms   64 (2s)
+    low        /legal, /test-email                      250ms   shed, never queued
+
+Caps adapt with AIMD: a request finishing within its class's latency
+target grows the cap by 1/cap (about +1 per cap's worth of requests); one
+that overruns shrinks it by BACKOFF, at most once per target interval so
+a single slow burst counts once. Latency is the server's share only: from
+the end of the request body (or admission, for requests without one) to
+the start of the response, so slow client uploads and downloads don't
+read as overload. When a protected class (anything not `low`) overruns
+its target or has requests waiting, the service is under pressure and
+`low` traffic is shed with an immediate 503 and Retry-After for
+ADMISSION_SHED_SECONDS. Queued requests that reach their deadline
+also get 503 + Retry-After instead of waiting forever.
+
+Admin routes and /metrics bypass admission so they keep working while
+the app is overloaded. ADMISSION_CONTROL=0 disables the middleware.
+"""
+
+import asyncio
+import logging
+import math
+import os
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Deque, Dict, Optional
+
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from .metrics import METRIC_PREFIX, registry
+
+logger = logging.getLogger(__name__)
+
+ADMISSION_CONTROL = os.getenv('ADMISSION_CONTROL', '1').lower() not in ('0', 'false', 'no')
+ADMISSION_SHED_SECONDS = float(os.getenv('ADMISSION_SHED_SECONDS', '10'))
+
+ADMISSION_WAIT_METRIC = f'{METRIC_PREFIX}_admission_wait_seconds'
+
+BACKOFF = 0.7
+
+EXEMPT_PREFIXES = ('/api/admin/', '/metrics')
+
+
+@dataclass
+class RouteClass:
+    name: str
+    latency_target: float    # seconds; slower completions shrink the cap
+    initial_limit: int
+    min_limit: int
+    max_limit: int
+    queue_size: int          # 0 = shed as soon as the cap is reached
+    queue_timeout: float     # seconds a queued request may wait for a slot
+    retry_after: int         # Retry-After seconds sent with a 503
+    sheddable: bool = False  # shed outright while protected classes are under pressure
+
+
+ROUTE_CLASSES = {
+    'critical': RouteClass('critical', 5.0, 32, 4, 128, 64, 15.0, 5),
+    'uploads': RouteClass('uploads', 2.0, 16, 2, 64, 32, 5.0, 5),
+    'pages': RouteClass('pages', 0.25, 64, 8, 256, 64, 2.0, 2),
+    'low': RouteClass('low', 0.25, 8, 1, 32, 0, 0.0, 30, sheddable=True),
+}
+
+# First matching prefix wins; anything unlisted is a page
+ROUTE_PREFIXES = (
+    ('/api/submit-onboarding', 'critical'),
+    ('/api/stripe/webhook', 'critical'),
+    ('/thank-you', 'critical'),
+    ('/api/upload-file', 'uploads'),
+    ('/api/uploads', 'uploads'),
+    ('/api/files/', 'uploads'),
+    ('/legal', 'low'),
+    ('/test-email', 'low'),
+)
+
+
+def classify(path: str) -> Optional[str]:
+    """Route class for a request path, or None for routes that bypass admission."""
+    if path.startswith(EXEMPT_PREFIXES):
+        return None
+    for prefix, name in ROUTE_PREFIXES:
+        if path.startswith(prefix):
+            return name
+    return 'pages'
+
+
+class Rejected(Exception):
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class ClassLimiter:
+    """AIMD concurrency cap with a deadline-bounded FIFO queue for one route class."""
+
+    def __init__(self, route_class: RouteClass):
+        self.route_class = route_class
+        self.limit = float(route_class.initial_limit)
+        self.in_flight = 0
+        self.waiters: Deque[asyncio.Future] = deque()
+        self.admitted = 0
+        self.shed = 0
+        self.timed_out = 0
+        self.last_latency = 0.0
+        self._last_decrease = 0.0
+        self.wait_histogram = registry.histogram(ADMISSION_WAIT_METRIC, route_class.name, label_name='class',
+                                                 help_text='Time requests waited for admission, by route class')
+
+    @property
+    def has_capacity(self) -> bool:
+        return self.in_flight < max(1, int(self.limit))
+
+    async def acquire(self):
+        if self.has_capacity and not self.waiters:
+            self.in_flight += 1
+            self.admitted += 1
+            self.wait_histogram.observe(0.0)
+            return
+
+        route_class = self.route_class
+        if len(self.waiters) >= route_class.queue_size:
+            self.shed += 1
+            raise Rejected('queue_full', route_class.retry_after)
+
+        start = time.perf_counter()
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter, route_class.queue_timeout)
+        except asyncio.TimeoutError:
+            self._abandon(waiter)
+            self.timed_out += 1
+            raise Rejected('queue_timeout', route_class.retry_after)
+        except asyncio.CancelledError:  # client went away while queued
+            self._abandon(waiter)
+            raise
+        self.admitted += 1
+        self.wait_histogram.observe(time.perf_counter() - start)
+
+    def _abandon(self, waiter: asyncio.Future):
+        if waiter.done() and not waiter.cancelled():
+            # A slot was handed over just as the waiter gave up; pass it on
+            self.in_flight -= 1
+            self._wake()
+            return
+        waiter.cancel()
+        try:
+            self.waiters.remove(waiter)
+        except ValueError:
+            pass
+
+    def release(self, latency: float) -> bool:
+        """Free a slot and adapt the cap; returns True if the latency target was missed."""
+        self.in_flight -= 1
+        self.last_latency = latency
+        route_class = self.route_class
+        breached = latency > route_class.latency_target
+        now = time.monotonic()
+        if breached:
+            if now - self._last_decrease >= route_class.latency_target:
+                self.limit = max(route_class.min_limit, self.limit * BACKOFF)
+                self._last_decrease = now
+        else:
+            self.limit = min(route_class.max_limit, self.limit + 1 / self.limit)
+        self._wake()
+        return breached
+
+    def _wake(self):
+        # Hand freed slots straight to waiters so newcomers can't jump the queue
+        while self.waiters and self.has_capacity:
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                self.in_flight += 1
+                waiter.set_result(None)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            'limit': round(self.limit, 2),
+            'in_flight': self.in_flight,
+            'queued': len(self.waiters),
+            'admitted': self.admitted,
+            'shed': self.shed,
+            'timed_out': self.timed_out,
+            'latency_target_ms': self.route_class.latency_target * 1000,
+            'last_latency_ms': round(self.last_latency * 1000, 1),
+        }
+
+
+class AdmissionController:
+    """Per-class limiters plus the pressure signal that drives shedding."""
+
+    def __init__(self, route_classes: Dict[str, RouteClass] = None, shed_seconds: float = ADMISSION_SHED_SECONDS):
+        self.limiters = {name: ClassLimiter(rc) for name, rc in (route_classes or ROUTE_CLASSES).items()}
+        self.shed_seconds = shed_seconds
+        self._pressure_until = 0.0
+
+    def under_pressure(self, now: float) -> bool:
+        if now < self._pressure_until:
+            return True
+        return any(limiter.waiters for limiter in self.limiters.values() if not limiter.route_class.sheddable)
+
+    def _raise_pressure(self, class_name: str, latency: float, now: float):
+        if now >= self._pressure_until:
+            logger.warning("Latency target missed on %s (%.0fms > %.0fms); shedding low-priority traffic for %.0fs",
+                           class_name, latency * 1000, self.limiters[class_name].route_class.latency_target * 1000,
+                           self.shed_seconds)
+        self._pressure_until = now + self.shed_seconds
+
+    async def admit(self, class_name: str) -> ClassLimiter:
+        limiter = self.limiters[class_name]
+        now = time.monotonic()
+        if limiter.route_class.sheddable and self.under_pressure(now):
+            limiter.shed += 1
+            # Until the shed window closes; pressure from queued requests alone has no
+            # deadline, so ask for a quick retry
+            raise Rejected('shedding', max(1, math.ceil(self._pressure_until - now)))
+        await limiter.acquire()
+        return limiter
+
+    def done(self, limiter: ClassLimiter, latency: float):
+        if limiter.release(latency) and not limiter.route_class.sheddable:
+            self._raise_pressure(limiter.route_class.name, latency, time.monotonic())
+
+    def snapshot(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        return {
+            'under_pressure': self.under_pressure(now),
+            'shedding_for_seconds': round(max(0.0, self._pressure_until - now), 1),
+            'classes': {name: limiter.snapshot() for name, limiter in self.limiters.items()},
+        }
+
+
+class AdmissionControlMiddleware:
+    """Admit, queue or shed each request according to its route class.
+
+    Plain ASGI rather than BaseHTTPMiddleware: a slot is held until the
+    last body chunk has been sent, so streamed exports and file downloads
+    occupy it for as long as they actually run. The latency fed to the
+    controller stops at the response start and restarts when the request
+    body has fully arrived, leaving out time spent on the client's network.
+    """
+
+    def __init__(self, app: ASGIApp, controller: AdmissionController):
+        self.app = app
+        self.controller = controller
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        class_name = classify(scope['path']) if scope['type'] == 'http' else None
+        if class_name is None:
+            await self.app(scope, receive, send)
+            return
+
+        try:
+            limiter = await self.controller.admit(class_name)
+        except Rejected as rejected:
+            logger.info("Rejected %s %s (%s, %s)", scope['method'], scope['path'], class_name, rejected.reason)
+            await overloaded_response(rejected.retry_after)(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        latency: Optional[float] = None
+        released = False
+
+        def release():
+            nonlocal released
+            if not released:
+                released = True
+                self.controller.done(limiter, time.perf_counter() - start if latency is None else latency)
+
+        async def receive_wrapper() -> Message:
+            nonlocal start
+            message = await receive()
+            if message['type'] == 'http.request' and not message.get('more_body', False) and latency is None:
+                start = time.perf_counter()  # the upload is the client's time, not ours
+            return message
+
+        async def send_wrapper(message: Message):
+            nonlocal latency
+            if message['type'] == 'http.response.start':
+                latency = time.perf_counter() - start
+            try:
+                await send(message)
+            finally:
+                if (message['type'] == 'http.response.body' and not message.get('more_body', False)) \
+                        or message['type'] == 'http.response.pathsend':
+                    release()
+
+        try:
+            await self.app(scope, receive_wrapper, send_wrapper)
+        finally:
+            release()  # no final body: the app raised or the client went away
+
+
+def overloaded_response(retry_after: int) -> JSONResponse:
+    return JSONResponse(
+        status_code=503,
+        content={"detail": {"error": "overloaded", "message": "The service is busy. Please try again shortly."}},
+        headers={"Retry-After": str(retry_after), "Cache-Control": "no-store"},
+    )
@@ -0,0 +1,313 @@
+# app/chat_gateway.py
+"""WebSocket chat gateway for the menu bot (mounted at /ws by run.py).
+
+JSON text frames in both directions:
+
+    client  {"type": "ask", "question": "Do you have oat milk?", "lat": 40.73, "lng": -73.99}
+            {"type": "ping"}
+    server  {"type": "ready", "session": "..."}
+            {"type": "answer", "id": 1, "answer": "..."}
+            {"type": "pong"}
+            {"type": "error", "error": "rate_limited", "retry_after": 2.4}
+
+lat/lng are optional and give the bot delivery-zone context.
+
+An idle connection costs one ChatConnection (a __slots__ object with two
+token buckets) plus the server's own per-socket state; there is no extra
+task, queue or buffer per connection. Run the gateway with
+`python run.py`, which starts uvicorn with `uvicorn_options()`:
+permessage-deflate off (each socket would otherwise keep its own zlib
+windows, several times the rest of its footprint), a small receive queue
+and a 4KB frame limit. See `python -m benchmarks.chat_connections` for
+how many sockets one process holds.
+
+Flow control:
+
+  - inbound: each connection handles one question at a time. While an
+    answer is pending nothing more is read, so further frames back up
+    in the server's small receive queue and then in TCP, not in memory
+  - outbound: a send that can't complete within CHAT_SEND_TIMEOUT (a
+    client that stopped reading) closes the connection
+  - answers: at most CHAT_MAX_CONCURRENT_ANSWERS questions go to the
+    model at once per process; the rest wait their turn
+  - rate: every inbound frame is charged to a token bucket. Questions
+    draw from CHAT_MESSAGES_PER_MINUTE with bursts of CHAT_MESSAGE_BURST;
+    pings and invalid frames from a separate, more generous bucket
+    (CONTROL_MESSAGES_PER_MINUTE), so keepalives don't use up questions.
+    Over-limit frames get an error with retry_after instead of their
+    reply, and a client that keeps going is closed
+
+Dead peers are found by protocol-level pings, which the server sends
+every CHAT_PING_INTERVAL seconds and closes the socket if no pong comes
+back within CHAT_PING_TIMEOUT. Browsers can't send protocol pings, so
+clients keep an otherwise quiet connection open with {"type": "ping"};
+connections with no client message for CHAT_IDLE_TIMEOUT are closed.
+"""
+
+import asyncio
+import json
+import logging
+import math
+import os
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from starlette.websockets import WebSocket, WebSocketState
+
+logger = logging.getLogger(__name__)
+
+CHAT_MAX_CONNECTIONS = int(os.getenv('CHAT_MAX_CONNECTIONS', '10000'))
+CHAT_MESSAGES_PER_MINUTE = float(os.getenv('CHAT_MESSAGES_PER_MINUTE', '20'))
+CHAT_MESSAGE_BURST = int(os.getenv('CHAT_MESSAGE_BURST', '5'))
+CHAT_MAX_CONCURRENT_ANSWERS = int(os.getenv('CHAT_MAX_CONCURRENT_ANSWERS', '32'))
+CHAT_SEND_TIMEOUT = float(os.getenv('CHAT_SEND_TIMEOUT', '10'))
+CHAT_IDLE_TIMEOUT = float(os.getenv('CHAT_IDLE_TIMEOUT', '900'))
+CHAT_PING_INTERVAL = float(os.getenv('CHAT_PING_INTERVAL', '20'))
+CHAT_PING_TIMEOUT = float(os.getenv('CHAT_PING_TIMEOUT', '20'))
+
+MAX_MESSAGE_SIZE = 4096
+MAX_QUESTION_LENGTH = 1000
+MAX_VIOLATIONS = 10  # rate-limited messages in a row before the connection is closed
+CONTROL_MESSAGES_PER_MINUTE = 60  # pings and invalid frames
+CONTROL_MESSAGE_BURST = 10
+RECEIVE_QUEUE = 4
+REAP_INTERVAL = 30.0
+
+# Close codes
+GOING_AWAY = 1001
+POLICY_VIOLATION = 1008
+TRY_AGAIN_LATER = 1013
+
+Answerer = Callable[[str, str, Optional[float], Optional[float]], Awaitable[str]]
+CloseHook = Callable[[str], None]
+
+
+def uvicorn_options() -> Dict[str, Any]:
+    """uvicorn settings for holding many mostly idle sockets."""
+    return {
+        'ws': 'websockets',
+        'ws_max_size': MAX_MESSAGE_SIZE,
+        'ws_max_queue': RECEIVE_QUEUE,
+        'ws_ping_interval': CHAT_PING_INTERVAL,
+        'ws_ping_timeout': CHAT_PING_TIMEOUT,
+        'ws_per_message_deflate': False,
+    }
+
+
+class TokenBucket:
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated')
+
+    def __init__(self, per_minute: float, burst: int, now: float):
+        self.rate = per_minute / 60.0
+        self.capacity = float(burst)
+        self.tokens = float(burst)
+        self.updated = now
+
+    def take(self, now: float) -> float:
+        """0 if a message may go through, else seconds until one may."""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate if self.rate else math.inf
+
+
+class ChatConnection:
+    __slots__ = ('session', 'websocket', 'bucket', 'control', 'connected_at', 'last_seen', 'answers',
+                 'violations', 'busy')
+
+    def __init__(self, websocket: WebSocket, bucket: TokenBucket, control: TokenBucket, now: float):
+        self.session = uuid.uuid4().hex
+        self.websocket = websocket
+        self.bucket = bucket  # questions
+        self.control = control  # everything else
+        self.connected_at = now
+        self.last_seen = now
+        self.answers = 0
+        self.violations = 0
+        self.busy = False
+
+
+class BadMessage(ValueError):
+    pass
+
+
+def parse_ask(message: Dict[str, Any]):
+    """(question, lat, lng) from an ask frame."""
+    question = message.get('question')
+    if not isinstance(question, str) or not question.strip():
+        raise BadMessage("question must be a non-empty string")
+    if len(question) > MAX_QUESTION_LENGTH:
+        raise BadMessage(f"question is longer than {MAX_QUESTION_LENGTH} characters")
+    lat, lng = message.get('lat'), message.get('lng')
+    if lat is None or lng is None:
+        return question.strip(), None, None
+    if isinstance(lat, bool) or isinstance(lng, bool) or not isinstance(lat, (int, float)) \
+            or not isinstance(lng, (int, float)) or not (-90 <= lat <= 90 and -180 <= lng <= 180):
+        raise BadMessage("lat/lng must be degrees")
+    return question.strip(), float(lat), float(lng)
+
+
+class ChatGateway:
+    """Accepts chat sockets, enforces per-connection limits and routes questions to the bot."""
+
+    def __init__(self, answer: Answerer, max_connections: int = CHAT_MAX_CONNECTIONS,
+                 messages_per_minute: float = CHAT_MESSAGES_PER_MINUTE, burst: int = CHAT_MESSAGE_BURST,
+                 max_concurrent_answers: int = CHAT_MAX_CONCURRENT_ANSWERS, send_timeout: float = CHAT_SEND_TIMEOUT,
+                 idle_timeout: float = CHAT_IDLE_TIMEOUT, on_close: Optional[CloseHook] = None):
+        self.answer = answer
+        self.on_close = on_close
+        self.max_connections = max_connections
+        self.messages_per_minute = messages_per_minute
+        self.burst = burst
+        self.send_timeout = send_timeout
+        self.idle_timeout = idle_timeout
+        self.connections: Dict[str, ChatConnection] = {}
+        self._answer_slots = asyncio.Semaphore(max_concurrent_answers)
+        self._reaper: Optional[asyncio.Task] = None
+        self.accepted = 0
+        self.refused = 0
+        self.rate_limited = 0
+        self.slow_closed = 0
+        self.idle_closed = 0
+
+    # -- lifecycle -----------------------------------------------------------
+
+    def start(self):
+        if self._reaper is None:
+            self._reaper = asyncio.create_task(self._reap_idle_periodically())
+
+    async def stop(self):
+        if self._reaper is not None:
+            self._reaper.cancel()
+            self._reaper = None
+        await asyncio.gather(*(self._close(connection, GOING_AWAY, "Server shutting down")
+                               for connection in list(self.connections.values())))
+
+    # -- per connection ------------------------------------------------------
+
+    async def serve(self, websocket: WebSocket):
+        if len(self.connections) >= self.max_connections:
+            self.refused += 1
+            await websocket.close(code=TRY_AGAIN_LATER)  # before accept: the handshake gets a 403
+            return
+        await websocket.accept()
+        now = time.monotonic()
+        connection = ChatConnection(websocket, TokenBucket(self.messages_per_minute, self.burst, now),
+                                    TokenBucket(CONTROL_MESSAGES_PER_MINUTE, CONTROL_MESSAGE_BURST, now), now)
+        self.connections[connection.session] = connection
+        self.accepted += 1
+        try:
+            if not await self._send(connection, {'type': 'ready', 'session': connection.session}):
+                return
+            while True:
+                message = await websocket.receive()
+                if message['type'] == 'websocket.disconnect':
+                    return
+                connection.last_seen = time.monotonic()
+                if not await self._handle(connection, message.get('text')):
+                    return
+        except Exception as e:
+            if connection.session in self.connections and websocket.client_state != WebSocketState.DISCONNECTED:
+                logger.error("[%s] Chat connection failed: %s", connection.session[:8], e)
+        finally:
+            self.connections.pop(connection.session, None)
+            if self.on_close is not None:
+                self.on_close(connection.session)
+
+    async def _handle(self, connection: ChatConnection, text: Optional[str]) -> bool:
+        """Process one frame; False once the connection has been closed."""
+        message, error = None, None
+        try:
+            if text is None:
+                raise BadMessage("frames must be JSON text")
+            message = json.loads(text)
+            if not isinstance(message, dict):
+                raise BadMessage("frames must be JSON objects")
+        except (ValueError, BadMessage) as e:
+            message, error = None, str(e)
+        kind = message.get('type') if message is not None else None
+        if message is not None and kind not in ('ask', 'ping'):
+            error = "type must be 'ask' or 'ping'"
+
+        # Every frame is charged, so pings and junk can't be used to flood replies
+        bucket = connection.bucket if kind == 'ask' else connection.control
+        retry_after = bucket.take(time.monotonic())
+        if retry_after:
+            self.rate_limited += 1
+            connection.violations += 1
+            if connection.violations >= MAX_VIOLATIONS:
+                await self._close(connection, POLICY_VIOLATION, "Too many messages")
+                return False
+            return await self._send(connection, {'type': 'error', 'error': 'rate_limited',
+                                                 'retry_after': round(retry_after, 1)})
+        connection.violations = 0
+
+        if error is not None:
+            return await self._send(connection, {'type': 'error', 'error': 'bad_request', 'message': error})
+        if kind == 'ping':
+            return await self._send(connection, {'type': 'pong'})
+
+        try:
+            question, lat, lng = parse_ask(message)
+        except BadMessage as e:
+            return await self._send(connection, {'type': 'error', 'error': 'bad_request', 'message': str(e)})
+
+        connection.busy = True
+        try:
+            async with self._answer_slots:
+                answer = await self.answer(connection.session, question, lat, lng)
+        except Exception as e:
+            logger.error("[%s] Bot answer failed: %s", connection.session[:8], e)
+            return await self._send(connection, {'type': 'error', 'error': 'unavailable',
+                                                 'message': "The bot couldn't answer right now. Please try again."})
+        finally:
+            connection.busy = False
+        connection.answers += 1
+        return await self._send(connection, {'type': 'answer', 'id': connection.answers, 'answer': answer})
+
+    async def _send(self, connection: ChatConnection, payload: Dict[str, Any]) -> bool:
+        """Send a frame, closing a client too slow to take it; False if the connection is gone."""
+        try:
+            await asyncio.wait_for(connection.websocket.send_text(json.dumps(payload)), self.send_timeout)
+            return True
+        except asyncio.TimeoutError:
+            self.slow_closed += 1
+            logger.info("[%s] Closing chat connection: client stopped reading", connection.session[:8])
+            await self._close(connection, POLICY_VIOLATION, "Client too slow")
+        except Exception:
+            pass  # disconnected mid-send
+        return False
+
+    async def _close(self, connection: ChatConnection, code: int, reason: str):
+        self.connections.pop(connection.session, None)
+        try:
+            await asyncio.wait_for(connection.websocket.close(code=code, reason=reason), 1.0)
+        except Exception:
+            pass
+
+    # -- housekeeping --------------------------------------------------------
+
+    async def _reap_idle_periodically(self):
+        while True:
+            await asyncio.sleep(REAP_INTERVAL)
+            cutoff = time.monotonic() - self.idle_timeout
+            idle = [c for c in self.connections.values() if c.last_seen < cutoff and not c.busy]
+            for connection in idle:
+                self.idle_closed += 1
+                await self._close(connection, GOING_AWAY, "Idle timeout")
+            if idle:
+                logger.info("Closed %s idle chat connections", len(idle))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'connections': len(self.connections),
+            'busy': sum(1 for connection in self.connections.values() if connection.busy),
+            'accepted': self.accepted,
+            'refused': self.refused,
+            'rate_limited': self.rate_limited,
+            'slow_closed': self.slow_closed,
+            'idle_closed': self.idle_closed,
+        }
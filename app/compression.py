@@ -0,0 +1,240 @@
+# app/compression.py
+"""Negotiated, streaming response compression (br, zstd, gzip).
+
+The encoding is picked from Accept-Encoding by q-value, ties going to
+the server's preference: br, then zstd, then gzip. gzip is always
+available; br needs the `brotli` package and zstd needs `zstandard`. An
+encoding whose package isn't installed is never offered, so both stay
+optional.
+
+Responses are left alone when they are small (under
+COMPRESSION_MIN_SIZE), not a text-like type (uploaded images and PDFs
+from /api/files are already compressed), already encoded, partial
+(206), or marked `Cache-Control: no-transform`. Bodies are compressed
+chunk by chunk and flushed after every chunk of a streaming response,
+so CSV exports and other streams still reach the client progressively.
+A response that streams in small chunks is only held back until it
+reaches the size threshold or ends.
+
+Levels trade CPU for bytes: COMPRESSION_GZIP_LEVEL (1-9, default 6),
+COMPRESSION_BROTLI_QUALITY (0-11, default 4; 11 is far too slow for
+per-request use), COMPRESSION_ZSTD_LEVEL (1-22, default 3).
+RESPONSE_COMPRESSION=0 disables the middleware.
+"""
+
+import os
+import zlib
+from typing import Callable, Dict, List, Optional
+
+try:
+    import brotli
+except ImportError:  # optional
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # optional
+    zstandard = None
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+RESPONSE_COMPRESSION = os.getenv('RESPONSE_COMPRESSION', '1').lower() not in ('0', 'false', 'no')
+COMPRESSION_MIN_SIZE = int(os.getenv('COMPRESSION_MIN_SIZE', '1024'))
+COMPRESSION_GZIP_LEVEL = int(os.getenv('COMPRESSION_GZIP_LEVEL', '6'))
+COMPRESSION_BROTLI_QUALITY = int(os.getenv('COMPRESSION_BROTLI_QUALITY', '4'))
+COMPRESSION_ZSTD_LEVEL = int(os.getenv('COMPRESSION_ZSTD_LEVEL', '3'))
+
+COMPRESSIBLE_TYPES = (
+    'text/',
+    'application/json',
+    'application/problem+json',
+    'application/javascript',
+    'application/xml',
+    'application/x-ndjson',
+    'image/svg+xml',
+)
+
+
+class _Gzip:
+    def __init__(self, level: int):
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 31)  # 31: gzip container
+
+    def compress(self, data: bytes, flush: bool) -> bytes:
+        out = self._compressor.compress(data)
+        return out + self._compressor.flush(zlib.Z_SYNC_FLUSH) if flush else out
+
+    def finish(self, data: bytes) -> bytes:
+        return self._compressor.compress(data) + self._compressor.flush()
+
+
+class _Brotli:
+    def __init__(self, quality: int):
+        self._compressor = brotli.Compressor(quality=quality)
+
+    def compress(self, data: bytes, flush: bool) -> bytes:
+        out = self._compressor.process(data)
+        return out + self._compressor.flush() if flush else out
+
+    def finish(self, data: bytes) -> bytes:
+        return self._compressor.process(data) + self._compressor.finish()
+
+
+class _Zstd:
+    def __init__(self, level: int):
+        self._compressor = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def compress(self, data: bytes, flush: bool) -> bytes:
+        out = self._compressor.compress(data)
+        return out + self._compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK) if flush else out
+
+    def finish(self, data: bytes) -> bytes:
+        return self._compressor.compress(data) + self._compressor.flush()
+
+
+def available_encodings(gzip_level: int = COMPRESSION_GZIP_LEVEL, brotli_quality: int = COMPRESSION_BROTLI_QUALITY,
+                        zstd_level: int = COMPRESSION_ZSTD_LEVEL) -> Dict[str, Callable]:
+    """Encoding name -> compressor factory, in server preference order."""
+    encodings = {}
+    if brotli is not None:
+        encodings['br'] = lambda: _Brotli(brotli_quality)
+    if zstandard is not None:
+        encodings['zstd'] = lambda: _Zstd(zstd_level)
+    encodings['gzip'] = lambda: _Gzip(gzip_level)
+    return encodings
+
+
+def negotiate(accept_encoding: str, offered: List[str]) -> Optional[str]:
+    """Best of `offered` (in preference order) for an Accept-Encoding header, or None."""
+    q_values = {}
+    for part in accept_encoding.split(','):
+        coding, _, params = part.strip().partition(';')
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        q_values[coding] = q
+
+    best, best_q = None, 0.0
+    for coding in offered:
+        q = q_values.get(coding, q_values.get('*', 0.0))
+        if q > best_q:
+            best, best_q = coding, q
+    return best
+
+
+def is_compressible(content_type: str) -> bool:
+    return content_type.lower().startswith(COMPRESSIBLE_TYPES)
+
+
+class CompressionMiddleware:
+    """ASGI middleware that compresses text-like responses in the negotiated encoding."""
+
+    def __init__(self, app: ASGIApp, minimum_size: int = COMPRESSION_MIN_SIZE,
+                 encodings: Optional[Dict[str, Callable]] = None):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.encodings = encodings if encodings is not None else available_encodings()
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope['type'] != 'http' or scope['method'] == 'HEAD':
+            await self.app(scope, receive, send)
+            return
+        encoding = negotiate(Headers(scope=scope).get('accept-encoding', ''), list(self.encodings))
+        responder = _CompressingResponder(self.app, send, encoding, self.encodings.get(encoding), self.minimum_size)
+        await responder(scope, receive)
+
+
+class _CompressingResponder:
+    def __init__(self, app: ASGIApp, send: Send, encoding: Optional[str], factory: Optional[Callable],
+                 minimum_size: int):
+        self.app = app
+        self.send = send
+        self.encoding = encoding
+        self.factory = factory
+        self.minimum_size = minimum_size
+        self.start_message: Optional[Message] = None
+        self.pending: List[bytes] = []
+        self.pending_size = 0
+        self.compressor = None
+        self.passthrough = False
+
+    async def __call__(self, scope: Scope, receive: Receive):
+        await self.app(scope, receive, self.send_wrapper)
+
+    async def send_wrapper(self, message: Message):
+        message_type = message['type']
+        if message_type == 'http.response.start':
+            self._on_start(message)
+            if self.passthrough:
+                await self.send(message)
+            return
+        if message_type != 'http.response.body' or self.passthrough:
+            await self.send(message)
+            return
+
+        body = message.get('body', b'')
+        more_body = message.get('more_body', False)
+
+        if self.compressor is None:
+            self.pending.append(body)
+            self.pending_size += len(body)
+            if more_body and self.pending_size < self.minimum_size:
+                return  # not sure yet whether this one is worth compressing
+            body = b''.join(self.pending)
+            self.pending = []
+            if self.pending_size < self.minimum_size:
+                await self.send(self.start_message)
+                await self.send({'type': 'http.response.body', 'body': body, 'more_body': False})
+                return
+            self._begin_compression()
+            await self.send(self.start_message)
+
+        if more_body:
+            chunk = self.compressor.compress(body, flush=True)
+            if chunk:
+                await self.send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+        else:
+            await self.send({'type': 'http.response.body', 'body': self.compressor.finish(body), 'more_body': False})
+
+    def _on_start(self, message: Message):
+        message['headers'] = list(message.get('headers', []))
+        self.start_message = message
+        headers = Headers(raw=message['headers'])
+        content_type = headers.get('content-type', '')
+        if not is_compressible(content_type):
+            self.passthrough = True
+            return
+
+        # The representation varies by Accept-Encoding whenever it could be compressed
+        MutableHeaders(raw=message['headers']).add_vary_header('Accept-Encoding')
+
+        status = message['status']
+        if (
+            self.factory is None
+            or status < 200 or status in (204, 206, 304)
+            or 'content-encoding' in headers
+            or 'content-range' in headers
+            or 'no-transform' in headers.get('cache-control', '').lower()
+        ):
+            self.passthrough = True
+            return
+        content_length = headers.get('content-length')
+        if content_length is not None and content_length.isdigit() and int(content_length) < self.minimum_size:
+            self.passthrough = True
+
+    def _begin_compression(self):
+        self.compressor = self.factory()
+        headers = MutableHeaders(raw=self.start_message['headers'])
+        headers['Content-Encoding'] = self.encoding
+        if 'content-length' in headers:
+            del headers['Content-Length']
+        etag = headers.get('etag')
+        if etag and not etag.startswith('W/'):
+            headers['ETag'] = f'W/{etag}'  # no longer byte-identical to the uncompressed entity
@@ -0,0 +1,232 @@
+# app/conversations.py
+"""Per-session conversation history for the menu bot.
+
+Follow-up questions ("and in oat milk?") only make sense with the turns
+before them, but sending a session's whole history would let prompt size
+and latency grow without bound. Each session keeps its last
+CONVERSATION_MAX_TURNS question/answer pairs in a fixed-size ring buffer
+of __slots__ records, and `history()` returns the newest turns that fit
+in CONVERSATION_TOKEN_BUDGET.
+
+Every turn caches its own token estimate and the session's running total
+up to and including it, so the cut-off for a budget is a binary search
+over the ring rather than a re-count of every turn on every question.
+Turns that fall out of the ring or the budget aren't lost entirely: their
+questions are folded into a one-line summary ("Earlier the customer
+asked: ...", itself capped at SUMMARY_TOKENS) that is sent ahead of the
+turns when there is room for it. The summary is built from the text, not
+by another model call, so it adds nothing to answer latency.
+
+Token counts are estimates (about four characters a token plus a few per
+message, the way OpenAI chat messages are framed), which is close enough
+to hold a budget without a tokenizer dependency.
+
+Sessions are kept in LRU order. Ones idle for CONVERSATION_IDLE_SECONDS
+are dropped, and the least recently used are evicted while the store's
+estimated size is over CONVERSATION_MAX_BYTES.
+"""
+
+import math
+import os
+import sys
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+CONVERSATION_MAX_TURNS = int(os.getenv('CONVERSATION_MAX_TURNS', '16'))
+CONVERSATION_TOKEN_BUDGET = int(os.getenv('CONVERSATION_TOKEN_BUDGET', '1500'))
+CONVERSATION_MAX_BYTES = int(os.getenv('CONVERSATION_MAX_BYTES', str(64 * 1024 * 1024)))
+CONVERSATION_IDLE_SECONDS = float(os.getenv('CONVERSATION_IDLE_SECONDS', '1800'))
+
+CHARS_PER_TOKEN = 4
+MESSAGE_OVERHEAD_TOKENS = 4  # role and framing per chat message
+SUMMARY_TOKENS = 120
+SUMMARY_QUESTION_CHARS = 80
+SUMMARY_PREFIX = "Earlier the customer asked: "
+
+# Rough per-object overheads for the size estimate; only the cap depends on them
+TURN_OVERHEAD = sys.getsizeof(object()) + 5 * 8
+CONVERSATION_OVERHEAD = 256  # the Conversation, its summary list and its LRU entry
+
+
+def estimate_tokens(text: str) -> int:
+    return math.ceil(len(text) / CHARS_PER_TOKEN) + MESSAGE_OVERHEAD_TOKENS
+
+
+def shorten(question: str) -> str:
+    question = ' '.join(question.split())
+    if len(question) > SUMMARY_QUESTION_CHARS:
+        question = question[:SUMMARY_QUESTION_CHARS - 3].rstrip() + '...'
+    return question
+
+
+def summary_text(questions: List[str]) -> str:
+    """One system line listing earlier questions, dropping the oldest past SUMMARY_TOKENS."""
+    start = 0
+    while start < len(questions) - 1 and \
+            estimate_tokens(SUMMARY_PREFIX + '; '.join(questions[start:])) > SUMMARY_TOKENS:
+        start += 1
+    return SUMMARY_PREFIX + '; '.join(questions[start:])
+
+
+class Turn:
+    __slots__ = ('question', 'answer', 'tokens', 'running', 'size')
+
+    def __init__(self, question: str, answer: str, running_before: int):
+        self.question = question
+        self.answer = answer
+        self.tokens = estimate_tokens(question) + estimate_tokens(answer)
+        self.running = running_before + self.tokens  # session total up to and including this turn
+        self.size = sys.getsizeof(question) + sys.getsizeof(answer) + TURN_OVERHEAD
+
+
+class Conversation:
+    """Ring buffer of the most recent turns of one session."""
+
+    __slots__ = ('turns', 'start', 'count', 'running', 'summary', 'last_used', 'size')
+
+    def __init__(self, capacity: int, now: float):
+        self.turns: List[Optional[Turn]] = [None] * capacity
+        self.start = 0  # slot of the oldest turn
+        self.count = 0
+        self.running = 0  # tokens of every turn ever added
+        self.summary: List[str] = []  # shortened questions that have left the ring, oldest first
+        self.last_used = now
+        self.size = CONVERSATION_OVERHEAD + sys.getsizeof(self.turns)
+
+    def _turn(self, position: int) -> Turn:
+        """The turn `position` places after the oldest one."""
+        return self.turns[(self.start + position) % len(self.turns)]
+
+    def add(self, question: str, answer: str) -> int:
+        """Append a turn, overwriting the oldest when full; returns the change in size."""
+        before = self.size
+        turn = Turn(question, answer, self.running)
+        self.running = turn.running
+        if self.count == len(self.turns):
+            oldest = self.turns[self.start]
+            self._summarize(oldest.question)
+            self.size -= oldest.size
+            self.turns[self.start] = turn
+            self.start = (self.start + 1) % len(self.turns)
+        else:
+            self.turns[(self.start + self.count) % len(self.turns)] = turn
+            self.count += 1
+        self.size += turn.size
+        return self.size - before
+
+    def _summarize(self, question: str):
+        question = shorten(question)
+        self.summary.append(question)
+        self.size += sys.getsizeof(question)
+        # Questions summary_text() would drop anyway needn't be kept
+        while len(self.summary) > 1 and \
+                estimate_tokens(SUMMARY_PREFIX + '; '.join(self.summary)) > SUMMARY_TOKENS:
+            self.size -= sys.getsizeof(self.summary.pop(0))
+
+    def _first_within(self, budget: int) -> int:
+        """Position of the oldest turn such that it and every newer one fit in `budget` tokens."""
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            turn = self._turn(middle)
+            if self.running - (turn.running - turn.tokens) <= budget:
+                high = middle
+            else:
+                low = middle + 1
+        return low
+
+    def history(self, budget: int) -> List[Dict[str, str]]:
+        """Chat messages for the newest turns that fit in `budget` tokens, oldest first.
+
+        Older turns are represented by the summary line when it fits too.
+        """
+        first = self._first_within(budget)
+        used = 0
+        if first < self.count:
+            oldest = self._turn(first)
+            used = self.running - (oldest.running - oldest.tokens)
+        messages: List[Dict[str, str]] = []
+        questions = self.summary + [shorten(self._turn(position).question) for position in range(first)]
+        if questions:
+            summary = summary_text(questions)
+            if used + estimate_tokens(summary) <= budget:
+                messages.append({'role': 'system', 'content': summary})
+        for position in range(first, self.count):
+            turn = self._turn(position)
+            messages.append({'role': 'user', 'content': turn.question})
+            messages.append({'role': 'assistant', 'content': turn.answer})
+        return messages
+
+
+class ConversationStore:
+    """Session id -> Conversation, idle-expired and LRU-evicted under a memory cap."""
+
+    def __init__(self, max_turns: int = CONVERSATION_MAX_TURNS, token_budget: int = CONVERSATION_TOKEN_BUDGET,
+                 max_bytes: int = CONVERSATION_MAX_BYTES, idle_seconds: float = CONVERSATION_IDLE_SECONDS):
+        self.max_turns = max(1, max_turns)
+        self.token_budget = token_budget
+        self.max_bytes = max_bytes
+        self.idle_seconds = idle_seconds
+        self._sessions: 'OrderedDict[str, Conversation]' = OrderedDict()
+        self.bytes = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def _get(self, session: str, now: float) -> Optional[Conversation]:
+        conversation = self._sessions.get(session)
+        if conversation is None:
+            return None
+        if now - conversation.last_used > self.idle_seconds:
+            self.forget(session)
+            self.expirations += 1
+            return None
+        self._sessions.move_to_end(session)
+        conversation.last_used = now
+        return conversation
+
+    def history(self, session: str, question: str) -> List[Dict[str, str]]:
+        """Earlier turns to send with `question`, within the per-request token budget."""
+        conversation = self._get(session, time.monotonic())
+        if conversation is None:
+            return []
+        return conversation.history(max(0, self.token_budget - estimate_tokens(question)))
+
+    def record(self, session: str, question: str, answer: str):
+        now = time.monotonic()
+        conversation = self._get(session, now)
+        if conversation is None:
+            conversation = self._sessions[session] = Conversation(self.max_turns, now)
+            self.bytes += conversation.size
+        self.bytes += conversation.add(question, answer)
+        self._expire(now)
+        while self.bytes > self.max_bytes and len(self._sessions) > 1:
+            self.forget(next(iter(self._sessions)))
+            self.evictions += 1
+
+    def _expire(self, now: float):
+        while self._sessions:
+            session, oldest = next(iter(self._sessions.items()))
+            if now - oldest.last_used <= self.idle_seconds:
+                break
+            self.forget(session)
+            self.expirations += 1
+
+    def forget(self, session: str):
+        conversation = self._sessions.pop(session, None)
+        if conversation is not None:
+            self.bytes -= conversation.size
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'sessions': len(self._sessions),
+            'bytes': self.bytes,
+            'max_bytes': self.max_bytes,
+            'max_turns': self.max_turns,
+            'token_budget': self.token_budget,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+        }
@@ -0,0 +1,161 @@
+# app/delivery_zones.py
+"""Delivery-zone index: which businesses deliver to a given point.
+
+Businesses that offer delivery can draw zones at onboarding, either as
+polygons or as a radius around their shop (see DeliveryZone). Zones from
+every such submission are loaded into one shapely STRtree, so a
+point-in-zone lookup only tests the zones whose bounding boxes contain
+the point instead of every polygon. `query_many` pushes a whole array of
+points through the tree in one vectorized call.
+
+Coordinates are (longitude, latitude) in degrees, as in GeoJSON, and
+polygons are tested in that plane, which is plenty for zones a few
+kilometres across. Radius zones are turned into 64-sided polygons whose
+vertices are computed on the sphere, so a 5km radius is 5km in every
+direction at any latitude. Zones crossing the antimeridian aren't
+supported.
+
+The index is built lazily on a worker thread. Saving a submission with
+zones invalidates it in the worker that saved it; other workers pick the
+change up within DELIVERY_ZONE_REFRESH_SECONDS. A lookup that arrives
+while a rebuild is running is answered from the previous index.
+
+shapely and numpy are imported on first use: they are slow to import and
+only needed once someone asks.
+"""
+
+import asyncio
+import logging
+import math
+import os
+import time
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from .storage import unescape_stored
+
+logger = logging.getLogger(__name__)
+
+DELIVERY_ZONE_REFRESH_SECONDS = float(os.getenv('DELIVERY_ZONE_REFRESH_SECONDS', '60'))
+
+EARTH_RADIUS_KM = 6371.0088
+CIRCLE_SEGMENTS = 64
+PAGE_SIZE = 1000
+
+
+def circle(lng: float, lat: float, radius_km: float, segments: int = CIRCLE_SEGMENTS) -> List[Tuple[float, float]]:
+    """Vertices of a polygon approximating a radius around (lng, lat)."""
+    angular = radius_km / EARTH_RADIUS_KM
+    phi1, lambda1 = math.radians(lat), math.radians(lng)
+    vertices = []
+    for step in range(segments):
+        bearing = 2 * math.pi * step / segments
+        phi2 = math.asin(math.sin(phi1) * math.cos(angular) +
+                         math.cos(phi1) * math.sin(angular) * math.cos(bearing))
+        lambda2 = lambda1 + math.atan2(math.sin(bearing) * math.sin(angular) * math.cos(phi1),
+                                       math.cos(angular) - math.sin(phi1) * math.sin(phi2))
+        vertices.append((math.degrees(lambda2), math.degrees(phi2)))
+    return vertices
+
+
+def zone_vertices(zone: Dict[str, Any]) -> List[Tuple[float, float]]:
+    if zone.get('polygon'):
+        return [tuple(vertex) for vertex in zone['polygon']]
+    lng, lat = zone['center']
+    return circle(lng, lat, zone['radius_km'])
+
+
+class DeliveryZoneIndex:
+    """Immutable STRtree over every stored delivery zone."""
+
+    def __init__(self, records: Iterable[Dict[str, Any]]):
+        import shapely
+
+        self.businesses: List[Dict[str, Any]] = []
+        geometries, owners, zone_names = [], [], []
+        for record in records:
+            business = len(self.businesses)
+            self.businesses.append({'business_name': unescape_stored(record['business_name'] or '')})
+            for zone in record.get('delivery_zones') or []:
+                polygon = shapely.Polygon(zone_vertices(zone))
+                if not polygon.is_valid:
+                    polygon = shapely.make_valid(polygon)  # self-intersecting drawings
+                geometries.append(polygon)
+                owners.append(business)
+                zone_names.append(zone.get('name'))
+        self.owners = owners
+        self.zone_names = zone_names
+        self.tree = shapely.STRtree(geometries)
+        self.built_at = time.monotonic()
+
+    def __len__(self) -> int:
+        return len(self.owners)
+
+    def query(self, lng: float, lat: float) -> List[Dict[str, Any]]:
+        """Businesses with a zone containing the point, each with the matching zone names."""
+        import shapely
+
+        matches: Dict[int, Dict[str, Any]] = {}
+        for zone in sorted(self.tree.query(shapely.Point(lng, lat), predicate='intersects')):
+            business = self.owners[zone]
+            match = matches.setdefault(business, {**self.businesses[business], 'zones': []})
+            if self.zone_names[zone]:
+                match['zones'].append(self.zone_names[zone])
+        return list(matches.values())
+
+    def query_many(self, points: Sequence[Tuple[float, float]]) -> List[List[int]]:
+        """For each (lng, lat) point, the indexes into `businesses` that deliver there."""
+        import numpy as np
+        import shapely
+
+        results: List[List[int]] = [[] for _ in points]
+        if not len(points) or not len(self.owners):
+            return results
+        geometries = shapely.points(np.asarray(points, dtype=float))
+        point_indexes, zone_indexes = self.tree.query(geometries, predicate='intersects')
+        owners = np.asarray(self.owners)[zone_indexes]
+        # One row per (point, business), however many of its zones matched
+        for point, business in np.unique(np.column_stack((point_indexes, owners)), axis=0):
+            results[point].append(int(business))
+        return results
+
+
+class DeliveryZones:
+    """The current index, rebuilt from the submission store when it goes stale."""
+
+    def __init__(self, store, refresh_seconds: float = DELIVERY_ZONE_REFRESH_SECONDS):
+        self.store = store
+        self.refresh_seconds = refresh_seconds
+        self._index: Optional[DeliveryZoneIndex] = None
+        self._stale = True
+        self._lock = asyncio.Lock()
+
+    def invalidate(self):
+        self._stale = True
+
+    def _is_current(self) -> bool:
+        return (self._index is not None and not self._stale
+                and time.monotonic() - self._index.built_at < self.refresh_seconds)
+
+    async def index(self) -> DeliveryZoneIndex:
+        if self._is_current() or (self._index is not None and self._lock.locked()):
+            return self._index
+        async with self._lock:
+            if self._is_current():
+                return self._index
+            self._stale = False
+            start = time.perf_counter()
+            try:
+                records, after_id = [], 0
+                while True:
+                    page = await self.store.zones_page(after_id, PAGE_SIZE)
+                    if not page:
+                        break
+                    records.extend(page)
+                    after_id = page[-1]['id']
+                self._index = await asyncio.to_thread(DeliveryZoneIndex, records)
+            except BaseException:
+                self._stale = True
+                raise
+            logger.info("Delivery-zone index built: %s zones for %s businesses in %.1fms",
+                        len(self._index), len(records), (time.perf_counter() - start) * 1000)
+        return self._index
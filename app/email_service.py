@@ -1,13 +1,18 @@
 # app/email_service.py
 
 import os
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
+import threading
+from collections import deque
 from typing import Dict, Any
 import json
 from datetime import datetime
 
+from .circuit_breaker import CircuitBreaker
+
+# send_email() result when SMTP is unavailable and the message was queued for
+# flush_deferred(): not sent yet, but it will be without another send_email()
+DEFERRED = 'deferred'
+
 
 class EmailService:
     def __init__(self):
@@ -21,13 +26,29 @@ class EmailService:
         self.admin_email = os.getenv('ADMIN_EMAIL', 'eliascolon23@gmail.com')
         self.from_email = os.getenv('FROM_EMAIL', 'noreply@aichatflows.com')
         
+        # Never let a slow or unreachable SMTP server hang a request indefinitely
+        self.connect_timeout = float(os.getenv('SMTP_CONNECT_TIMEOUT', '5'))
+        self.read_timeout = float(os.getenv('SMTP_READ_TIMEOUT', '15'))
+        
+        # After N consecutive failures stop trying for a while; messages sent
+        # meanwhile are queued and retried once a probe gets through
+        self.breaker = CircuitBreaker(
+            'smtp',
+            failure_threshold=int(os.getenv('SMTP_BREAKER_THRESHOLD', '3')),
+            reset_timeout=float(os.getenv('SMTP_BREAKER_RESET_SECONDS', '60')),
+        )
+        self.deferred = deque()
+        self.max_deferred = int(os.getenv('SMTP_DEFERRED_MAX', '100'))
+        self._deferred_lock = threading.Lock()
+        
         # Log configuration status
-        logger.info(f"Email Service Configuration:")
-        logger.info(f"  SMTP Server: {self.smtp_server}:{self.smtp_port}")
-        logger.info(f"  From Email: {self.from_email}")
-        logger.info(f"  Admin Email: {self.admin_email}")
-        logger.info(f"  SMTP Username: {'✓ Set' if self.smtp_username else '✗ Missing'}")
-        logger.info(f"  SMTP Password: {'✓ Set' if self.smtp_password else '✗ Missing'}")
+        logger.info("Email Service Configuration:")
+        logger.info("  SMTP Server: %s:%s", self.smtp_server, self.smtp_port)
+        logger.info("  SMTP Timeouts: connect %ss, read %ss", self.connect_timeout, self.read_timeout)
+        logger.info("  From Email: %s", self.from_email)
+        logger.info("  Admin Email: %s", self.admin_email)
+        logger.info("  SMTP Username: %s", '✓ Set' if self.smtp_username else '✗ Missing')
+        logger.info("  SMTP Password: %s", '✓ Set' if self.smtp_password else '✗ Missing')
         
         if not self.smtp_username or not self.smtp_password:
             logger.error("CRITICAL: Email service cannot send emails - SMTP credentials missing!")
@@ -35,17 +56,87 @@ class EmailService:
         else:
             logger.info("Email service ready to send emails")
     
-    def send_email(self, to_email: str, subject: str, html_content: str, text_content: str = None):
-        """Send an email using SMTP"""
+    def _deliver(self, to_email: str, msg):
+        """One SMTP session; raises on any failure"""
+        import smtplib
+        
+        with smtplib.SMTP(self.smtp_server, self.smtp_port, timeout=self.connect_timeout) as server:
+            # The connect timeout covered the TCP handshake; allow longer for the exchange
+            server.sock.settimeout(self.read_timeout)
+            server.starttls()
+            server.login(self.smtp_username, self.smtp_password)
+            server.send_message(msg)
+    
+    def _defer(self, to_email: str, msg, reason: str):
+        import logging
+        logger = logging.getLogger(__name__)
+        
+        with self._deferred_lock:
+            if len(self.deferred) >= self.max_deferred:
+                dropped_to, _ = self.deferred.popleft()
+                logger.error("Deferred email queue full - dropped oldest message to %s", dropped_to)
+            self.deferred.append((to_email, msg))
+            queued = len(self.deferred)
+        logger.warning("%s - deferred email to %s (%s queued)", reason, to_email, queued)
+    
+    def flush_deferred(self) -> int:
+        """Retry deferred emails while the breaker allows it; returns how many were sent"""
         import logging
         logger = logging.getLogger(__name__)
         
+        sent = 0
+        while True:
+            with self._deferred_lock:
+                if not self.deferred:
+                    break
+                if not self.breaker.allow():
+                    break
+                to_email, msg = self.deferred.popleft()
+            try:
+                self._deliver(to_email, msg)
+            except Exception as e:
+                self.breaker.record_failure(e)
+                with self._deferred_lock:
+                    self.deferred.appendleft((to_email, msg))
+                logger.warning("Deferred email retry failed, SMTP still unavailable: %s", e)
+                break
+            self.breaker.record_success()
+            sent += 1
+        if sent:
+            logger.info("Sent %s deferred emails", sent)
+        return sent
+    
+    def status(self) -> Dict[str, Any]:
+        """Breaker state and queue depth for diagnostics"""
+        return {
+            "connect_timeout_seconds": self.connect_timeout,
+            "read_timeout_seconds": self.read_timeout,
+            "circuit_breaker": self.breaker.snapshot(),
+            "deferred_emails": len(self.deferred),
+        }
+    
+    def send_email(self, to_email: str, subject: str, html_content: str, text_content: str = None,
+                   defer: bool = True):
+        """Send an email using SMTP
+        
+        Returns True once sent, DEFERRED if SMTP is unavailable and the message
+        was queued for a later retry, and False otherwise. With defer=False
+        nothing is ever queued.
+        """
+        import logging
+        # smtplib pulls in ssl and the email package; defer until the first send
+        import smtplib
+        import socket
+        from email.mime.text import MIMEText
+        from email.mime.multipart import MIMEMultipart
+        logger = logging.getLogger(__name__)
+        
         if not self.smtp_username or not self.smtp_password:
             logger.warning("Email credentials not configured. Skipping email send.")
             return False
         
         try:
-            logger.info(f"Preparing to send email to {to_email} with subject: {subject}")
+            logger.info("Preparing to send email to %s with subject: %s", to_email, subject)
             
             msg = MIMEMultipart('alternative')
             msg['From'] = self.from_email
@@ -60,25 +151,41 @@ class EmailService:
             # Add HTML part
             html_part = MIMEText(html_content, 'html')
             msg.attach(html_part)
-            
-            # Send email
-            logger.info(f"Connecting to SMTP server {self.smtp_server}:{self.smtp_port}")
-            with smtplib.SMTP(self.smtp_server, self.smtp_port) as server:
-                server.starttls()
-                server.login(self.smtp_username, self.smtp_password)
-                server.send_message(msg)
-            
-            logger.info(f"Email sent successfully to {to_email}")
-            return True
         except Exception as e:
-            logger.error(f"Error sending email to {to_email}: {str(e)}")
+            logger.error("Error building email to %s: %s", to_email, e)
             return False
+        
+        # Fail fast while the SMTP server is known to be down
+        if not self.breaker.allow():
+            if not defer:
+                logger.warning("SMTP circuit open - not sending email to %s", to_email)
+                return False
+            self._defer(to_email, msg, "SMTP circuit open")
+            return DEFERRED
+        
+        try:
+            logger.info("Connecting to SMTP server %s:%s", self.smtp_server, self.smtp_port)
+            self._deliver(to_email, msg)
+        except Exception as e:
+            logger.error("Error sending email to %s: %s", to_email, e)
+            if self.breaker.record_failure(e):
+                logger.error("SMTP circuit opened after %s consecutive failures", self.breaker.failure_threshold)
+            if defer and isinstance(e, (ConnectionError, TimeoutError, smtplib.SMTPConnectError,
+                                        smtplib.SMTPServerDisconnected, socket.gaierror)):
+                # Connection trouble or a timeout: keep the message for a retry
+                self._defer(to_email, msg, "SMTP unreachable")
+                return DEFERRED
+            return False
+        
+        self.breaker.record_success()
+        logger.info("Email sent successfully to %s", to_email)
+        return True
     
     def send_user_confirmation(self, user_email: str, form_data: Dict[str, Any]):
         """Send confirmation email to the user after form submission"""
         import logging
         logger = logging.getLogger(__name__)
-        logger.info(f"Sending user confirmation email to {user_email} for business: {form_data.get('business_name')}")
+        logger.info("Sending user confirmation email to %s for business: %s", user_email, form_data.get('business_name'))
         
         subject = "Welcome to AIChatFlows – Your Setup Has Begun"
         
@@ -155,7 +262,7 @@ class EmailService:
         """Send notification email to admin with all form details"""
         import logging
         logger = logging.getLogger(__name__)
-        logger.info(f"Sending admin notification email for new signup: {form_data.get('business_name')} ({form_data.get('plan')} Plan)")
+        logger.info("Sending admin notification email for new signup: %s (%s Plan)", form_data.get('business_name'), form_data.get('plan'))
         
         subject = f"🚀 New Signup Submitted on AIChatFlows - {form_data.get('business_name')}"
         
@@ -595,13 +702,14 @@ class EmailService:
         The AIChatFlows Team
         """
         
-        return self.send_email(user_email, subject, html_content, text_content)
+        # Never queued: the deferred queue would hold passwords in memory
+        return self.send_email(user_email, subject, html_content, text_content, defer=False)
     
     def send_payment_confirmation(self, user_email: str, business_name: str, plan: str):
         """Send final payment confirmation email to user after successful payment"""
         import logging
         logger = logging.getLogger(__name__)
-        logger.info(f"Sending payment confirmation email to {user_email} for business: {business_name} ({plan} Plan)")
+        logger.info("Sending payment confirmation email to %s for business: %s (%s Plan)", user_email, business_name, plan)
         
         subject = "🎉 You're all set – Welcome to AI Chat Flows"
         
@@ -693,13 +801,14 @@ class EmailService:
         The AIChatFlows Team
         """
         
-        return self.send_email(user_email, subject, html_content, text_content)
+        # Never queued: the webhook answers 500 instead, and Stripe's retries outlive this process
+        return self.send_email(user_email, subject, html_content, text_content, defer=False)
     
     def send_admin_payment_confirmation(self, business_name: str, plan: str, user_email: str):
         """Send admin notification that form + payment were both completed"""
         import logging
         logger = logging.getLogger(__name__)
-        logger.info(f"Sending admin payment confirmation for completed client: {business_name} ({plan} Plan) - {user_email}")
+        logger.info("Sending admin payment confirmation for completed client: %s (%s Plan) - %s", business_name, plan, user_email)
         
         subject = "✅ New Client Submission + Payment Completed"
         
@@ -799,4 +908,4 @@ class EmailService:
         This client is now a confirmed, paying customer and should be prioritized for setup.
         """
         
-        return self.send_email(self.admin_email, subject, html_content, text_content)
\ No newline at end of file
+        return self.send_email(self.admin_email, subject, html_content, text_content, defer=False)
\ No newline at end of file
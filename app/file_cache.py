@@ -0,0 +1,151 @@
+# app/file_cache.py
+"""Hot-file cache for /api/files.
+
+Admin notification emails embed uploaded menu images by URL, so the same
+handful of files is fetched over and over by mail clients. The cache
+keeps, per requested path, what serving it needs: the resolved and
+access-checked path, MIME type, size, ETag and Last-Modified, and for
+files up to FILE_CACHE_MAX_FILE_SIZE the bytes themselves. Cached bodies
+are bounded by FILE_CACHE_MAX_BYTES in LRU order; metadata entries by
+MAX_ENTRIES.
+
+Every request still does one os.stat(). If the file's inode, size or
+mtime has changed (replaced, rewritten, touched by the upload GC or the
+dedupe lookup) the entry is dropped and reloaded, and a deleted file
+drops its entry and 404s. Larger files are not held in memory; they are
+served by FileResponse, which streams in chunks and hands the file to
+the server for zero-copy sendfile on servers that offer the ASGI
+pathsend extension.
+"""
+
+import mimetypes
+import os
+import stat as stat_module
+from collections import OrderedDict
+from dataclasses import dataclass
+from email.utils import formatdate
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+
+FILE_CACHE_MAX_BYTES = int(os.getenv('FILE_CACHE_MAX_BYTES', str(32 * 1024 * 1024)))
+FILE_CACHE_MAX_FILE_SIZE = int(os.getenv('FILE_CACHE_MAX_FILE_SIZE', str(256 * 1024)))
+MAX_ENTRIES = 4096
+
+
+@dataclass
+class CachedFile:
+    path: Path
+    identity: Tuple[int, int, int]  # (st_ino, st_size, st_mtime_ns)
+    size: int
+    media_type: str
+    etag: str
+    last_modified: str
+    body: Optional[bytes] = None
+
+
+def file_identity(stat_result: os.stat_result) -> Tuple[int, int, int]:
+    return stat_result.st_ino, stat_result.st_size, stat_result.st_mtime_ns
+
+
+class HotFileCache:
+    """LRU of file metadata, plus the bytes of small files, bounded by total size."""
+
+    def __init__(self, root: Path, max_bytes: int = FILE_CACHE_MAX_BYTES,
+                 max_file_size: int = FILE_CACHE_MAX_FILE_SIZE, max_entries: int = MAX_ENTRIES):
+        self.root = Path(root).resolve()
+        self.max_bytes = max_bytes
+        self.max_file_size = min(max_file_size, max_bytes)
+        self.max_entries = max_entries
+        self._entries: 'OrderedDict[Tuple[str, str], CachedFile]' = OrderedDict()
+        self.cached_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.evictions = 0
+
+    def lookup(self, business_name: str, filename: str) -> Tuple[Optional[CachedFile], Optional[os.stat_result]]:
+        """Cached entry if still current, plus the fresh stat; (None, None) if the file is gone."""
+        key = (business_name, filename)
+        entry = self._entries.get(key)
+        path = entry.path if entry is not None else self.root / business_name / filename
+        try:
+            stat_result = os.stat(path)
+        except (FileNotFoundError, NotADirectoryError):
+            if entry is not None:
+                self._drop(key)
+                self.invalidations += 1
+            return None, None
+        if entry is not None:
+            if entry.identity == file_identity(stat_result):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry, stat_result
+            self._drop(key)
+            self.invalidations += 1
+        self.misses += 1
+        return None, stat_result
+
+    def resolve(self, business_name: str, filename: str) -> Optional[Path]:
+        """Resolved path of a requested file, or None if it points outside the uploads root."""
+        path = (self.root / business_name / filename).resolve()
+        if not path.is_relative_to(self.root):
+            return None
+        return path
+
+    def load(self, business_name: str, filename: str, path: Path, stat_result: os.stat_result) -> CachedFile:
+        """Build an entry for a cache miss (blocking I/O: call from a worker thread)."""
+        media_type, _ = mimetypes.guess_type(path.name)
+        body = None
+        if stat_result.st_size <= self.max_file_size:
+            with open(path, 'rb') as f:
+                stat_result = os.fstat(f.fileno())  # describe exactly what was read
+                body = f.read()
+        return CachedFile(
+            path=path,
+            identity=file_identity(stat_result),
+            size=stat_result.st_size if body is None else len(body),
+            media_type=media_type or 'application/octet-stream',
+            etag=f'"{stat_result.st_mtime_ns:x}-{stat_result.st_size:x}"',
+            last_modified=formatdate(stat_result.st_mtime, usegmt=True),
+            body=body,
+        )
+
+    def store(self, business_name: str, filename: str, entry: CachedFile):
+        key = (business_name, filename)
+        if key in self._entries:
+            self._drop(key)
+        self._entries[key] = entry
+        if entry.body is not None:
+            self.cached_bytes += len(entry.body)
+        while self._entries and (self.cached_bytes > self.max_bytes or len(self._entries) > self.max_entries):
+            oldest = next(iter(self._entries))
+            self._drop(oldest)
+            self.evictions += 1
+
+    def _drop(self, key: Tuple[str, str]):
+        entry = self._entries.pop(key, None)
+        if entry is not None and entry.body is not None:
+            self.cached_bytes -= len(entry.body)
+
+    def clear(self):
+        self._entries.clear()
+        self.cached_bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'cached_files': sum(1 for entry in self._entries.values() if entry.body is not None),
+            'cached_bytes': self.cached_bytes,
+            'max_bytes': self.max_bytes,
+            'max_file_size': self.max_file_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+            'invalidations': self.invalidations,
+            'evictions': self.evictions,
+        }
+
+
+def is_regular_file(stat_result: os.stat_result) -> bool:
+    return stat_module.S_ISREG(stat_result.st_mode)
@@ -0,0 +1,141 @@
+# app/logging_config.py
+"""Structured, non-blocking logging.
+
+Request handlers only hand records to an in-memory queue; a background
+QueueListener thread does the formatting (including tracebacks) and the
+stream I/O. Records are emitted as one JSON object per line by default
+(LOG_FORMAT=json) or in the classic text format (LOG_FORMAT=text).
+"""
+
+import atexit
+import copy
+import json
+import logging
+import os
+import queue
+import random
+import threading
+from contextvars import ContextVar
+from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener
+from typing import Optional
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+# Fraction of requests whose full (masked) payload is logged
+PAYLOAD_LOG_SAMPLE_RATE = float(os.getenv('PAYLOAD_LOG_SAMPLE_RATE', '0.05'))
+
+# Request ID of the request currently being handled, attached to every record
+request_id_var: ContextVar[Optional[str]] = ContextVar('request_id', default=None)
+
+_listener: Optional[QueueListener] = None
+
+
+class JsonFormatter(logging.Formatter):
+    """Format records as single-line JSON objects."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'timestamp': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        request_id = getattr(record, 'request_id', None)
+        if request_id:
+            entry['request_id'] = request_id
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        if record.stack_info:
+            entry['stack'] = self.formatStack(record.stack_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class RequestContextFilter(logging.Filter):
+    """Copy the current request ID onto the record in the calling task."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = request_id_var.get()
+        return True
+
+
+class DeferredQueueHandler(QueueHandler):
+    """QueueHandler that leaves formatting to the listener thread.
+
+    The stock QueueHandler.prepare() runs the formatter (and renders any
+    traceback) on the calling thread. Here only the message arguments are
+    merged, so later mutation of the arguments can't change the record, and
+    exc_info travels to the listener to be formatted there.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+def setup_logging() -> QueueListener:
+    """Route all logging through a background queue listener (idempotent)."""
+    global _listener
+    if _listener is not None:
+        return _listener
+
+    level = getattr(logging, os.getenv('LOG_LEVEL', 'INFO').upper(), logging.INFO)
+    log_format = os.getenv('LOG_FORMAT', 'json').lower()
+
+    stream_handler = logging.StreamHandler()
+    if log_format == 'text':
+        stream_handler.setFormatter(logging.Formatter(TEXT_FORMAT))
+    else:
+        stream_handler.setFormatter(JsonFormatter())
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = DeferredQueueHandler(log_queue)
+    queue_handler.addFilter(RequestContextFilter())
+
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+
+    _listener = QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(shutdown_logging)
+    os.register_at_fork(after_in_child=_restart_after_fork)
+    return _listener
+
+
+def _restart_after_fork():
+    """The listener thread doesn't survive fork(); give the child its own queue and thread."""
+    if _listener is None:
+        return
+    log_queue = queue.SimpleQueue()
+    for handler in logging.getLogger().handlers:
+        if isinstance(handler, QueueHandler):
+            handler.queue = log_queue
+    _listener.queue = log_queue
+    _listener._thread = None
+    _listener.start()
+
+
+def listener_thread() -> Optional[threading.Thread]:
+    return getattr(_listener, '_thread', None)
+
+
+def shutdown_logging():
+    """Flush queued records and stop the listener thread."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def should_log_payload(rate: Optional[float] = None) -> bool:
+    """Decide whether this request's verbose payload log should be written."""
+    if rate is None:
+        rate = PAYLOAD_LOG_SAMPLE_RATE
+    if rate >= 1.0:
+        return True
+    return rate > 0 and random.random() < rate
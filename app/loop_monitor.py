@@ -0,0 +1,143 @@
+# app/loop_monitor.py
+"""Event-loop lag and blocking detector.
+
+A heartbeat coroutine wakes every `interval` seconds and records how late
+it was (event-loop lag) into a histogram. A watchdog thread watches the
+heartbeat: when the loop has not ticked for longer than `threshold`, some
+callback is blocking it, so the watchdog grabs the loop thread's current
+stack with sys._current_frames(), works out which route's handler is on
+it, and logs the stack once per stall. When the loop recovers, the total
+stall is recorded per route:
+
+    aichatflows_event_loop_lag_seconds{loop="main"}
+    aichatflows_event_loop_block_seconds{route="/api/submit-onboarding"}
+
+Cost is one timer callback per interval on the loop plus one thread that
+sleeps between checks, so it is left on in production.
+"""
+
+import asyncio
+import inspect
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from types import CodeType, FrameType
+from typing import Dict, Iterable, Optional
+
+from .metrics import METRIC_PREFIX, registry
+
+logger = logging.getLogger(__name__)
+
+LOOP_LAG_METRIC = f'{METRIC_PREFIX}_event_loop_lag_seconds'
+LOOP_BLOCK_METRIC = f'{METRIC_PREFIX}_event_loop_block_seconds'
+
+LOOP_MONITOR_INTERVAL = float(os.getenv('LOOP_MONITOR_INTERVAL_MS', '50')) / 1000
+LOOP_BLOCK_THRESHOLD = float(os.getenv('LOOP_BLOCK_THRESHOLD_MS', '100')) / 1000
+
+MAX_STACK_DEPTH = 30
+
+
+def route_code_map(routes: Iterable) -> Dict[CodeType, str]:
+    """Map each endpoint function's code object to its route path.
+
+    Decorators such as the rate limiter wrap endpoints with functools.wraps,
+    so unwrap to the function whose frame actually shows up in a stack.
+    """
+    codes = {}
+    for route in routes:
+        endpoint = getattr(route, 'endpoint', None)
+        path = getattr(route, 'path', None)
+        if endpoint is None or path is None:
+            continue
+        code = getattr(inspect.unwrap(endpoint), '__code__', None)
+        if code is not None:
+            codes[code] = path
+    return codes
+
+
+class LoopMonitor:
+    """Heartbeat on the event loop plus a watchdog thread that catches it blocked."""
+
+    def __init__(self, interval: float = LOOP_MONITOR_INTERVAL, threshold: float = LOOP_BLOCK_THRESHOLD,
+                 route_codes: Optional[Dict[CodeType, str]] = None):
+        self.interval = interval
+        self.threshold = threshold
+        self.route_codes = route_codes or {}
+        self.lag_histogram = registry.histogram(LOOP_LAG_METRIC, 'main', label_name='loop',
+                                                help_text='Event loop scheduling lag')
+        self.blocks = 0
+        self._last_tick = time.perf_counter()
+        self._loop_thread_id: Optional[int] = None
+        self._stall_route: Optional[str] = None
+        self._stall_reported = False
+        self._stop = threading.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        """Start monitoring the running loop (call from a startup hook)."""
+        self._loop_thread_id = threading.get_ident()
+        self._last_tick = time.perf_counter()
+        self._task = asyncio.get_running_loop().create_task(self._heartbeat())
+        self._thread = threading.Thread(target=self._watchdog, name='loop-watchdog', daemon=True)
+        self._thread.start()
+        logger.info("Event loop monitor started (interval %.0fms, threshold %.0fms)",
+                    self.interval * 1000, self.threshold * 1000)
+
+    def stop(self):
+        self._stop.set()
+        if self._task is not None:
+            self._task.cancel()
+
+    async def _heartbeat(self):
+        while True:
+            expected = time.perf_counter() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.perf_counter()
+            lag = max(0.0, now - expected)
+            self.lag_histogram.observe(lag)
+            if lag > self.threshold:
+                self._record_block(lag)
+            self._last_tick = now
+
+    def _record_block(self, duration: float):
+        route = self._stall_route or 'unknown'
+        self.blocks += 1
+        registry.histogram(LOOP_BLOCK_METRIC, route, label_name='route',
+                           help_text='Time the event loop was blocked, by route').observe(duration)
+        if self._stall_reported:
+            logger.warning("Event loop was blocked for %.0fms in %s", duration * 1000, route)
+        self._stall_route = None
+        self._stall_reported = False
+
+    def _watchdog(self):
+        while not self._stop.wait(self.interval):
+            stalled = time.perf_counter() - self._last_tick - self.interval
+            if stalled > self.threshold and not self._stall_reported:
+                self._stall_reported = True
+                self._report_stall(stalled)
+
+    def _report_stall(self, stalled: float):
+        frame = sys._current_frames().get(self._loop_thread_id)
+        if frame is None:
+            return
+        self._stall_route = self.route_for(frame)
+        stack = ''.join(traceback.format_stack(frame, limit=MAX_STACK_DEPTH))
+        record = logger.makeRecord(
+            logger.name, logging.WARNING, __file__, 0,
+            "Event loop blocked for over %.0fms in %s", (stalled * 1000, self._stall_route or 'unknown'),
+            None, sinfo=f"Blocking stack (most recent call last):\n{stack.rstrip()}",
+        )
+        logger.handle(record)
+
+    def route_for(self, frame: Optional[FrameType]) -> Optional[str]:
+        """Route whose handler is on the stack, innermost first."""
+        while frame is not None:
+            route = self.route_codes.get(frame.f_code)
+            if route is not None:
+                return route
+            frame = frame.f_back
+        return None
@@ -1,26 +1,33 @@
 # app/main.py
 
+import time
+_MODULE_LOAD_START = time.perf_counter()
+
 from dotenv import load_dotenv
 load_dotenv()
 
+# TRACEMALLOC_FRAMES=<n> traces allocations from here on, app imports included
+from .memory_profile import TRACEMALLOC_FRAMES, start as start_tracemalloc
+if TRACEMALLOC_FRAMES > 0:
+    start_tracemalloc(TRACEMALLOC_FRAMES)
+
 import os
-import json
+import asyncio
 import html
 import logging
 import uuid
-import traceback
 import re
-import shutil
+import hashlib
 import mimetypes
 from pathlib import Path
 from datetime import datetime
-from typing import Dict, Any, Optional, List
-import bleach
-from fastapi import FastAPI, Request, HTTPException, UploadFile, File, Form
+from email.utils import formatdate
+from typing import Dict, Any, Optional, List, Tuple
+from fastapi import FastAPI, Request, HTTPException, UploadFile, File, Form, Query
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.middleware.trustedhost import TrustedHostMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import HTMLResponse, JSONResponse, FileResponse
+from fastapi.responses import HTMLResponse, JSONResponse, FileResponse, PlainTextResponse
 from fastapi.templating import Jinja2Templates
 from fastapi.security import HTTPBearer
 from starlette.middleware.base import BaseHTTPMiddleware
@@ -29,36 +36,59 @@ from slowapi import Limiter, _rate_limit_exceeded_handler
 from slowapi.util import get_remote_address
 from slowapi.errors import RateLimitExceeded
 from pydantic import ValidationError
-from .models import OnboardingForm, OnboardingResponse
-from .email_service import EmailService
-
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+from .models import OnboardingForm, OnboardingResponse, UploadLookupRequest, DeliversToBulkRequest
+from .email_service import DEFERRED, EmailService
+from .logging_config import setup_logging, should_log_payload, request_id_var
+from .storage import SubmissionStore, default_db_path, submission_key, unescape_stored
+from .admin import router as admin_router
+from .uploads import (
+    UPLOADS_DIR, MAX_FILE_SIZE, BASE_URL, ALLOWED_EXTENSIONS, ALLOWED_MIME_TYPES,
+    ATTACHMENT_FIELDS, ATTACHMENT_PLACEHOLDER, business_dir_name, file_url,
+    validate_file_metadata, ingest_multipart, path_for_url,
+)
+from .upload_gc import UploadCollector
+from .profiling import profile_request
+from .loop_monitor import LoopMonitor, LOOP_BLOCK_THRESHOLD, route_code_map
+from .admission import ADMISSION_CONTROL, AdmissionController, AdmissionControlMiddleware
+from .compression import RESPONSE_COMPRESSION, CompressionMiddleware
+from .file_cache import HotFileCache, is_regular_file
+from .delivery_zones import DeliveryZones
+from .text_extraction import TextExtractor
+from .stripe_webhook import (
+    MAX_PAYLOAD_SIZE as MAX_WEBHOOK_PAYLOAD, PAYMENT_EVENTS, SignatureVerificationError,
+    checkout_details, parse_event, verify_signature, webhook_secret,
 )
+from .resumable import (
+    ResumableUploadStore, TUS_VERSION, TUS_EXTENSIONS, parse_upload_metadata, parse_checksum,
+)
+from .metrics import span, observe_request, start_request_timing, format_timings, render_prometheus
+
+# Configure logging (JSON lines written by a background queue listener)
+setup_logging()
 logger = logging.getLogger(__name__)
 
 # Get the parent directory (ai-coffee root)
 BASE_DIR = Path(__file__).parent.parent
 
-# File upload configuration
-UPLOADS_DIR = BASE_DIR / "uploads"
-UPLOADS_DIR.mkdir(exist_ok=True)
-MAX_FILE_SIZE = 10 * 1024 * 1024  # 10MB
-
-# Base URL for generating absolute file URLs
-BASE_URL = os.getenv('BASE_URL', 'https://aichatflows.com')
-ALLOWED_EXTENSIONS = {
-    'image': {'.jpg', '.jpeg', '.png', '.gif', '.webp'},
-    'document': {'.pdf', '.doc', '.docx', '.txt', '.rtf'},
-}
-ALLOWED_MIME_TYPES = {
-    'image/jpeg', 'image/png', 'image/gif', 'image/webp',
-    'application/pdf', 'application/msword', 
-    'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
-    'text/plain', 'application/rtf'
-}
+# Submission storage (SQLite, WAL mode) - connects lazily on first use
+submission_store = SubmissionStore(default_db_path())
+
+# Partial uploads for the resumable (tus-style) upload protocol
+resumable_uploads = ResumableUploadStore()
+RESUMABLE_EXPIRY_INTERVAL = 15 * 60  # seconds between sweeps for abandoned uploads
+
+# Deletes uploaded files no submission references (after ORPHAN_UPLOAD_GRACE)
+upload_collector = UploadCollector(submission_store)
+
+# Metadata of recently served uploads, plus the bytes of small hot files
+file_cache = HotFileCache(UPLOADS_DIR)
+
+# STRtree over the delivery zones businesses drew at onboarding, built on first lookup
+delivery_zones = DeliveryZones(submission_store)
+
+# Text from submitted PDF/DOCX/RTF/TXT attachments, extracted in a process pool
+text_extractor = TextExtractor()
+UPLOAD_GC_INTERVAL = int(os.getenv('UPLOAD_GC_INTERVAL', '3600'))  # 0 disables
 
 app = FastAPI(
     title="AIChatFlows API",
@@ -68,21 +98,27 @@ app = FastAPI(
     redoc_url=None  # Disable redoc in production
 )
 
+class InstrumentedLimiter(Limiter):
+    """Limiter that records the cost of each rate-limit check as a span"""
+    def _check_request_limit(self, *args, **kwargs):
+        with span("rate_limit_check"):
+            return super()._check_request_limit(*args, **kwargs)
+
 # Rate limiting configuration with fallback
 try:
     # Try to use Redis if available, otherwise fall back to in-memory
     redis_url = os.getenv("REDIS_URL") or os.getenv("RATE_LIMIT_STORAGE_URL")
     if redis_url:
-        limiter = Limiter(key_func=get_remote_address, storage_uri=redis_url)
+        limiter = InstrumentedLimiter(key_func=get_remote_address, storage_uri=redis_url)
         logger.info("Rate limiting initialized with Redis backend")
     else:
-        limiter = Limiter(key_func=get_remote_address)
+        limiter = InstrumentedLimiter(key_func=get_remote_address)
         logger.warning("Rate limiting initialized with in-memory backend")
     
     app.state.limiter = limiter
     app.add_exception_handler(RateLimitExceeded, _rate_limit_exceeded_handler)
 except Exception as e:
-    logger.error(f"Failed to initialize rate limiter: {e}")
+    logger.error("Failed to initialize rate limiter: %s", e)
     # Create a dummy limiter that doesn't actually limit to prevent crashes
     class DummyLimiter:
         def limit(self, *args, **kwargs):
@@ -128,11 +164,37 @@ class SecurityHeadersMiddleware(BaseHTTPMiddleware):
         
         return response
 
+# Request timing middleware - end-to-end latency per route for /metrics
+class RequestTimingMiddleware(BaseHTTPMiddleware):
+    async def dispatch(self, request: Request, call_next):
+        start = time.perf_counter()
+        response: Response = await call_next(request)
+        
+        # The router stores the matched route in the shared scope
+        route = request.scope.get("route")
+        observe_request(getattr(route, "path", "unmatched"), time.perf_counter() - start)
+        
+        return response
+
+class InstrumentedTemplates(Jinja2Templates):
+    """Jinja2Templates that times each render (TemplateResponse renders eagerly)"""
+    def TemplateResponse(self, *args, **kwargs):
+        name = kwargs.get("name") or next((arg for arg in args if isinstance(arg, str)), "unknown")
+        with span(f"template_render.{name}"):
+            return super().TemplateResponse(*args, **kwargs)
+
+# Admin API (submission search/export) - shares the submission store via app.state
+app.state.submission_store = submission_store
+app.state.file_cache = file_cache
+app.state.delivery_zones = delivery_zones
+app.state.text_extractor = text_extractor
+app.include_router(admin_router)
+
 # 2) Serve static assets from ./static
 app.mount("/static", StaticFiles(directory=str(BASE_DIR / "static")), name="static")
 
 # 3) Tell FastAPI where to find templates
-templates = Jinja2Templates(directory=str(BASE_DIR / "templates"))
+templates = InstrumentedTemplates(directory=str(BASE_DIR / "templates"))
 
 # 4) Root route → landing page
 @app.get("/", response_class=HTMLResponse)
@@ -171,6 +233,8 @@ async def test_email(request: Request):
             "smtp_server": os.getenv('SMTP_SERVER', 'smtp.gmail.com'),
             "smtp_port": os.getenv('SMTP_PORT', '587')
         }
+        if hasattr(email_service, 'status'):
+            status.update(email_service.status())
         
         return JSONResponse(content={
             "email_configuration": status,
@@ -182,192 +246,172 @@ async def test_email(request: Request):
             "message": "Email service configuration error"
         }, status_code=500)
 
-# Thank you page route
-@app.get("/thank-you", response_class=HTMLResponse)
-@limiter.limit("5/minute")  # Rate limit: 5 requests per minute for thank you page
-async def thank_you(request: Request):
-    # Generate unique request ID for tracking
-    request_id = str(uuid.uuid4())[:8]
-    start_time = datetime.now()
-    logger.info(f"[{request_id}] Thank you page accessed from IP: {request.client.host if request.client else 'unknown'}")
+# Metrics endpoint (Prometheus text format)
+@app.get("/metrics")
+async def metrics(request: Request):
+    """Expose per-stage and per-route latency histograms"""
+    # Optional bearer token so latency data isn't public
+    metrics_token = os.getenv("METRICS_TOKEN")
+    if metrics_token and request.headers.get("Authorization") != f"Bearer {metrics_token}":
+        raise HTTPException(status_code=401, detail="Unauthorized")
     
-    # Initialize variables for safe access
-    submission_data = None
-    business_name = "Valued Customer"
-    plan = "Unknown"
-    user_email = None
+    return PlainTextResponse(render_prometheus(), media_type="text/plain; version=0.0.4")
+
+# One-off emails sent per submission once Stripe reports the payment (see the email ledger in storage)
+PAYMENT_EMAIL_KINDS = ('payment_confirmation', 'admin_payment_confirmation')
+
+async def send_once(ledger_key: str, email_kind: str, request_id: str, send, *args):
+    """Send a one-off email unless the ledger says it already went out
     
+    Returns True if it was sent (now or earlier) and False otherwise. A
+    DEFERRED result counts as not sent: the in-memory queue dies with the
+    worker, so the claim is released and the webhook's retry sends it.
+    """
     try:
-        # Safely get the most recent submission from the submissions directory
-        submissions_dir = BASE_DIR / "submissions"
-        
-        # Check if submissions directory exists and is accessible
-        try:
-            if not submissions_dir.exists():
-                logger.warning(f"[{request_id}] Submissions directory does not exist at {submissions_dir}")
-                raise FileNotFoundError("Submissions directory not found")
-            
-            if not submissions_dir.is_dir():
-                logger.error(f"[{request_id}] Submissions path exists but is not a directory")
-                raise OSError("Submissions path is not a directory")
-                
-        except (OSError, PermissionError) as e:
-            logger.error(f"[{request_id}] Cannot access submissions directory: {str(e)}")
-            logger.error(f"[{request_id}] Directory access traceback: {traceback.format_exc()}")
-            # Continue to render page without email functionality
-            return templates.TemplateResponse("thank-you.html", {"request": request})
-        
-        # Safely find and load the most recent submission file
-        try:
-            # Get all submission files with error handling
-            submission_files = []
-            try:
-                submission_files = list(submissions_dir.glob("submission_*.json"))
-            except (OSError, PermissionError) as e:
-                logger.error(f"[{request_id}] Error listing submission files: {str(e)}")
-                raise
-            
-            if not submission_files:
-                logger.warning(f"[{request_id}] No submission files found in {submissions_dir}")
-                # Render page without triggering emails
-                return templates.TemplateResponse("thank-you.html", {"request": request})
-            
-            logger.info(f"[{request_id}] Found {len(submission_files)} submission files")
-            
-            # Safely get the most recent file by modification time with validation
-            try:
-                latest_file = max(submission_files, key=lambda f: f.stat().st_mtime)
-                
-                # Validate the selected file
-                if not latest_file.exists():
-                    logger.error(f"[{request_id}] Latest file {latest_file} no longer exists")
-                    raise FileNotFoundError("Latest submission file missing")
-                    
-                if not latest_file.is_file():
-                    logger.error(f"[{request_id}] Latest path {latest_file} is not a file")
-                    raise OSError("Latest submission path is not a file")
-                    
-                # Check file size (prevent loading huge files)
-                file_size = latest_file.stat().st_size
-                if file_size > 1024 * 1024:  # 1MB limit
-                    logger.error(f"[{request_id}] Submission file too large: {file_size} bytes")
-                    raise ValueError("Submission file too large")
-                    
-                if file_size == 0:
-                    logger.warning(f"[{request_id}] Submission file is empty")
-                    raise ValueError("Submission file is empty")
-                    
-                logger.info(f"[{request_id}] Selected latest submission: {latest_file.name} ({file_size} bytes)")
-                
-            except (OSError, ValueError, PermissionError) as e:
-                logger.error(f"[{request_id}] Error selecting latest file: {str(e)}")
-                logger.error(f"[{request_id}] File selection traceback: {traceback.format_exc()}")
-                return templates.TemplateResponse("thank-you.html", {"request": request})
-            
-        except Exception as e:
-            logger.error(f"[{request_id}] Unexpected error during file discovery: {str(e)}")
-            logger.error(f"[{request_id}] File discovery traceback: {traceback.format_exc()}")
-            return templates.TemplateResponse("thank-you.html", {"request": request})
+        if not await submission_store.claim(ledger_key, email_kind):
+            logger.info("[%s] %s already sent for %s - skipping", request_id, email_kind, ledger_key)
+            return True
+    except Exception as e:
+        logger.error("[%s] Email ledger unavailable, not sending %s: %s", request_id, email_kind, e)
+        return False
+    
+    sent = False
+    try:
+        logger.info("[%s] Attempting to send %s", request_id, email_kind)
+        with span(f"smtp.{email_kind}"):
+            sent = await asyncio.to_thread(send, *args)
         
-        # Safely read and parse the submission data
+        if sent is DEFERRED:
+            logger.warning("[%s] %s email was queued, not sent - leaving it to the webhook retry", request_id, email_kind)
+            sent = False
+        elif sent:
+            logger.info("[%s] %s email sent successfully", request_id, email_kind)
+        else:
+            logger.warning("[%s] %s email failed - service returned False", request_id, email_kind)
+    except Exception as e:
+        logger.error("[%s] Failed to send %s email: %s", request_id, email_kind, e)
+        logger.error("[%s] Email traceback", request_id, exc_info=True)
+    
+    if not sent:
+        # Release the claim so the webhook's retry (it answers 500) can send it
         try:
-            with open(latest_file, 'r', encoding='utf-8') as f:
-                submission_data = json.load(f)
-            
-            # Validate JSON structure
-            if not isinstance(submission_data, dict):
-                logger.error(f"[{request_id}] Invalid JSON structure: not a dictionary")
-                raise ValueError("Invalid submission data structure")
-            
-            # Safely extract data with validation and sanitization
-            business_name = str(submission_data.get('business_name', 'Valued Customer')).strip()
-            plan = str(submission_data.get('plan', 'Unknown')).strip()
-            user_email = submission_data.get('contact_email')
-            
-            # Validate business name (prevent XSS and ensure reasonable length)
-            if len(business_name) > 200:
-                logger.warning(f"[{request_id}] Business name too long, truncating")
-                business_name = business_name[:200] + "..."
-            
-            # Validate email format if present
-            if user_email:
-                user_email = str(user_email).strip()
-                if '@' not in user_email or len(user_email) > 254:
-                    logger.warning(f"[{request_id}] Invalid email format detected")
-                    user_email = None
-            
-            # Mask sensitive data for logging
-            masked_data = mask_sensitive_data(submission_data)
-            logger.info(f"[{request_id}] Loaded submission data for {business_name} ({plan} Plan)")
-            logger.debug(f"[{request_id}] Submission data keys: {list(masked_data.keys())}")
-            
-        except (json.JSONDecodeError, UnicodeDecodeError) as e:
-            logger.error(f"[{request_id}] Failed to parse submission file {latest_file}: {str(e)}")
-            logger.error(f"[{request_id}] JSON parsing traceback: {traceback.format_exc()}")
-            return templates.TemplateResponse("thank-you.html", {"request": request})
-            
-        except (OSError, PermissionError) as e:
-            logger.error(f"[{request_id}] Failed to read submission file {latest_file}: {str(e)}")
-            logger.error(f"[{request_id}] File read traceback: {traceback.format_exc()}")
-            return templates.TemplateResponse("thank-you.html", {"request": request})
-            
+            await submission_store.release(ledger_key, email_kind)
         except Exception as e:
-            logger.error(f"[{request_id}] Unexpected error reading submission data: {str(e)}")
-            logger.error(f"[{request_id}] Data reading traceback: {traceback.format_exc()}")
-            return templates.TemplateResponse("thank-you.html", {"request": request})
-        
-        # Send confirmation emails with comprehensive error handling
-        if user_email and submission_data:
-            # Send payment confirmation email to user
-            try:
-                logger.info(f"[{request_id}] Attempting to send payment confirmation to user")
-                email_result = email_service.send_payment_confirmation(user_email, business_name, plan)
-                
-                if email_result:
-                    logger.info(f"[{request_id}] Payment confirmation email sent successfully to {user_email}")
-                else:
-                    logger.warning(f"[{request_id}] Payment confirmation email failed - service returned False")
-                    
-            except Exception as e:
-                logger.error(f"[{request_id}] Failed to send payment confirmation email: {str(e)}")
-                logger.error(f"[{request_id}] User email traceback: {traceback.format_exc()}")
-                # Continue processing - don't fail the entire request
-            
-            # Send admin notification about completed payment
-            try:
-                logger.info(f"[{request_id}] Attempting to send admin payment notification")
-                admin_result = email_service.send_admin_payment_confirmation(business_name, plan, user_email)
-                
-                if admin_result:
-                    logger.info(f"[{request_id}] Admin payment confirmation email sent successfully")
-                else:
-                    logger.warning(f"[{request_id}] Admin payment confirmation email failed - service returned False")
-                    
-            except Exception as e:
-                logger.error(f"[{request_id}] Failed to send admin payment confirmation: {str(e)}")
-                logger.error(f"[{request_id}] Admin email traceback: {traceback.format_exc()}")
-                # Continue processing - don't fail the entire request
-        else:
-            if not user_email:
-                logger.warning(f"[{request_id}] No valid user email found - skipping email notifications")
+            logger.error("[%s] Failed to release email ledger entry: %s", request_id, e)
+    return sent
+
+async def send_payment_emails(submission_data: Dict[str, Any], request_id: str) -> bool:
+    """Payment confirmation to the customer and the admin; False if either could not be sent"""
+    # Safely extract data with validation and sanitization
+    business_name = str(submission_data.get('business_name') or 'Valued Customer').strip()
+    plan = str(submission_data.get('plan') or 'Unknown').strip()
+    user_email = submission_data.get('contact_email')
+    
+    # Validate business name (prevent XSS and ensure reasonable length)
+    if len(business_name) > 200:
+        logger.warning("[%s] Business name too long, truncating", request_id)
+        business_name = business_name[:200] + "..."
+    
+    # Validate email format if present
+    if user_email:
+        user_email = str(user_email).strip()
+        if '@' not in user_email or len(user_email) > 254:
+            logger.warning("[%s] Invalid email format detected", request_id)
+            user_email = None
+    if not user_email:
+        logger.warning("[%s] No valid user email found - skipping payment emails", request_id)
+        return True  # nothing a retry could fix
+    
+    ledger_key = submission_key(submission_data)
+    user_sent = await send_once(ledger_key, 'payment_confirmation', request_id,
+                                email_service.send_payment_confirmation, user_email, business_name, plan)
+    admin_sent = await send_once(ledger_key, 'admin_payment_confirmation', request_id,
+                                 email_service.send_admin_payment_confirmation, business_name, plan, user_email)
+    return bool(user_sent and admin_sent)
+
+async def find_paid_submission(details: Dict[str, Optional[str]]) -> Optional[Dict[str, Any]]:
+    """The submission a checkout session paid for: by client_reference_id, else newest by email"""
+    if details.get('client_reference_id'):
+        submission = await submission_store.find_by_request_id(details['client_reference_id'])
+        if submission:
+            return submission
+    if details.get('email'):
+        matches = await submission_store.page({'contact_email': details['email']}, limit=1)
+        if matches:
+            return matches[0]
+    return None
+
+# Stripe webhook: the source of truth for completed payments
+@app.post("/api/stripe/webhook")
+async def stripe_webhook(request: Request):
+    """Verify a Stripe event, send the payment emails and record the event once they're handled
+    
+    Stripe only redelivers events that didn't get a 2xx, so the emails are sent
+    before responding and a failed send answers 500; the email ledger stops a
+    redelivery from repeating the emails that did go out.
+    """
+    request_id = str(uuid.uuid4())[:8]
+    request_id_var.set(request_id)
+    
+    secret = webhook_secret()
+    if not secret:
+        raise HTTPException(status_code=404, detail="Not found")
+    
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > MAX_WEBHOOK_PAYLOAD:
+        raise HTTPException(status_code=413, detail="Payload too large")
+    payload = await request.body()
+    if len(payload) > MAX_WEBHOOK_PAYLOAD:
+        raise HTTPException(status_code=413, detail="Payload too large")
+    
+    try:
+        verify_signature(payload, request.headers.get("Stripe-Signature"), secret)
+        event = parse_event(payload)
+    except SignatureVerificationError as e:
+        logger.warning("[%s] Rejected Stripe webhook: %s", request_id, e)
+        raise HTTPException(status_code=400, detail="Invalid signature")
+    except ValueError as e:
+        logger.warning("[%s] Malformed Stripe webhook: %s", request_id, e)
+        raise HTTPException(status_code=400, detail="Invalid payload")
+    
+    # Stripe delivers at least once - act on each event id only once
+    event_id, event_type = event['id'], event['type']
+    if await submission_store.seen_event(event_id):
+        logger.info("[%s] Duplicate Stripe event %s ignored", request_id, event_id)
+        return {"received": True, "duplicate": True}
+    
+    submission_data = None
+    if event_type in PAYMENT_EVENTS:
+        details = checkout_details(event['data']['object'])
+        if details['payment_status'] in ('paid', 'no_payment_required'):
+            submission_data = await find_paid_submission(details)
             if not submission_data:
-                logger.warning(f"[{request_id}] No submission data available - skipping email notifications")
-                
-    except Exception as e:
-        logger.error(f"[{request_id}] Unexpected error processing thank you page: {str(e)}")
-        logger.error(f"[{request_id}] Full processing traceback: {traceback.format_exc()}")
-        # Continue to render page - never fail completely
+                logger.warning("[%s] No submission matches checkout session %s", request_id, details['session_id'])
+        else:
+            logger.info("[%s] Checkout session %s not paid yet (%s)", request_id, details['session_id'], details['payment_status'])
     
-    # Calculate processing time for monitoring
-    processing_time = (datetime.now() - start_time).total_seconds()
-    logger.info(f"[{request_id}] Thank you page processing completed in {processing_time:.3f}s")
+    ledger_key = submission_key(submission_data) if submission_data else None
+    if submission_data:
+        logger.info("[%s] Payment confirmed by %s for submission %s", request_id, event_id, ledger_key)
+        with span("payment_emails"):
+            sent = await send_payment_emails(submission_data, request_id)
+        if not sent:
+            # Not recorded, so Stripe's redelivery retries the emails that failed
+            raise HTTPException(status_code=500, detail="Payment emails could not be sent")
     
-    # Always render the thank you page with graceful fallback
+    if not await submission_store.remember_event(event_id, event_type, ledger_key):
+        logger.info("[%s] Duplicate Stripe event %s ignored", request_id, event_id)
+        return {"received": True, "duplicate": True}
+    return {"received": True}
+
+# Thank you page route - a plain render; payment emails are driven by the Stripe webhook
+@app.get("/thank-you", response_class=HTMLResponse)
+async def thank_you(request: Request):
     try:
         return templates.TemplateResponse("thank-you.html", {"request": request})
     except Exception as e:
-        logger.error(f"[{request_id}] Failed to render thank-you template: {str(e)}")
-        logger.error(f"[{request_id}] Template rendering traceback: {traceback.format_exc()}")
+        logger.error("Failed to render thank-you template: %s", e)
+        logger.error("Template rendering traceback", exc_info=True)
         
         # Last resort fallback - return minimal HTML
         minimal_html = """
@@ -417,20 +461,34 @@ else:
         "http://localhost:8000",  # For local development
         "http://127.0.0.1:8000"   # For local development
     ]
-    logger.info(f"CORS configured for production with origins: {ALLOWED_ORIGINS}")
+    logger.info("CORS configured for production with origins: %s", ALLOWED_ORIGINS)
 
 app.add_middleware(
     CORSMiddleware,
     allow_origins=ALLOWED_ORIGINS,
-    allow_methods=["GET", "POST", "OPTIONS"],
-    allow_headers=["Content-Type", "Authorization"],
+    allow_methods=["GET", "POST", "PATCH", "HEAD", "DELETE", "OPTIONS"],
+    allow_headers=["Content-Type", "Authorization", "Tus-Resumable", "Upload-Length", "Upload-Offset", "Upload-Metadata", "Upload-Checksum"],
+    expose_headers=["Location", "Tus-Resumable", "Upload-Offset", "Upload-Length", "Upload-Expires", "Upload-File-URL"],
     allow_credentials=True,
     max_age=3600,  # Cache preflight requests for 1 hour
 )
 
+# Compress HTML/JSON/CSV responses in the negotiated encoding (RESPONSE_COMPRESSION=0 disables)
+if RESPONSE_COMPRESSION:
+    app.add_middleware(CompressionMiddleware)
+
 # Security headers middleware - add last so it runs first
 app.add_middleware(SecurityHeadersMiddleware)
 
+# Timing wraps everything, so it measures the full middleware stack too
+app.add_middleware(RequestTimingMiddleware)
+
+# Admission control runs first, so shed requests cost almost nothing
+# and only admitted ones are timed (ADMISSION_CONTROL=0 disables)
+if ADMISSION_CONTROL:
+    app.state.admission = AdmissionController()
+    app.add_middleware(AdmissionControlMiddleware, controller=app.state.admission)
+
 # Initialize email service with error handling
 try:
     email_service = EmailService()
@@ -443,7 +501,7 @@ try:
         logger.error("Without these, no emails will be sent to users or admin")
         
 except Exception as e:
-    logger.error(f"Failed to initialize email service: {e}")
+    logger.error("Failed to initialize email service: %s", e)
     logger.error("Email service will be disabled - no emails will be sent")
     # Create a dummy email service that doesn't send emails to prevent crashes
     class DummyEmailService:
@@ -470,6 +528,8 @@ except Exception as e:
     email_service = DummyEmailService()
     logger.warning("Email service disabled due to initialization failure")
 
+SMTP_DEFERRED_RETRY_INTERVAL = 30  # seconds between retries of deferred emails
+
 # Startup validation
 @app.on_event("startup")
 async def startup_validation():
@@ -479,13 +539,13 @@ async def startup_validation():
     # Validate templates directory
     templates_dir = BASE_DIR / "templates"
     if not templates_dir.exists():
-        logger.error(f"Templates directory not found: {templates_dir}")
+        logger.error("Templates directory not found: %s", templates_dir)
         raise RuntimeError("Templates directory missing")
     
     # Validate static files directory
     static_dir = BASE_DIR / "static"
     if not static_dir.exists():
-        logger.warning(f"Static directory not found: {static_dir}")
+        logger.warning("Static directory not found: %s", static_dir)
     
     # Validate environment variables
     required_env_vars = ["ENVIRONMENT"]
@@ -495,17 +555,81 @@ async def startup_validation():
             missing_vars.append(var)
     
     if missing_vars:
-        logger.warning(f"Missing optional environment variables: {missing_vars}")
+        logger.warning("Missing optional environment variables: %s", missing_vars)
     
     # Log startup configuration
-    logger.info(f"Environment: {environment}")
-    logger.info(f"Allowed hosts: {ALLOWED_HOSTS}")
-    logger.info(f"CORS origins: {ALLOWED_ORIGINS}")
-    logger.info(f"Rate limiter: {'Redis' if hasattr(limiter, 'storage') else 'In-memory'}")
-    logger.info(f"Email service: {'Active' if hasattr(email_service, 'smtp_server') else 'Disabled'}")
+    logger.info("Environment: %s", environment)
+    logger.info("Allowed hosts: %s", ALLOWED_HOSTS)
+    logger.info("CORS origins: %s", ALLOWED_ORIGINS)
+    logger.info("Rate limiter: %s", 'Redis' if hasattr(limiter, 'storage') else 'In-memory')
+    logger.info("Email service: %s", 'Active' if hasattr(email_service, 'smtp_server') else 'Disabled')
+    logger.info("App module loaded in %.0fms (run `python -m app.startup_profile` for a breakdown)", _MODULE_LOAD_TIME * 1000)
     
     logger.info("Application startup validation completed successfully")
 
+async def expire_resumable_uploads_periodically():
+    """Delete partial uploads nobody has touched within RESUMABLE_UPLOAD_TTL"""
+    while True:
+        try:
+            await asyncio.to_thread(resumable_uploads.expire_stale)
+        except Exception as e:
+            logger.error("Resumable upload expiry failed: %s", e)
+        await asyncio.sleep(RESUMABLE_EXPIRY_INTERVAL)
+
+async def flush_deferred_emails_periodically():
+    """Retry emails deferred while the SMTP circuit was open; doubles as the recovery probe"""
+    while True:
+        await asyncio.sleep(SMTP_DEFERRED_RETRY_INTERVAL)
+        if getattr(email_service, 'deferred', None):
+            try:
+                await asyncio.to_thread(email_service.flush_deferred)
+            except Exception as e:
+                logger.error("Deferred email retry failed: %s", e)
+
+async def collect_orphaned_uploads_periodically():
+    """Delete uploaded files that no submission references once past the grace period"""
+    while True:
+        try:
+            await asyncio.to_thread(upload_collector.collect)
+        except Exception as e:
+            logger.error("Orphaned upload collection failed: %s", e)
+        await asyncio.sleep(UPLOAD_GC_INTERVAL)
+
+@app.on_event("startup")
+async def start_loop_monitor():
+    """Watch for synchronous work blocking the event loop (LOOP_BLOCK_THRESHOLD_MS=0 disables)"""
+    if LOOP_BLOCK_THRESHOLD > 0:
+        app.state.loop_monitor = LoopMonitor(route_codes=route_code_map(app.routes))
+        app.state.loop_monitor.start()
+
+@app.on_event("shutdown")
+async def stop_loop_monitor():
+    if getattr(app.state, 'loop_monitor', None):
+        app.state.loop_monitor.stop()
+
+@app.on_event("shutdown")
+async def flush_deferred_emails():
+    """Last try at queued emails before the worker exits (recycle, rolling restart or shutdown)"""
+    if getattr(email_service, 'deferred', None):
+        try:
+            await asyncio.to_thread(email_service.flush_deferred)
+        except Exception as e:
+            logger.error("Deferred email flush on shutdown failed: %s", e)
+        if email_service.deferred:
+            logger.error("Shutting down with %s deferred emails unsent", len(email_service.deferred))
+
+@app.on_event("shutdown")
+async def stop_text_extraction():
+    text_extractor.shutdown()
+
+@app.on_event("startup")
+async def start_background_tasks():
+    """Start periodic housekeeping tasks"""
+    app.state.background_tasks = [asyncio.create_task(expire_resumable_uploads_periodically())]
+    app.state.background_tasks.append(asyncio.create_task(flush_deferred_emails_periodically()))
+    if UPLOAD_GC_INTERVAL > 0:
+        app.state.background_tasks.append(asyncio.create_task(collect_orphaned_uploads_periodically()))
+
 def mask_sensitive_data(data: dict) -> dict:
     """Mask sensitive credential data for logging"""
     masked_data = data.copy()
@@ -528,10 +652,13 @@ def sanitize_input(value: Any) -> Any:
         
         # Limit length to prevent DoS
         if len(value) > 10000:
-            logger.warning(f"Input truncated - length: {len(value)}")
+            logger.warning("Input truncated - length: %s", len(value))
             value = value[:10000]
         
-        # Use bleach for HTML sanitization - more robust than html.escape
+        # Use bleach for HTML sanitization - more robust than html.escape.
+        # Imported on first use: only the submit path sanitizes, and bleach's
+        # vendored html5lib is one of the slowest imports at cold start.
+        import bleach
         allowed_tags = []  # No HTML tags allowed
         value = bleach.clean(value, tags=allowed_tags, strip=True)
         
@@ -568,7 +695,7 @@ def validate_email_format(email: str) -> bool:
 def create_secure_error_response(error_type: str, message: str, request_id: str, status_code: int = 400) -> HTTPException:
     """Create secure error response that doesn't leak internal information"""
     # Log detailed error internally
-    logger.error(f"[{request_id}] {error_type}: {message}")
+    logger.error("[%s] %s: %s", request_id, error_type, message)
     
     # Return generic error message to client
     safe_messages = {
@@ -596,29 +723,12 @@ def create_secure_error_response(error_type: str, message: str, request_id: str,
 # File upload helper functions
 def validate_file(file: UploadFile) -> tuple[bool, str]:
     """Validate uploaded file for security and type compliance."""
-    # Check file size
-    if hasattr(file, 'size') and file.size > MAX_FILE_SIZE:
-        return False, f"File size exceeds maximum allowed size of {MAX_FILE_SIZE // (1024*1024)}MB"
-    
-    # Check MIME type
-    if file.content_type not in ALLOWED_MIME_TYPES:
-        return False, f"File type '{file.content_type}' is not allowed"
-    
-    # Check file extension
-    file_ext = Path(file.filename).suffix.lower()
-    allowed_exts = set()
-    for ext_group in ALLOWED_EXTENSIONS.values():
-        allowed_exts.update(ext_group)
-    
-    if file_ext not in allowed_exts:
-        return False, f"File extension '{file_ext}' is not allowed"
-    
-    return True, "File is valid"
+    return validate_file_metadata(file.filename, file.content_type, getattr(file, 'size', None))
 
-def save_uploaded_file(file: UploadFile, business_name: str, file_type: str) -> str:
-    """Save uploaded file and return the file URL."""
+def save_uploaded_file(file: UploadFile, business_name: str, file_type: str) -> Tuple[str, str, int]:
+    """Save uploaded file and return its URL, SHA-256 and size."""
     # Create business directory
-    business_dir = UPLOADS_DIR / business_name.replace(' ', '_').lower()
+    business_dir = UPLOADS_DIR / business_dir_name(business_name)
     business_dir.mkdir(exist_ok=True)
     
     # Generate unique filename
@@ -626,12 +736,17 @@ def save_uploaded_file(file: UploadFile, business_name: str, file_type: str) ->
     unique_filename = f"{uuid.uuid4()}{file_ext}"
     file_path = business_dir / unique_filename
     
-    # Save file
+    # Save file, hashing it on the way through for the upload content index
+    hasher = hashlib.sha256()
+    size = 0
     with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
+        for chunk in iter(lambda: file.file.read(1024 * 1024), b""):
+            hasher.update(chunk)
+            buffer.write(chunk)
+            size += len(chunk)
     
     # Return absolute URL for email compatibility
-    return f"{BASE_URL}/api/files/{business_name.replace(' ', '_').lower()}/{unique_filename}"
+    return file_url(business_dir.name, unique_filename), hasher.hexdigest(), size
 
 # File upload endpoint
 @app.post("/api/upload-file")
@@ -644,305 +759,543 @@ async def upload_file(
 ):
     """Upload a file and return its URL."""
     request_id = str(uuid.uuid4())[:8]
-    logger.info(f"[{request_id}] File upload request: {file.filename} for {business_name}")
+    request_id_var.set(request_id)
+    logger.info("[%s] File upload request: %s for %s", request_id, file.filename, business_name)
     
     try:
         # Validate file
         is_valid, message = validate_file(file)
         if not is_valid:
-            logger.warning(f"[{request_id}] File validation failed: {message}")
+            logger.warning("[%s] File validation failed: %s", request_id, message)
             raise HTTPException(status_code=400, detail=message)
         
         # Save file
-        file_url = save_uploaded_file(file, business_name, file_type)
+        file_url, sha256, size = save_uploaded_file(file, business_name, file_type)
+        await submission_store.remember_upload(business_dir_name(business_name), sha256, size, file_url)
         
-        logger.info(f"[{request_id}] File uploaded successfully: {file_url}")
+        logger.info("[%s] File uploaded successfully: %s", request_id, file_url)
         return {
             "success": True,
             "file_url": file_url,
             "filename": file.filename,
             "file_type": file.content_type,
-            "size": file.size if hasattr(file, 'size') else 0
+            "size": size
         }
         
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"[{request_id}] File upload error: {str(e)}")
+        logger.error("[%s] File upload error: %s", request_id, e)
         raise HTTPException(status_code=500, detail="File upload failed")
 
+# Upload-skip pre-flight: same bytes for the same business -> reuse the stored file
+@app.post("/api/uploads/lookup")
+@limiter.limit("30/minute")
+async def lookup_upload(request: Request, lookup: UploadLookupRequest):
+    """Return the URL of an already-stored file with this SHA-256 and size.
+    
+    Lookups only match files stored under the business_name sent, but that
+    name is client-supplied, so this is not an access control: anyone who
+    already holds a file's exact bytes can learn whether a named business has
+    uploaded it (and get the URL /api/files would serve it at anyway).
+    """
+    sha256 = lookup.sha256
+    is_valid, message = validate_file_metadata(lookup.filename, lookup.content_type, lookup.size)
+    if not is_valid:
+        raise HTTPException(status_code=400, detail=message)
+    
+    business_dir = business_dir_name(lookup.business_name)
+    url = await submission_store.lookup_upload(business_dir, sha256, lookup.size)
+    if url:
+        path = path_for_url(url)
+        try:
+            exists = path is not None and path.stat().st_size == lookup.size
+            if exists:
+                # Handing the file out again restarts its orphan grace period
+                os.utime(path)
+        except OSError:
+            exists = False
+        if not exists:
+            await submission_store.discard_upload(url)
+            url = None
+    
+    if not url:
+        return {"found": False}
+    logger.info("Upload skipped, %s already stored for %s", sha256[:12], business_dir)
+    return {"found": True, "file_url": url, "size": lookup.size}
+
+# Delivery-zone lookups: which businesses deliver to a point
+@app.get("/api/delivers-to")
+@limiter.limit("60/minute")
+async def delivers_to(request: Request, lat: float = Query(..., ge=-90, le=90),
+                      lng: float = Query(..., ge=-180, le=180), business: Optional[str] = Query(None, max_length=200)):
+    """Businesses whose delivery zones contain (lat, lng), optionally just one business by name."""
+    index = await delivery_zones.index()
+    matches = index.query(lng, lat)
+    if business is not None:
+        wanted = business.strip().casefold()
+        matches = [match for match in matches if match['business_name'].casefold() == wanted]
+    return {"delivers": bool(matches), "businesses": matches}
+
+@app.post("/api/delivers-to/bulk")
+@limiter.limit("10/minute")
+async def delivers_to_bulk(request: Request, body: DeliversToBulkRequest):
+    """Check up to 10,000 (lng, lat) points in one vectorized pass.
+    
+    `matches[i]` lists indexes into `businesses` for `points[i]`, so each
+    business name is sent once however many points it covers.
+    """
+    index = await delivery_zones.index()
+    with span("delivery_zones.query_many"):
+        matches = await asyncio.to_thread(index.query_many, body.points)
+    return {"businesses": index.businesses, "matches": matches}
+
+# Resumable upload endpoints (tus 1.0 subset: creation, checksum, expiration, termination)
+def resumable_headers(upload: Dict[str, Any]) -> Dict[str, str]:
+    """Protocol headers describing an upload's current state"""
+    headers = {
+        "Tus-Resumable": TUS_VERSION,
+        "Upload-Offset": str(upload['offset']),
+        "Upload-Length": str(upload['length']),
+        "Upload-Expires": formatdate(upload['expires'], usegmt=True),
+        "Cache-Control": "no-store",
+    }
+    if upload.get('file_url'):
+        headers["Upload-File-URL"] = upload['file_url']
+    return headers
+
+@app.options("/api/uploads/resumable")
+async def resumable_upload_options():
+    """Advertise protocol version, extensions and limits"""
+    return Response(status_code=204, headers={
+        "Tus-Resumable": TUS_VERSION,
+        "Tus-Version": TUS_VERSION,
+        "Tus-Extension": TUS_EXTENSIONS,
+        "Tus-Max-Size": str(MAX_FILE_SIZE),
+        "Tus-Checksum-Algorithm": "sha256,sha1,md5",
+    })
+
+@app.post("/api/uploads/resumable")
+@limiter.limit("10/minute")  # Creating an upload costs the same as a one-shot upload
+async def create_resumable_upload(request: Request):
+    """Start a resumable upload; metadata carries filename, content_type and business_name"""
+    try:
+        length = int(request.headers.get("Upload-Length", ""))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Upload-Length header is required")
+    if length <= 0:
+        raise HTTPException(status_code=400, detail="Upload-Length must be positive")
+    
+    metadata = parse_upload_metadata(request.headers.get("Upload-Metadata"))
+    upload = await asyncio.to_thread(resumable_uploads.create, length, metadata)
+    logger.info("Resumable upload %s created: %s (%s bytes) for %s", upload['id'], upload['filename'], length, upload['business_name'])
+    
+    status = await asyncio.to_thread(resumable_uploads.status, upload['id'])
+    headers = resumable_headers(status)
+    headers["Location"] = f"/api/uploads/resumable/{upload['id']}"
+    return Response(status_code=201, headers=headers)
+
+@app.head("/api/uploads/resumable/{upload_id}")
+@limiter.limit("120/minute")
+async def resumable_upload_status(request: Request, upload_id: str):
+    """Report how many bytes the server has, so the client knows where to resume"""
+    status = await asyncio.to_thread(resumable_uploads.status, upload_id)
+    return Response(status_code=200, headers=resumable_headers(status))
+
+@app.patch("/api/uploads/resumable/{upload_id}")
+@limiter.limit("120/minute")  # Chunks are cheap; a 10MB file in 256KB chunks is 40 requests
+async def resumable_upload_chunk(request: Request, upload_id: str):
+    """Append a chunk at Upload-Offset, optionally verified by Upload-Checksum"""
+    if request.headers.get("Content-Type", "").split(";")[0].strip() != "application/offset+octet-stream":
+        raise HTTPException(status_code=415, detail="Content-Type must be application/offset+octet-stream")
+    try:
+        offset = int(request.headers.get("Upload-Offset", ""))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Upload-Offset header is required")
+    
+    checksum = parse_checksum(request.headers.get("Upload-Checksum"))
+    status = await resumable_uploads.append(upload_id, offset, request.stream(), checksum)
+    if status.get('file_url'):
+        await submission_store.remember_upload(status['business_dir'], status['sha256'], status['length'], status['file_url'])
+    return Response(status_code=204, headers=resumable_headers(status))
+
+@app.delete("/api/uploads/resumable/{upload_id}")
+@limiter.limit("10/minute")
+async def cancel_resumable_upload(request: Request, upload_id: str):
+    """Abandon an upload and free its partial data"""
+    await asyncio.to_thread(resumable_uploads.delete, upload_id)
+    return Response(status_code=204, headers={"Tus-Resumable": TUS_VERSION})
+
 # File serving endpoint
 @app.get("/api/files/{business_name}/{filename}")
-async def serve_file(business_name: str, filename: str):
+async def serve_file(request: Request, business_name: str, filename: str):
     """Serve uploaded files with proper security."""
     try:
-        file_path = UPLOADS_DIR / business_name / filename
-        
-        if not file_path.exists():
+        entry, stat_result = file_cache.lookup(business_name, filename)
+        if stat_result is None:
             raise HTTPException(status_code=404, detail="File not found")
         
-        # Verify file is within uploads directory (security check)
-        if not str(file_path.resolve()).startswith(str(UPLOADS_DIR.resolve())):
-            raise HTTPException(status_code=403, detail="Access denied")
-        
-        # Get MIME type
-        mime_type, _ = mimetypes.guess_type(str(file_path))
-        if not mime_type:
-            mime_type = 'application/octet-stream'
-        
-        # Create response with proper headers for email client compatibility
-        response = FileResponse(
-            path=str(file_path),
-            media_type=mime_type,
-            filename=filename
-        )
+        if entry is None:
+            # Verify file is within uploads directory (security check)
+            file_path = file_cache.resolve(business_name, filename)
+            if file_path is None:
+                raise HTTPException(status_code=403, detail="Access denied")
+            if not is_regular_file(stat_result):
+                raise HTTPException(status_code=404, detail="File not found")
+            entry = await asyncio.to_thread(file_cache.load, business_name, filename, file_path, stat_result)
+            file_cache.store(business_name, filename, entry)
         
         # Add headers for better email client compatibility
-        response.headers["Cache-Control"] = "public, max-age=3600"
-        response.headers["Access-Control-Allow-Origin"] = "*"
-        response.headers["Access-Control-Allow-Methods"] = "GET"
-        response.headers["Content-Disposition"] = f'inline; filename="{filename}"'
+        headers = {
+            "Cache-Control": "public, max-age=3600",
+            "Access-Control-Allow-Origin": "*",
+            "Access-Control-Allow-Methods": "GET",
+            "ETag": entry.etag,
+            "Last-Modified": entry.last_modified,
+        }
+        if entry.etag in request.headers.get("if-none-match", ""):
+            return Response(status_code=304, headers=headers)
         
-        return response
+        headers["Content-Disposition"] = f'inline; filename="{filename}"'
+        if entry.body is not None:
+            return Response(content=entry.body, media_type=entry.media_type, headers=headers)
+        
+        # Too big to keep in memory: stream it (sendfile where the server supports pathsend)
+        return FileResponse(
+            path=str(entry.path),
+            media_type=entry.media_type,
+            headers=headers,
+            stat_result=stat_result,
+        )
         
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"File serving error: {str(e)}")
+        logger.error("File serving error: %s", e)
         raise HTTPException(status_code=500, detail="File access failed")
 
-# Onboarding form submission endpoint
-@app.post("/api/submit-onboarding", response_model=OnboardingResponse)
-@limiter.limit("3/minute")  # Rate limit: 3 form submissions per minute per IP
-async def submit_onboarding(request: Request):
-    # Generate unique request ID for tracking
-    request_id = str(uuid.uuid4())[:8]
-    start_time = datetime.now()
+def process_form_data(data):
+    """Clean and process form data before validation with comprehensive sanitization"""
+    processed = {}
+    
+    # Handle all fields with sanitization
+    for key, value in data.items():
+        # Convert empty strings and null values to None for optional fields
+        if value in ["", "null", "undefined", None]:
+            processed[key] = None
+        # Handle boolean fields
+        elif key in ['has_faqs', 'consent_to_share', 'confirm_accurate', 'consent_automation']:
+            if isinstance(value, str):
+                processed[key] = value.lower() == 'true'
+            elif isinstance(value, bool):
+                processed[key] = value
+            else:
+                processed[key] = bool(value) if value is not None else False
+        else:
+            # Apply comprehensive sanitization to all other fields
+            processed[key] = sanitize_input(value)
+    
+    return processed
+
+def validate_onboarding_data(request_data: Dict[str, Any], request_id: str) -> OnboardingForm:
+    """Sanitize and validate raw onboarding fields (CPU only - safe to run in a worker thread)"""
+    # Process form data with sanitization
+    with span("sanitize"):
+        processed_data = process_form_data(request_data)
+    
+    # Additional validation for critical fields
+    if processed_data.get('contact_email'):
+        if not validate_email_format(processed_data['contact_email']):
+            raise create_secure_error_response("validation", "Invalid email format", request_id, 422)
     
-    logger.info(f"[{request_id}] Starting onboarding form submission")
+    # Log submission details (with masked sensitive data) for a sample of requests
+    if should_log_payload() and logger.isEnabledFor(logging.INFO):
+        logger.info("[%s] Processed data: %s", request_id, mask_sensitive_data(processed_data))
+    logger.info("[%s] Submission method: %s", request_id, processed_data.get('submission_method', 'MISSING'))
+    logger.info("[%s] Plan: %s", request_id, processed_data.get('plan', 'MISSING'))
     
+    # Enhanced login field clearing for in-person setup
+    if processed_data.get('submission_method') == 'Request In-Person Setup':
+        logger.info("[%s] In-person setup detected, clearing all login fields", request_id)
+        login_fields = [
+            'instagram_email', 'instagram_password', 'tiktok_email', 'tiktok_password',
+            'facebook_email', 'facebook_password', 'whatsapp_number', 'whatsapp_password'
+        ]
+        for field in login_fields:
+            processed_data[field] = None
+        logger.info("[%s] Login fields cleared for in-person setup", request_id)
+    
+    # Validate with Pydantic with enhanced error handling
     try:
-        # Parse request body
-        try:
-            raw_body = await request.body()
-            logger.info(f"[{request_id}] Raw request body length: {len(raw_body)} bytes")
-            
-            request_data = await request.json()
-            logger.info(f"[{request_id}] Parsed JSON keys: {list(request_data.keys())}")
-            
-        except Exception as e:
-            logger.error(f"[{request_id}] Failed to parse request body: {str(e)}")
-            logger.error(f"[{request_id}] Full traceback: {traceback.format_exc()}")
-            raise create_secure_error_response("bad_request", "Invalid request format", request_id, 400)
-        
-        # Enhanced data processing and cleaning with security
-        def process_form_data(data):
-            """Clean and process form data before validation with comprehensive sanitization"""
-            processed = {}
+        with span("validation"):
+            form_data = OnboardingForm(**processed_data)
+        logger.info("[%s] Pydantic validation successful", request_id)
+        return form_data
+        
+    except ValidationError as e:
+        logger.error("[%s] Pydantic validation failed", request_id)
+        logger.error("[%s] Validation errors: %s", request_id, e.errors())
+        logger.error("[%s] Full traceback", request_id, exc_info=True)
+        
+        # Create user-friendly error messages without exposing internal structure
+        error_messages = []
+        for error in e.errors():
+            field_name = error['loc'][-1] if error['loc'] else 'field'
+            error_type = error['type']
             
-            # Handle all fields with sanitization
-            for key, value in data.items():
-                # Convert empty strings and null values to None for optional fields
-                if value in ["", "null", "undefined", None]:
-                    processed[key] = None
-                # Handle boolean fields
-                elif key in ['has_faqs', 'consent_to_share', 'confirm_accurate', 'consent_automation']:
-                    if isinstance(value, str):
-                        processed[key] = value.lower() == 'true'
-                    elif isinstance(value, bool):
-                        processed[key] = value
-                    else:
-                        processed[key] = bool(value) if value is not None else False
-                else:
-                    # Apply comprehensive sanitization to all other fields
-                    processed[key] = sanitize_input(value)
+            # Sanitize field names and provide generic error messages
+            safe_field_name = sanitize_input(str(field_name)).replace('_', ' ').title()
             
-            return processed
+            # Custom error messages for better UX but no internal details
+            if error_type == 'missing':
+                error_messages.append(f"{safe_field_name} is required")
+            elif 'email' in error_type.lower():
+                error_messages.append(f"{safe_field_name} must be a valid email address")
+            else:
+                error_messages.append(f"{safe_field_name} is invalid")
         
-        # Process form data with sanitization
-        processed_data = process_form_data(request_data)
+        raise create_secure_error_response("validation", f"Validation failed: {'; '.join(error_messages)}", request_id, 422)
+
+async def extract_attachment_text(form_data: OnboardingForm, request_id: str):
+    """Queue text extraction for the submission's document attachments (results land in the cache)"""
+    for field in ATTACHMENT_FIELDS:
+        url = unescape_stored(getattr(form_data, field) or '')
+        path = path_for_url(url) if url else None
+        if path is None:
+            continue
+        try:
+            text_extractor.schedule(path, await submission_store.upload_hash(url))
+        except Exception as e:
+            logger.warning("[%s] Could not queue text extraction for %s: %s", request_id, url, e)
+
+async def complete_onboarding(form_data: OnboardingForm, request_id: str, start_time: datetime,
+                              timings: Dict[str, float]) -> OnboardingResponse:
+    """Store a validated submission, send the notification emails and build the payment URL"""
+    # Convert form data to dict and sanitize inputs
+    data_dict = form_data.dict()
+    logger.info("[%s] Form data converted to dict successfully", request_id)
+    
+    # Sanitize string inputs to prevent XSS
+    sanitized_data = {}
+    for key, value in data_dict.items():
+        if isinstance(value, str):
+            sanitized_data[key] = html.escape(value)
+        else:
+            sanitized_data[key] = value
+    
+    logger.info("[%s] Data sanitization completed", request_id)
+    
+    # Handle secure credential storage based on submission method
+    if form_data.submission_method == 'Submit through this page':
+        logger.info("[%s] Processing online submission with credentials", request_id)
         
-        # Additional validation for critical fields
-        if processed_data.get('contact_email'):
-            if not validate_email_format(processed_data['contact_email']):
-                raise create_secure_error_response("validation", "Invalid email format", request_id, 422)
-        
-        # Log submission details (with masked sensitive data)
-        masked_data = mask_sensitive_data(processed_data)
-        logger.info(f"[{request_id}] Processed data: {masked_data}")
-        logger.info(f"[{request_id}] Submission method: {processed_data.get('submission_method', 'MISSING')}")
-        logger.info(f"[{request_id}] Plan: {processed_data.get('plan', 'MISSING')}")
-        
-        # Enhanced login field clearing for in-person setup
-        if processed_data.get('submission_method') == 'Request In-Person Setup':
-            logger.info(f"[{request_id}] In-person setup detected, clearing all login fields")
-            login_fields = [
-                'instagram_email', 'instagram_password', 'tiktok_email', 'tiktok_password',
-                'facebook_email', 'facebook_password', 'whatsapp_number', 'whatsapp_password'
-            ]
-            for field in login_fields:
-                processed_data[field] = None
-            logger.info(f"[{request_id}] Login fields cleared for in-person setup")
-        
-        # Validate with Pydantic with enhanced error handling
+        # Send credentials via secure email immediately, then remove from storage
         try:
-            form_data = OnboardingForm(**processed_data)
-            logger.info(f"[{request_id}] Pydantic validation successful")
-            
-        except ValidationError as e:
-            logger.error(f"[{request_id}] Pydantic validation failed")
-            logger.error(f"[{request_id}] Validation errors: {e.errors()}")
-            logger.error(f"[{request_id}] Full traceback: {traceback.format_exc()}")
-            
-            # Create user-friendly error messages without exposing internal structure
-            error_messages = []
-            for error in e.errors():
-                field_name = error['loc'][-1] if error['loc'] else 'field'
-                error_type = error['type']
-                
-                # Sanitize field names and provide generic error messages
-                safe_field_name = sanitize_input(str(field_name)).replace('_', ' ').title()
-                
-                # Custom error messages for better UX but no internal details
-                if error_type == 'missing':
-                    error_messages.append(f"{safe_field_name} is required")
-                elif 'email' in error_type.lower():
-                    error_messages.append(f"{safe_field_name} must be a valid email address")
-                else:
-                    error_messages.append(f"{safe_field_name} is invalid")
-            
-            raise create_secure_error_response("validation", f"Validation failed: {'; '.join(error_messages)}", request_id, 422)
+            with span("smtp.secure_credentials"):
+                await asyncio.to_thread(email_service.send_secure_credentials, form_data.contact_email, sanitized_data)
+            logger.info("[%s] Secure credentials email sent successfully", request_id)
+        except Exception as e:
+            logger.error("[%s] Failed to send secure credentials email: %s", request_id, e)
+            logger.error("[%s] Email error traceback", request_id, exc_info=True)
+            # Continue processing even if email fails
         
-        # Convert form data to dict and sanitize inputs
-        data_dict = form_data.dict()
-        logger.info(f"[{request_id}] Form data converted to dict successfully")
+        # Remove sensitive fields from data that gets stored
+        sensitive_fields = ['instagram_password', 'facebook_password', 'other_platform_credentials']
+        storage_data = {k: v for k, v in sanitized_data.items() if k not in sensitive_fields}
+        storage_data['credentials_handling'] = 'Sent via secure email'
+    else:
+        logger.info("[%s] Processing in-person setup request", request_id)
         
-        # Sanitize string inputs to prevent XSS
-        sanitized_data = {}
-        for key, value in data_dict.items():
-            if isinstance(value, str):
-                sanitized_data[key] = html.escape(value)
-            else:
-                sanitized_data[key] = value
+        # For in-person setup, don't store any login credentials
+        non_credential_fields = [
+            'business_name', 'instagram_handle', 'other_platforms', 'business_type',
+            'common_customer_question', 'product_service_description', 'delivery_pickup',
+            'delivery_services', 'delivery_other', 'pickup_method', 'pickup_details',
+            'delivery_zones', 'menu_upload', 'menu_text', 'additional_docs', 'plan', 'submission_method',
+            'has_faqs', 'faq_upload', 'consent_to_share', 'confirm_accurate', 'consent_automation',
+            'contact_email', 'submission_timestamp'
+        ]
+        storage_data = {k: v for k, v in sanitized_data.items() if k in non_credential_fields}
+        storage_data['credentials_handling'] = 'In-person setup requested'
+    
+    storage_data['request_id'] = request_id
+    logger.info("[%s] Storage data prepared", request_id)
+    
+    # Save sanitized, non-sensitive data to the submission store (off the event loop)
+    try:
+        with span("submission_write"):
+            row_id = await submission_store.save(storage_data)
+        logger.info("[%s] Submission saved as row %s in %s", request_id, row_id, submission_store.db_path)
+        if storage_data.get('delivery_zones'):
+            delivery_zones.invalidate()
+        await extract_attachment_text(form_data, request_id)
         
-        logger.info(f"[{request_id}] Data sanitization completed")
+    except Exception as e:
+        logger.error("[%s] Failed to save submission: %s", request_id, e)
+        logger.error("[%s] Submission save traceback", request_id, exc_info=True)
+        # Continue processing even if the save fails - email notifications still work
+    
+    # Send confirmation email to user with enhanced error handling
+    try:
+        with span("smtp.user_confirmation"):
+            await asyncio.to_thread(email_service.send_user_confirmation, form_data.contact_email, storage_data)
+        logger.info("[%s] User confirmation email sent successfully", request_id)
+    except Exception as e:
+        logger.error("[%s] Failed to send user confirmation email: %s", request_id, e)
+        logger.error("[%s] User email traceback", request_id, exc_info=True)
+    
+    # Send notification email to admin with enhanced error handling
+    try:
+        with span("smtp.admin_notification"):
+            await asyncio.to_thread(email_service.send_admin_notification, storage_data)
+        logger.info("[%s] Admin notification email sent successfully", request_id)
+    except Exception as e:
+        logger.error("[%s] Failed to send admin notification email: %s", request_id, e)
+        logger.error("[%s] Admin email traceback", request_id, exc_info=True)
+    
+    # Generate secure payment URL - URLs now stored server-side only
+    # TODO: SECURITY - Move Stripe URLs to environment variables
+    stripe_urls = {
+        "Starter": os.getenv("STRIPE_STARTER_URL", "https://buy.stripe.com/fZu5kEaZ4dQqbKUfNZ8Vi00"),
+        "Pro": os.getenv("STRIPE_PRO_URL", "https://buy.stripe.com/3cI5kE7MS13EcOY6dp8Vi01")
+    }
+    
+    stripe_url = stripe_urls.get(form_data.plan)
+    
+    # Add success URL parameter securely; client_reference_id comes back on the
+    # checkout session in the Stripe webhook and identifies this submission
+    success_url = os.getenv("SUCCESS_URL", "https://aichatflows.com/thank-you")
+    if "?" in stripe_url:
+        stripe_url += f"&success_url={success_url}"
+    else:
+        stripe_url += f"?success_url={success_url}"
+    stripe_url += f"&client_reference_id={request_id}"
         
-        # Handle secure credential storage based on submission method
-        if form_data.submission_method == 'Submit through this page':
-            logger.info(f"[{request_id}] Processing online submission with credentials")
-            
-            # Send credentials via secure email immediately, then remove from storage
-            try:
-                email_service.send_secure_credentials(form_data.contact_email, sanitized_data)
-                logger.info(f"[{request_id}] Secure credentials email sent successfully")
-            except Exception as e:
-                logger.error(f"[{request_id}] Failed to send secure credentials email: {str(e)}")
-                logger.error(f"[{request_id}] Email error traceback: {traceback.format_exc()}")
-                # Continue processing even if email fails
-            
-            # Remove sensitive fields from data that gets stored
-            sensitive_fields = ['instagram_password', 'facebook_password', 'other_platform_credentials']
-            storage_data = {k: v for k, v in sanitized_data.items() if k not in sensitive_fields}
-            storage_data['credentials_handling'] = 'Sent via secure email'
-        else:
-            logger.info(f"[{request_id}] Processing in-person setup request")
-            
-            # For in-person setup, don't store any login credentials
-            non_credential_fields = [
-                'business_name', 'instagram_handle', 'other_platforms', 'business_type',
-                'common_customer_question', 'product_service_description', 'delivery_pickup',
-                'delivery_services', 'delivery_other', 'pickup_method', 'pickup_details',
-                'menu_upload', 'menu_text', 'additional_docs', 'plan', 'submission_method',
-                'has_faqs', 'faq_upload', 'consent_to_share', 'confirm_accurate', 'consent_automation',
-                'contact_email', 'submission_timestamp'
-            ]
-            storage_data = {k: v for k, v in sanitized_data.items() if k in non_credential_fields}
-            storage_data['credentials_handling'] = 'In-person setup requested'
-        
-        storage_data['request_id'] = request_id
-        logger.info(f"[{request_id}] Storage data prepared")
-        
-        # Save sanitized, non-sensitive data to file with enhanced error handling
+    logger.info("[%s] Payment URL generated for %s plan", request_id, form_data.plan)
+    
+    # Calculate processing time
+    processing_time = (datetime.now() - start_time).total_seconds()
+    logger.info("[%s] Form submission completed successfully in %.2fs (%s)", request_id, processing_time, format_timings(timings))
+    
+    return OnboardingResponse(
+        success=True,
+        message="Thank you for joining AIChatFlows! Redirecting to payment...",
+        stripe_url=stripe_url
+    )
+
+# Onboarding form submission endpoint
+@app.post("/api/submit-onboarding", response_model=OnboardingResponse)
+@limiter.limit("3/minute")  # Rate limit: 3 form submissions per minute per IP
+async def submit_onboarding(request: Request, response: Response):
+    # Generate unique request ID for tracking
+    request_id = str(uuid.uuid4())[:8]
+    request_id_var.set(request_id)
+    start_time = datetime.now()
+    timings = start_request_timing()
+    
+    logger.info("[%s] Starting onboarding form submission", request_id)
+    
+    # Admin-triggered cProfile capture (PROFILING_ENABLED + X-Profile-Request header)
+    with profile_request(request, request_id, response):
         try:
-            submissions_dir = BASE_DIR / "submissions"
-            
-            # Create directory with proper error handling
+            # Parse request body
             try:
-                submissions_dir.mkdir(exist_ok=True, parents=True)
-            except PermissionError:
-                logger.warning(f"[{request_id}] No write permission for submissions directory, using temp directory")
-                submissions_dir = Path("/tmp") / "submissions"
-                submissions_dir.mkdir(exist_ok=True, parents=True)
-            except Exception as dir_error:
-                logger.error(f"[{request_id}] Failed to create submissions directory: {dir_error}")
-                # Use current directory as final fallback
-                submissions_dir = Path(".")
+                with span("json_parse"):
+                    raw_body = await request.body()
+                    request_data = await request.json()
+                logger.info("[%s] Raw request body length: %s bytes", request_id, len(raw_body))
+                
+                logger.info("[%s] Parsed JSON keys: %s", request_id, list(request_data.keys()))
+                
+            except Exception as e:
+                logger.error("[%s] Failed to parse request body: %s", request_id, e)
+                logger.error("[%s] Full traceback", request_id, exc_info=True)
+                raise create_secure_error_response("bad_request", "Invalid request format", request_id, 400)
             
-            timestamp = storage_data['submission_timestamp'].isoformat()
-            safe_business_name = "".join(c for c in storage_data['business_name'] if c.isalnum() or c in (' ', '-', '_')).rstrip()
-            filename = f"submission_{safe_business_name.replace(' ', '_')}_{timestamp}.json"
-            filepath = submissions_dir / filename
+            form_data = validate_onboarding_data(request_data, request_id)
+            return await complete_onboarding(form_data, request_id, start_time, timings)
             
-            with open(filepath, 'w') as f:
-                json.dump(storage_data, f, indent=2, default=str)
-            logger.info(f"[{request_id}] Submission saved to {filepath}")
+        except HTTPException:
+            # Re-raise HTTP exceptions without modification
+            raise
             
         except Exception as e:
-            logger.error(f"[{request_id}] Failed to save submission: {str(e)}")
-            logger.error(f"[{request_id}] File save traceback: {traceback.format_exc()}")
-            # Continue processing even if file save fails - email notifications still work
-        
-        # Send confirmation email to user with enhanced error handling
-        try:
-            email_service.send_user_confirmation(form_data.contact_email, storage_data)
-            logger.info(f"[{request_id}] User confirmation email sent successfully")
-        except Exception as e:
-            logger.error(f"[{request_id}] Failed to send user confirmation email: {str(e)}")
-            logger.error(f"[{request_id}] User email traceback: {traceback.format_exc()}")
-        
-        # Send notification email to admin with enhanced error handling
-        try:
-            email_service.send_admin_notification(storage_data)
-            logger.info(f"[{request_id}] Admin notification email sent successfully")
-        except Exception as e:
-            logger.error(f"[{request_id}] Failed to send admin notification email: {str(e)}")
-            logger.error(f"[{request_id}] Admin email traceback: {traceback.format_exc()}")
-        
-        # Generate secure payment URL - URLs now stored server-side only
-        # TODO: SECURITY - Move Stripe URLs to environment variables
-        stripe_urls = {
-            "Starter": os.getenv("STRIPE_STARTER_URL", "https://buy.stripe.com/fZu5kEaZ4dQqbKUfNZ8Vi00"),
-            "Pro": os.getenv("STRIPE_PRO_URL", "https://buy.stripe.com/3cI5kE7MS13EcOY6dp8Vi01")
-        }
-        
-        stripe_url = stripe_urls.get(form_data.plan)
-        
-        # Add success URL parameter securely
-        success_url = os.getenv("SUCCESS_URL", "https://aichatflows.com/thank-you")
-        if "?" in stripe_url:
-            stripe_url += f"&success_url={success_url}"
-        else:
-            stripe_url += f"?success_url={success_url}"
+            # Handle all other unexpected errors with full traceback logging
+            logger.error("[%s] Unexpected error during form submission: %s", request_id, e)
+            logger.error("[%s] Full traceback", request_id, exc_info=True)
             
-        logger.info(f"[{request_id}] Payment URL generated for {form_data.plan} plan")
+            raise create_secure_error_response("server_error", "Unexpected error during form submission", request_id, 500)
+
+# Combined multipart submission: form fields and attachments in one request
+@app.post("/api/submit-onboarding-multipart", response_model=OnboardingResponse)
+@limiter.limit("3/minute")  # Same budget as the JSON submit it replaces
+async def submit_onboarding_multipart(request: Request):
+    """Accept the onboarding form and its attachments in a single round-trip.
+    
+    Clients send text fields first and set each attachment field to
+    ATTACHMENT_PLACEHOLDER before appending the file parts. File parts are
+    streamed to UPLOADS_DIR while the form is validated in a worker thread.
+    """
+    request_id = str(uuid.uuid4())[:8]
+    request_id_var.set(request_id)
+    start_time = datetime.now()
+    timings = start_request_timing()
+    
+    logger.info("[%s] Starting multipart onboarding submission", request_id)
+    
+    validation_task: Optional[asyncio.Task] = None
+    files = []
+    
+    async def start_validation(fields: Dict[str, str]):
+        nonlocal validation_task
+        validation_task = asyncio.ensure_future(asyncio.to_thread(validate_onboarding_data, fields, request_id))
+    
+    def stop_if_invalid():
+        # No point reading the rest of the attachments for a form that failed validation
+        if validation_task is not None and validation_task.done() and not validation_task.cancelled():
+            error = validation_task.exception()
+            if error is not None:
+                raise error
+    
+    try:
+        with span("multipart_ingest"):
+            fields, files = await ingest_multipart(request, start_validation, check=stop_if_invalid)
+        logger.info("[%s] Received %s fields and %s attachments", request_id, len(fields), len(files))
         
-        # Calculate processing time
-        processing_time = (datetime.now() - start_time).total_seconds()
-        logger.info(f"[{request_id}] Form submission completed successfully in {processing_time:.2f}s")
+        form_data = await validation_task
         
-        return OnboardingResponse(
-            success=True,
-            message="Thank you for joining AIChatFlows! Redirecting to payment...",
-            stripe_url=stripe_url
-        )
+        # Swap attachment placeholders for the URLs of the files that arrived
+        attachment_urls = {ingested.field: ingested.url for ingested in files}
+        for field in ATTACHMENT_FIELDS:
+            if fields.get(field) == ATTACHMENT_PLACEHOLDER and field not in attachment_urls:
+                raise create_secure_error_response("bad_request", f"Declared attachment {field} was not uploaded", request_id, 400)
+        form_data = form_data.model_copy(update=attachment_urls)
         
-    except HTTPException:
-        # Re-raise HTTP exceptions without modification
-        raise
+        response = await complete_onboarding(form_data, request_id, start_time, timings)
         
-    except Exception as e:
-        # Handle all other unexpected errors with full traceback logging
-        logger.error(f"[{request_id}] Unexpected error during form submission: {str(e)}")
-        logger.error(f"[{request_id}] Full traceback: {traceback.format_exc()}")
+    except BaseException as e:
+        # Nothing references the attachments of a rejected submission
+        if validation_task is not None:
+            if not validation_task.done():
+                validation_task.cancel()
+            elif not validation_task.cancelled():
+                validation_task.exception()  # retrieved, so asyncio doesn't log it as lost
+        for ingested in files:
+            ingested.path.unlink(missing_ok=True)
         
-        raise create_secure_error_response("server_error", "Unexpected error during form submission", request_id, 500)
\ No newline at end of file
+        if isinstance(e, HTTPException) or not isinstance(e, Exception):
+            raise
+        logger.error("[%s] Unexpected error during multipart submission: %s", request_id, e)
+        logger.error("[%s] Full traceback", request_id, exc_info=True)
+        raise create_secure_error_response("server_error", "Unexpected error during form submission", request_id, 500)
+    
+    # Index the stored attachments so resubmissions can skip re-sending them
+    for ingested in files:
+        try:
+            await submission_store.remember_upload(ingested.business_dir, ingested.sha256, ingested.size, ingested.url)
+        except Exception as e:
+            logger.warning("[%s] Could not index upload %s: %s", request_id, ingested.url, e)
+    return response
+
+# Measured once the whole module (routes, middleware, services) has been imported
+_MODULE_LOAD_TIME = time.perf_counter() - _MODULE_LOAD_START
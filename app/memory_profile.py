@@ -0,0 +1,161 @@
+# app/memory_profile.py
+"""tracemalloc snapshots and diffs, grouped by module.
+
+Tracing is off until started, either at boot with TRACEMALLOC_FRAMES=<n>
+(catches allocations made during import) or later from the admin API.
+The frame depth is the overhead knob: 1 frame costs least and attributes
+each allocation to the line that made it; deeper tracebacks let an
+allocation inside the stdlib or a library be charged to the app.* module
+that called it.
+
+Allocations are grouped by module: app code by full module name
+(app.main, app.email_service), everything else by top-level package
+(starlette, bleach, slowapi), stdlib included.
+"""
+
+import itertools
+import linecache
+import os
+import sys
+import threading
+import tracemalloc
+from collections import OrderedDict, defaultdict
+from typing import Any, Dict, List, Optional
+
+TRACEMALLOC_FRAMES = int(os.getenv('TRACEMALLOC_FRAMES', '0'))
+MAX_SNAPSHOTS = 4
+MAX_FRAMES = 25
+
+APP_PACKAGE = 'app'
+
+# Allocations made by tracemalloc and the import system aren't interesting
+_IGNORED = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, linecache.__file__),
+    tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+    tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>'),
+    tracemalloc.Filter(False, '<unknown>'),
+)
+
+_snapshots: 'OrderedDict[str, tracemalloc.Snapshot]' = OrderedDict()
+_snapshot_ids = itertools.count(1)
+_lock = threading.Lock()
+
+
+def start(frames: int = 1):
+    """Start tracing (no-op if already tracing)."""
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(max(1, min(frames, MAX_FRAMES)))
+
+
+def stop():
+    tracemalloc.stop()
+    _snapshots.clear()
+
+
+def status() -> Dict[str, Any]:
+    tracing = tracemalloc.is_tracing()
+    current, peak = tracemalloc.get_traced_memory() if tracing else (0, 0)
+    return {
+        'tracing': tracing,
+        'frames': tracemalloc.get_traceback_limit() if tracing else 0,
+        'traced_bytes': current,
+        'peak_traced_bytes': peak,
+        'tracemalloc_overhead_bytes': tracemalloc.get_tracemalloc_memory() if tracing else 0,
+        'snapshots': list(_snapshots),
+    }
+
+
+class ModuleResolver:
+    """Map source filenames to module names using sys.modules."""
+
+    def __init__(self):
+        self._by_file: Dict[str, str] = {}
+        for name, module in list(sys.modules.items()):
+            filename = getattr(module, '__file__', None)
+            if filename:
+                self._by_file[filename] = name
+
+    def group(self, filename: str) -> str:
+        module = self._by_file.get(filename)
+        if module is None and filename.startswith('<frozen '):
+            module = filename[len('<frozen '):-1]  # frozen stdlib module, e.g. abc
+        if module is None:
+            return os.path.basename(filename)
+        if module == APP_PACKAGE or module.startswith(APP_PACKAGE + '.'):
+            return module
+        return module.split('.', 1)[0]
+
+    def is_app(self, filename: str) -> bool:
+        module = self._by_file.get(filename, '')
+        return module == APP_PACKAGE or module.startswith(APP_PACKAGE + '.')
+
+
+def _by_module(snapshot: tracemalloc.Snapshot, resolver: ModuleResolver, charge_to_app: bool) -> Dict[str, List[int]]:
+    """module -> [bytes, allocation count]."""
+    totals: Dict[str, List[int]] = defaultdict(lambda: [0, 0])
+    for stat in snapshot.statistics('traceback'):
+        frames = stat.traceback  # oldest call first
+        filename = frames[-1].filename
+        if charge_to_app:
+            filename = next((f.filename for f in reversed(frames) if resolver.is_app(f.filename)), filename)
+        entry = totals[resolver.group(filename)]
+        entry[0] += stat.size
+        entry[1] += stat.count
+    return totals
+
+
+def take_snapshot() -> str:
+    """Snapshot current allocations; keeps the last MAX_SNAPSHOTS."""
+    if not tracemalloc.is_tracing():
+        raise RuntimeError("tracemalloc is not tracing")
+    snapshot = tracemalloc.take_snapshot().filter_traces(_IGNORED)
+    with _lock:
+        snapshot_id = str(next(_snapshot_ids))
+        _snapshots[snapshot_id] = snapshot
+        while len(_snapshots) > MAX_SNAPSHOTS:
+            _snapshots.popitem(last=False)
+    return snapshot_id
+
+
+def get_snapshot(snapshot_id: str) -> Optional[tracemalloc.Snapshot]:
+    return _snapshots.get(snapshot_id)
+
+
+def top(snapshot: tracemalloc.Snapshot, group_by: str = 'module', limit: int = 25,
+        charge_to_app: bool = False) -> List[Dict[str, Any]]:
+    """Largest allocation sites, by module or by source line."""
+    if group_by == 'module':
+        totals = _by_module(snapshot, ModuleResolver(), charge_to_app)
+        rows = sorted(totals.items(), key=lambda item: item[1][0], reverse=True)[:limit]
+        return [{'module': module, 'size_bytes': size, 'count': count} for module, (size, count) in rows]
+
+    return [
+        {'site': str(stat.traceback[-1]), 'size_bytes': stat.size, 'count': stat.count,
+         'traceback': stat.traceback.format() if group_by == 'traceback' else None}
+        for stat in snapshot.statistics('traceback' if group_by == 'traceback' else 'lineno')[:limit]
+    ]
+
+
+def diff(old: tracemalloc.Snapshot, new: tracemalloc.Snapshot, group_by: str = 'module', limit: int = 25,
+         charge_to_app: bool = False) -> List[Dict[str, Any]]:
+    """What grew (or shrank) between two snapshots, largest change first."""
+    if group_by == 'module':
+        resolver = ModuleResolver()
+        before = _by_module(old, resolver, charge_to_app)
+        after = _by_module(new, resolver, charge_to_app)
+        rows = []
+        for module in set(before) | set(after):
+            size_before, count_before = before.get(module, (0, 0))
+            size_after, count_after = after.get(module, (0, 0))
+            if size_after != size_before or count_after != count_before:
+                rows.append({'module': module, 'size_bytes': size_after, 'size_diff': size_after - size_before,
+                             'count_diff': count_after - count_before})
+        rows.sort(key=lambda row: abs(row['size_diff']), reverse=True)
+        return rows[:limit]
+
+    return [
+        {'site': str(stat.traceback[-1]), 'size_bytes': stat.size, 'size_diff': stat.size_diff,
+         'count_diff': stat.count_diff}
+        for stat in new.compare_to(old, 'traceback' if group_by == 'traceback' else 'lineno')[:limit]
+    ]
@@ -0,0 +1,173 @@
+# app/metrics.py
+"""Lightweight in-process instrumentation.
+
+`span("stage")` times a block with perf_counter_ns and records it into a
+fixed-bucket histogram; p50/p95/p99 are estimated from the buckets, so
+recording is O(log buckets) with no per-sample storage. Everything is
+rendered in Prometheus text format by `render_prometheus()` for /metrics.
+"""
+
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Tuple
+
+# Bucket upper bounds in seconds: 50us .. 30s, roughly 2.5x apart
+DEFAULT_BUCKETS = (
+    0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+    0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0,
+)
+QUANTILES = (0.5, 0.95, 0.99)
+
+METRIC_PREFIX = 'aichatflows'
+
+# Per-request stage totals (seconds), set by start_request_timing()
+_request_timings: ContextVar[Optional[Dict[str, float]]] = ContextVar('request_timings', default=None)
+
+
+class Histogram:
+    """Fixed-bucket latency histogram with bucket-interpolated quantiles."""
+
+    __slots__ = ('bounds', 'counts', 'total', 'count', '_lock')
+
+    def __init__(self, bounds: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # last slot is +Inf
+        self.total = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        index = bisect_left(self.bounds, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.total += value
+            self.count += 1
+
+    def quantile(self, q: float) -> float:
+        """Estimate the q-quantile by linear interpolation inside its bucket."""
+        with self._lock:
+            counts = list(self.counts)
+            count = self.count
+        if not count:
+            return 0.0
+
+        rank = q * count
+        cumulative = 0
+        for index, bucket_count in enumerate(counts):
+            if cumulative + bucket_count >= rank and bucket_count:
+                lower = self.bounds[index - 1] if index > 0 else 0.0
+                if index >= len(self.bounds):
+                    return lower  # +Inf bucket: best we can say is "above the last bound"
+                upper = self.bounds[index]
+                return lower + (upper - lower) * (rank - cumulative) / bucket_count
+            cumulative += bucket_count
+        return self.bounds[-1]
+
+    def snapshot(self) -> Tuple[List[int], float, int]:
+        with self._lock:
+            return list(self.counts), self.total, self.count
+
+
+class MetricsRegistry:
+    """Named histograms keyed by (metric name, label value)."""
+
+    def __init__(self):
+        self._histograms: Dict[Tuple[str, str], Histogram] = {}
+        self._help: Dict[str, Tuple[str, str]] = {}
+        self._lock = threading.Lock()
+
+    def histogram(self, name: str, label: str, label_name: str = 'stage', help_text: str = '') -> Histogram:
+        key = (name, label)
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            with self._lock:
+                histogram = self._histograms.setdefault(key, Histogram())
+                self._help.setdefault(name, (label_name, help_text))
+        return histogram
+
+    def render_prometheus(self) -> str:
+        """Render all histograms plus p50/p95/p99 gauges in Prometheus text format."""
+        lines = []
+        names = sorted({name for name, _ in self._histograms})
+        for name in names:
+            label_name, help_text = self._help[name]
+            series = sorted((label, h) for (n, label), h in list(self._histograms.items()) if n == name)
+
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} histogram")
+            for label, histogram in series:
+                counts, total, count = histogram.snapshot()
+                cumulative = 0
+                for bound, bucket_count in zip(histogram.bounds, counts):
+                    cumulative += bucket_count
+                    lines.append(f'{name}_bucket{{{label_name}="{label}",le="{bound}"}} {cumulative}')
+                lines.append(f'{name}_bucket{{{label_name}="{label}",le="+Inf"}} {count}')
+                lines.append(f'{name}_sum{{{label_name}="{label}"}} {total:.6f}')
+                lines.append(f'{name}_count{{{label_name}="{label}"}} {count}')
+
+            quantile_name = f"{name}_quantile"
+            lines.append(f"# HELP {quantile_name} Estimated quantiles of {name}")
+            lines.append(f"# TYPE {quantile_name} gauge")
+            for label, histogram in series:
+                for q in QUANTILES:
+                    lines.append(f'{quantile_name}{{{label_name}="{label}",quantile="{q}"}} {histogram.quantile(q):.6f}')
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+STAGE_METRIC = f'{METRIC_PREFIX}_stage_duration_seconds'
+REQUEST_METRIC = f'{METRIC_PREFIX}_request_duration_seconds'
+
+# Fast path for span(): stage name -> histogram, skipping the registry lock
+_stage_histograms: Dict[str, Histogram] = {}
+
+
+class span:
+    """Time a block of code as a named stage: `with span("json_parse"): ...`"""
+
+    __slots__ = ('stage', 'histogram', 'start')
+
+    def __init__(self, stage: str):
+        self.stage = stage
+        histogram = _stage_histograms.get(stage)
+        if histogram is None:
+            histogram = _stage_histograms[stage] = registry.histogram(
+                STAGE_METRIC, stage, help_text='Time spent in each request stage')
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed = (time.perf_counter_ns() - self.start) / 1e9
+        self.histogram.observe(elapsed)
+        timings = _request_timings.get()
+        if timings is not None:
+            timings[self.stage] = timings.get(self.stage, 0.0) + elapsed
+        return False
+
+
+def observe_request(route: str, seconds: float):
+    """Record the end-to-end duration of a request for `route`."""
+    registry.histogram(REQUEST_METRIC, route, label_name='route',
+                       help_text='End-to-end request duration by route').observe(seconds)
+
+
+def start_request_timing() -> Dict[str, float]:
+    """Begin collecting per-stage timings for the current request."""
+    timings: Dict[str, float] = {}
+    _request_timings.set(timings)
+    return timings
+
+
+def format_timings(timings: Dict[str, float]) -> str:
+    """Render stage timings for a log line, e.g. 'json_parse=0.4ms sanitize=1.2ms'."""
+    return " ".join(f"{stage}={seconds * 1000:.1f}ms" for stage, seconds in timings.items())
+
+
+def render_prometheus() -> str:
+    return registry.render_prometheus()
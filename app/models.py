@@ -1,10 +1,32 @@
 # app/models.py
 
-from pydantic import BaseModel, EmailStr, field_validator, model_validator
-from typing import Optional, Literal, List
+from pydantic import BaseModel, EmailStr, Field, field_validator, model_validator
+from typing import Optional, Literal, List, Tuple
 from datetime import datetime
 
 
+class DeliveryZone(BaseModel):
+    """One delivery area: a polygon, or a radius around a center point.
+
+    Coordinates are GeoJSON-ordered (longitude, latitude) pairs in degrees.
+    """
+    name: Optional[str] = Field(None, max_length=100)
+    polygon: Optional[List[Tuple[float, float]]] = Field(None, min_length=3, max_length=500)
+    center: Optional[Tuple[float, float]] = None
+    radius_km: Optional[float] = Field(None, gt=0, le=100)
+
+    @model_validator(mode='after')
+    def validate_shape(self):
+        if (self.polygon is None) == (self.center is None):
+            raise ValueError('A delivery zone needs either a polygon or a center and radius')
+        if self.center is not None and self.radius_km is None:
+            raise ValueError('A delivery radius is required with a center point')
+        for lng, lat in self.polygon or [self.center]:
+            if not (-180 <= lng <= 180 and -90 <= lat <= 90):
+                raise ValueError('Delivery zone coordinates must be [longitude, latitude] in degrees')
+        return self
+
+
 class OnboardingForm(BaseModel):
     # Business Info
     business_name: str
@@ -21,6 +43,7 @@ class OnboardingForm(BaseModel):
     delivery_other: Optional[str] = None
     pickup_method: Optional[str] = None
     pickup_details: Optional[str] = None
+    delivery_zones: Optional[List[DeliveryZone]] = Field(None, max_length=20)
     
     # Menu Submission
     menu_upload: Optional[str] = None  # File URL from upload endpoint
@@ -125,4 +148,22 @@ class OnboardingForm(BaseModel):
 class OnboardingResponse(BaseModel):
     success: bool
     message: str
-    stripe_url: Optional[str] = None
\ No newline at end of file
+    stripe_url: Optional[str] = None
+
+class UploadLookupRequest(BaseModel):
+    """Pre-flight check for a file the server may already hold."""
+    business_name: str = Field(..., min_length=1, max_length=200)
+    filename: str = Field(..., min_length=1, max_length=255)
+    content_type: str = Field(..., max_length=200)
+    size: int = Field(..., gt=0)
+    sha256: str = Field(..., pattern=r'^[0-9a-fA-F]{64}$')
+
+    @field_validator('sha256')
+    @classmethod
+    def normalize_sha256(cls, v):
+        return v.lower()
+
+
+class DeliversToBulkRequest(BaseModel):
+    """Many (longitude, latitude) points to check against the delivery-zone index."""
+    points: List[Tuple[float, float]] = Field(..., min_length=1, max_length=10000)
@@ -0,0 +1,139 @@
+# app/profiling.py
+"""On-demand profiling, off unless PROFILING_ENABLED is set.
+
+Two tools, both reachable only with the admin token:
+
+- `StackSampler` samples every thread's stack with sys._current_frames()
+  at a fixed interval for N seconds and returns collapsed stacks
+  (`frame;frame;frame count` per line), the input format of
+  flamegraph.pl, speedscope and inferno. Sampling happens on its own
+  thread, so nothing is added to the code being profiled.
+- `profile_request()` runs one request under cProfile when it carries
+  `X-Profile-Request: <ADMIN_API_TOKEN>`. The stats are saved under
+  PROFILE_DIR and the response gets an `X-Profile-Id` header; fetch them
+  from /api/admin/profile/requests/<id>. cProfile sees everything the
+  loop thread runs while the request is in flight, including other
+  requests' callbacks, so use it on a quiet worker.
+
+When disabled the only cost is one flag check per submit request.
+"""
+
+import contextlib
+import cProfile
+import io
+import os
+import pstats
+import re
+import secrets
+import sys
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+from typing import Optional
+
+PROFILING_ENABLED = os.getenv('PROFILING_ENABLED', '').lower() in ('1', 'true', 'yes')
+PROFILE_DIR = Path(os.getenv('PROFILE_DIR', '/tmp/aichatflows-profiles'))
+PROFILE_HEADER = 'X-Profile-Request'
+
+MAX_PROFILE_SECONDS = 60
+DEFAULT_SAMPLE_INTERVAL = 0.005  # 200 Hz
+
+_PROFILE_ID = re.compile(r'^[0-9a-f]{8}$')
+
+# cProfile hooks the whole thread, so profile one request at a time
+_request_profile_lock = threading.Lock()
+
+
+def frame_label(code) -> str:
+    """'module.py:function' - short enough to read in a flamegraph."""
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}"
+
+
+class StackSampler:
+    """Statistical profiler over all threads of this process; one run at a time."""
+
+    _lock = threading.Lock()
+
+    def __init__(self, interval: float = DEFAULT_SAMPLE_INTERVAL):
+        self.interval = interval
+        self.samples = 0
+
+    def run(self, seconds: float) -> Counter:
+        """Sample for `seconds`; returns collapsed stack -> sample count."""
+        if not self._lock.acquire(blocking=False):
+            raise RuntimeError("A profile is already running")
+        try:
+            return self._sample(seconds)
+        finally:
+            self._lock.release()
+
+    def _sample(self, seconds: float) -> Counter:
+        own_thread = threading.get_ident()
+        names = {}
+        stacks: Counter = Counter()
+        deadline = time.perf_counter() + seconds
+        while time.perf_counter() < deadline:
+            if len(names) != threading.active_count():
+                names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_thread:
+                    continue
+                labels = []
+                while frame is not None:
+                    labels.append(frame_label(frame.f_code))
+                    frame = frame.f_back
+                labels.append(names.get(thread_id, f"thread-{thread_id}"))
+                stacks[';'.join(reversed(labels))] += 1
+            self.samples += 1
+            time.sleep(self.interval)
+        return stacks
+
+
+def collapsed(stacks: Counter) -> str:
+    """Render stacks in the collapsed (folded) flamegraph format."""
+    return ''.join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+
+def _authorized(header_value: Optional[str]) -> bool:
+    admin_token = os.getenv('ADMIN_API_TOKEN')
+    return bool(admin_token and header_value and secrets.compare_digest(header_value, admin_token))
+
+
+@contextlib.contextmanager
+def _run_profile(request_id: str, response):
+    if not _request_profile_lock.acquire(blocking=False):
+        yield  # another request is being profiled; run this one normally
+        return
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        _request_profile_lock.release()
+        PROFILE_DIR.mkdir(parents=True, exist_ok=True)
+        profiler.dump_stats(str(PROFILE_DIR / f"{request_id}.prof"))
+        response.headers['X-Profile-Id'] = request_id
+
+
+def profile_request(request, request_id: str, response):
+    """cProfile this request if profiling is enabled and the admin asked for it."""
+    if not PROFILING_ENABLED or not _authorized(request.headers.get(PROFILE_HEADER)):
+        return contextlib.nullcontext()
+    return _run_profile(request_id, response)
+
+
+def profile_path(profile_id: str) -> Optional[Path]:
+    if not _PROFILE_ID.match(profile_id):
+        return None
+    path = PROFILE_DIR / f"{profile_id}.prof"
+    return path if path.exists() else None
+
+
+def profile_report(path: Path, sort: str = 'cumulative', limit: int = 50) -> str:
+    """Top functions of a saved cProfile run as pstats text."""
+    output = io.StringIO()
+    stats = pstats.Stats(str(path), stream=output)
+    stats.strip_dirs().sort_stats(sort).print_stats(limit)
+    return output.getvalue()
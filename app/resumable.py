@@ -0,0 +1,261 @@
+# app/resumable.py
+"""Resumable, chunked uploads (a subset of the tus 1.0 protocol).
+
+    POST   /api/uploads/resumable        create; Upload-Length + Upload-Metadata
+    PATCH  /api/uploads/resumable/{id}   append a chunk at Upload-Offset
+    HEAD   /api/uploads/resumable/{id}   current Upload-Offset
+    DELETE /api/uploads/resumable/{id}   abandon
+
+Chunks are appended in place to one partial file, so the upload is
+assembled as it goes; completing it is a single rename into UPLOADS_DIR
+(the partial directory lives beside it on the same filesystem) rather than
+a copy. Each PATCH may carry `Upload-Checksum: sha256 <base64 digest>` for
+that chunk; on a mismatch the chunk is truncated away and the client
+resends it. Partial uploads idle for longer than RESUMABLE_UPLOAD_TTL
+seconds are deleted by `expire_stale()`.
+
+State is kept on disk (a JSON sidecar per upload, the partial file's size
+is the offset), so it is shared by every worker on the dyno.
+"""
+
+import asyncio
+import base64
+import binascii
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import re
+import time
+import uuid
+from pathlib import Path
+from typing import Any, AsyncIterator, Dict, Optional, Tuple
+
+from fastapi import HTTPException
+
+from .uploads import UPLOADS_DIR, business_dir_name, file_url, hash_file, validate_file_metadata
+
+logger = logging.getLogger(__name__)
+
+TUS_VERSION = '1.0.0'
+TUS_EXTENSIONS = 'creation,checksum,expiration,termination'
+CHECKSUM_ALGORITHMS = {'sha256': hashlib.sha256, 'sha1': hashlib.sha1, 'md5': hashlib.md5}
+
+RESUMABLE_DIR = Path(os.getenv('RESUMABLE_UPLOAD_DIR', str(UPLOADS_DIR.parent / 'uploads_partial')))
+RESUMABLE_UPLOAD_TTL = int(os.getenv('RESUMABLE_UPLOAD_TTL', str(24 * 3600)))
+
+# Status tus uses for a failed chunk checksum
+CHECKSUM_MISMATCH = 460
+
+_UPLOAD_ID = re.compile(r'^[0-9a-f]{32}$')
+
+
+def parse_upload_metadata(header: Optional[str]) -> Dict[str, str]:
+    """Decode a tus Upload-Metadata header: 'key b64value,key b64value'."""
+    metadata = {}
+    for pair in (header or '').split(','):
+        pair = pair.strip()
+        if not pair:
+            continue
+        key, _, value = pair.partition(' ')
+        try:
+            metadata[key] = base64.b64decode(value).decode('utf-8') if value else ''
+        except (binascii.Error, UnicodeDecodeError):
+            raise HTTPException(status_code=400, detail=f"Invalid Upload-Metadata value for '{key}'")
+    return metadata
+
+
+def parse_checksum(header: Optional[str]) -> Optional[Tuple[str, bytes]]:
+    """Decode an Upload-Checksum header: '<algorithm> <base64 digest>'."""
+    if not header:
+        return None
+    algorithm, _, encoded = header.strip().partition(' ')
+    if algorithm not in CHECKSUM_ALGORITHMS:
+        raise HTTPException(status_code=400, detail=f"Unsupported checksum algorithm '{algorithm}'")
+    try:
+        return algorithm, base64.b64decode(encoded, validate=True)
+    except binascii.Error:
+        raise HTTPException(status_code=400, detail="Invalid Upload-Checksum digest")
+
+
+class ResumableUploadStore:
+    """Partial uploads on disk: `<id>.part` (data) and `<id>.json` (metadata)."""
+
+    def __init__(self, directory: Path = RESUMABLE_DIR, ttl_seconds: int = RESUMABLE_UPLOAD_TTL):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.ttl_seconds = ttl_seconds
+
+    def _paths(self, upload_id: str) -> Tuple[Path, Path]:
+        if not _UPLOAD_ID.match(upload_id):
+            raise HTTPException(status_code=404, detail="Upload not found")
+        return self.directory / f"{upload_id}.part", self.directory / f"{upload_id}.json"
+
+    def _read_meta(self, upload_id: str) -> Dict[str, Any]:
+        _, meta_path = self._paths(upload_id)
+        try:
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            raise HTTPException(status_code=404, detail="Upload not found")
+
+    def _write_meta(self, upload_id: str, meta: Dict[str, Any]):
+        _, meta_path = self._paths(upload_id)
+        tmp_path = meta_path.with_suffix('.json.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, meta_path)
+
+    def create(self, length: int, metadata: Dict[str, str]) -> Dict[str, Any]:
+        """Register a new upload after validating its declared name, type and size."""
+        filename = metadata.get('filename', '')
+        content_type = metadata.get('content_type') or metadata.get('filetype', '')
+        business_name = metadata.get('business_name', '')
+        if not business_name:
+            raise HTTPException(status_code=400, detail="Upload-Metadata must include business_name")
+        is_valid, message = validate_file_metadata(filename, content_type, length)
+        if not is_valid:
+            raise HTTPException(status_code=413 if 'size' in message else 400, detail=message)
+
+        upload_id = uuid.uuid4().hex
+        part_path, _ = self._paths(upload_id)
+        part_path.touch()
+        meta = {
+            'id': upload_id,
+            'length': length,
+            'filename': filename,
+            'content_type': content_type,
+            'business_name': business_name,
+            'created': time.time(),
+            'updated': time.time(),
+            'file_url': None,
+        }
+        self._write_meta(upload_id, meta)
+        return meta
+
+    def status(self, upload_id: str) -> Dict[str, Any]:
+        """Metadata plus the current offset (the size of the partial file)."""
+        meta = self._read_meta(upload_id)
+        part_path, _ = self._paths(upload_id)
+        if meta.get('file_url'):
+            meta['offset'] = meta['length']
+        else:
+            try:
+                meta['offset'] = part_path.stat().st_size
+            except FileNotFoundError:
+                raise HTTPException(status_code=404, detail="Upload not found")
+        meta['expires'] = meta['updated'] + self.ttl_seconds
+        return meta
+
+    def _check_offset(self, upload_id: str, offset: int) -> Dict[str, Any]:
+        """Current status, or 409 if the upload is complete or not at `offset`."""
+        meta = self.status(upload_id)
+        if meta.get('file_url'):
+            raise HTTPException(status_code=409, detail="Upload already completed")
+        if offset != meta['offset']:
+            raise HTTPException(status_code=409, detail=f"Upload-Offset mismatch: server is at {meta['offset']}")
+        return meta
+
+    async def append(self, upload_id: str, offset: int, body: AsyncIterator[bytes],
+                     checksum: Optional[Tuple[str, bytes]] = None) -> Dict[str, Any]:
+        """Append one chunk at `offset`, verifying its checksum; completes the upload at full length."""
+        loop = asyncio.get_running_loop()
+
+        # Cheap rejection before opening anything; repeated under the lock below
+        await loop.run_in_executor(None, self._check_offset, upload_id, offset)
+
+        part_path, _ = self._paths(upload_id)
+        try:
+            handle = open(part_path, 'r+b')
+        except FileNotFoundError:
+            # Completed (renamed away) or deleted since the check
+            await loop.run_in_executor(None, self._check_offset, upload_id, offset)
+            raise HTTPException(status_code=404, detail="Upload not found")
+
+        with handle:
+            # One writer per upload, across all workers
+            try:
+                fcntl.flock(handle.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                raise HTTPException(status_code=423, detail="Upload is locked by another request")
+            # Another request may have written, completed or deleted the upload
+            # between the check above and taking the lock
+            meta = await loop.run_in_executor(None, self._check_offset, upload_id, offset)
+
+            hasher = CHECKSUM_ALGORITHMS[checksum[0]]() if checksum else None
+            remaining = meta['length'] - offset
+            written = 0
+            handle.seek(offset)
+            try:
+                async for chunk in body:
+                    if not chunk:
+                        continue
+                    written += len(chunk)
+                    if written > remaining:
+                        raise HTTPException(status_code=413, detail="Chunk exceeds declared Upload-Length")
+                    if hasher is not None:
+                        hasher.update(chunk)
+                    await loop.run_in_executor(None, handle.write, chunk)
+
+                if hasher is not None and hasher.digest() != checksum[1]:
+                    raise HTTPException(status_code=CHECKSUM_MISMATCH, detail="Checksum mismatch")
+            except BaseException as e:
+                # A rejected or unverifiable chunk is dropped so the client resends it
+                # from `offset`; an unchecksummed chunk cut off by a disconnect keeps
+                # what arrived, and the client resumes from the new offset
+                if hasher is not None or isinstance(e, HTTPException):
+                    handle.truncate(offset)
+                raise
+            handle.flush()
+
+            # Completed and recorded while still holding the lock, so a request
+            # waiting on it sees file_url rather than a vanished partial file
+            meta['updated'] = time.time()
+            if offset + written == meta['length']:
+                meta['file_url'] = await loop.run_in_executor(None, self._complete, upload_id, meta)
+            for transient in ('offset', 'expires'):
+                meta.pop(transient, None)
+            await loop.run_in_executor(None, self._write_meta, upload_id, meta)
+        return await loop.run_in_executor(None, self.status, upload_id)
+
+    def _complete(self, upload_id: str, meta: Dict[str, Any]) -> str:
+        """Move the assembled file into UPLOADS_DIR with a rename (no copy)."""
+        part_path, _ = self._paths(upload_id)
+        business_dir = business_dir_name(meta['business_name'])
+        (UPLOADS_DIR / business_dir).mkdir(exist_ok=True)
+        unique_filename = f"{uuid.uuid4()}{Path(meta['filename']).suffix.lower()}"
+        # Chunks may have arrived over several requests, so hash the assembled file once
+        meta['sha256'] = hash_file(part_path)
+        meta['business_dir'] = business_dir
+        os.replace(part_path, UPLOADS_DIR / business_dir / unique_filename)
+        logger.info("Resumable upload %s completed: %s/%s (%s bytes)", upload_id, business_dir, unique_filename, meta['length'])
+        return file_url(business_dir, unique_filename)
+
+    def delete(self, upload_id: str):
+        part_path, meta_path = self._paths(upload_id)
+        self._read_meta(upload_id)
+        part_path.unlink(missing_ok=True)
+        meta_path.unlink(missing_ok=True)
+
+    def expire_stale(self, now: Optional[float] = None) -> Tuple[int, int]:
+        """Delete uploads idle past the TTL; returns (uploads removed, bytes reclaimed)."""
+        now = time.time() if now is None else now
+        removed, reclaimed = 0, 0
+        for meta_path in self.directory.glob("*.json"):
+            try:
+                with open(meta_path, 'r', encoding='utf-8') as f:
+                    meta = json.load(f)
+                if meta.get('updated', 0) + self.ttl_seconds > now:
+                    continue
+                part_path = meta_path.with_suffix('.part')
+                if part_path.exists():
+                    reclaimed += part_path.stat().st_size
+                    part_path.unlink()
+                meta_path.unlink()
+                removed += 1
+            except (OSError, ValueError) as e:
+                logger.warning("Could not expire resumable upload %s: %s", meta_path.name, e)
+        if removed:
+            logger.info("Expired %s stale resumable uploads (%s bytes reclaimed)", removed, reclaimed)
+        return removed, reclaimed
@@ -0,0 +1,326 @@
+# app/server.py
+"""Pre-fork production server: one preloaded master, N uvicorn workers.
+
+    python -m app.server --port $PORT
+    python -m app.server --port 8000 --workers 4 --max-requests 5000
+
+The master imports app.main once, warms what is lazily built on first
+use (compiled Jinja templates, the bleach sanitizer), runs gc.freeze()
+so the collector doesn't dirty those pages, binds the listening socket
+and only then forks. Workers therefore share the app's read-only memory
+copy-on-write instead of each importing it again; see
+`python -m benchmarks.worker_memory` for the difference. Each worker runs
+its own event loop, startup hooks and background tasks, and accepts on
+the shared socket.
+
+Signals to the master:
+
+    SIGHUP           rolling restart: replace workers one at a time, each
+                     new worker serving before the old one is asked to stop
+    SIGTERM, SIGINT  graceful shutdown: workers finish in-flight requests
+                     for up to --graceful-timeout seconds
+
+Workers recycle themselves after --max-requests (plus up to
+--max-requests-jitter, so they don't all restart together) and the
+master forks a fresh one from the preloaded image. Workers are always
+forked from the image loaded at boot, so deploying new code still needs
+a full restart.
+
+Rate-limit counters are per worker unless REDIS_URL points them at a
+shared store.
+"""
+
+import argparse
+import asyncio
+import gc
+import logging
+import os
+import random
+import select
+import signal
+import socket
+import sys
+import threading
+import time
+from typing import Dict, List, Optional
+
+import uvicorn
+
+from .logging_config import listener_thread, shutdown_logging
+
+logger = logging.getLogger(__name__)
+
+WEB_CONCURRENCY = int(os.getenv('WEB_CONCURRENCY', str(os.cpu_count() or 1)))
+WORKER_MAX_REQUESTS = int(os.getenv('WORKER_MAX_REQUESTS', '10000'))  # 0 = never recycle
+WORKER_MAX_REQUESTS_JITTER = int(os.getenv('WORKER_MAX_REQUESTS_JITTER', '1000'))
+WORKER_GRACEFUL_TIMEOUT = float(os.getenv('WORKER_GRACEFUL_TIMEOUT', '30'))
+
+WORKER_READY_TIMEOUT = 30.0
+MIN_WORKER_LIFETIME = 1.0  # a worker dying sooner than this delays its replacement
+
+
+def preload():
+    """Import the app in the master and build everything workers can share."""
+    from . import main
+
+    for name in main.templates.env.list_templates():
+        main.templates.env.get_template(name)
+    main.sanitize_input("<b>warm</b> the sanitizer")
+
+    # Threads don't survive fork(); anything they hold would be stuck in the
+    # workers. The log listener restarts itself in each child.
+    threads = [thread.name for thread in threading.enumerate()
+               if thread is not threading.main_thread() and thread is not listener_thread()]
+    if threads:
+        logger.warning("Master has threads running before forking: %s", threads)
+    gc.collect()
+    gc.freeze()
+    return main.app
+
+
+def bind(host: str, port: int, backlog: int = 2048) -> socket.socket:
+    family = socket.AF_INET6 if ':' in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+class Worker:
+    __slots__ = ('pid', 'started', 'ready_fd')
+
+    def __init__(self, pid: int, ready_fd: Optional[int]):
+        self.pid = pid
+        self.started = time.monotonic()
+        self.ready_fd = ready_fd
+
+
+class Master:
+    """Forks, watches, recycles and rolling-restarts uvicorn workers."""
+
+    def __init__(self, app, sock: socket.socket, workers: int = WEB_CONCURRENCY,
+                 max_requests: int = WORKER_MAX_REQUESTS, max_requests_jitter: int = WORKER_MAX_REQUESTS_JITTER,
+                 graceful_timeout: float = WORKER_GRACEFUL_TIMEOUT, uvicorn_options: Optional[Dict] = None):
+        self.app = app
+        self.sock = sock
+        self.num_workers = max(1, workers)
+        self.max_requests = max_requests
+        self.max_requests_jitter = max_requests_jitter
+        self.graceful_timeout = graceful_timeout
+        self.uvicorn_options = uvicorn_options or {}
+        self.workers: Dict[int, Worker] = {}
+        self._stopping = False
+        self._reload = False
+        self._wakeup_r, self._wakeup_w = os.pipe()
+        os.set_blocking(self._wakeup_r, False)
+        os.set_blocking(self._wakeup_w, False)
+
+    # -- master --------------------------------------------------------------
+
+    def run(self) -> int:
+        signal.set_wakeup_fd(self._wakeup_w)
+        signal.signal(signal.SIGTERM, self._on_stop)
+        signal.signal(signal.SIGINT, self._on_stop)
+        signal.signal(signal.SIGHUP, self._on_reload)
+        signal.signal(signal.SIGCHLD, lambda signum, frame: None)  # just wake the loop
+
+        host, port = self.sock.getsockname()[:2]
+        logger.info("Master %s listening on %s:%s, starting %s workers", os.getpid(), host, port, self.num_workers)
+        for _ in range(self.num_workers):
+            self._spawn(wait=False)
+
+        while not self._stopping:
+            self._reap()
+            if self._reload:
+                self._reload = False
+                self._rolling_restart()
+            self._maintain()
+            self._sleep(1.0)
+
+        self._shutdown()
+        return 0
+
+    def _on_stop(self, signum, frame):
+        self._stopping = True
+
+    def _on_reload(self, signum, frame):
+        self._reload = True
+
+    def _sleep(self, timeout: float):
+        try:
+            ready, _, _ = select.select([self._wakeup_r], [], [], timeout)
+        except InterruptedError:
+            return
+        if ready:
+            try:
+                while os.read(self._wakeup_r, 512):
+                    pass
+            except BlockingIOError:
+                pass
+
+    def _maintain(self):
+        while len(self.workers) < self.num_workers and not self._stopping:
+            self._spawn(wait=False)
+
+    def _reap(self) -> List[int]:
+        exited = []
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+            if pid == 0:
+                break
+            worker = self.workers.pop(pid, None)
+            if worker is None:
+                continue
+            if worker.ready_fd is not None:
+                os.close(worker.ready_fd)
+            exited.append(pid)
+            lifetime = time.monotonic() - worker.started
+            clean_exit = (os.WIFEXITED(status) and os.WEXITSTATUS(status) == 0) or \
+                (os.WIFSIGNALED(status) and os.WTERMSIG(status) == signal.SIGTERM)
+            if clean_exit:
+                logger.info("Worker %s exited after %.0fs", pid, lifetime)
+            else:
+                logger.error("Worker %s died (status %s) after %.1fs", pid, status, lifetime)
+                if lifetime < MIN_WORKER_LIFETIME and not self._stopping:
+                    time.sleep(MIN_WORKER_LIFETIME)
+        return exited
+
+    def _spawn(self, wait: bool) -> Optional[Worker]:
+        ready_r, ready_w = os.pipe()
+        max_requests = self.max_requests + random.randint(0, self.max_requests_jitter) if self.max_requests else None
+        pid = os.fork()
+        if pid == 0:
+            os.close(ready_r)
+            code = 1
+            try:
+                self._run_worker(ready_w, max_requests)
+                code = 0
+            except BaseException:
+                logger.exception("Worker %s crashed", os.getpid())
+            finally:
+                shutdown_logging()
+                os._exit(code)
+
+        os.close(ready_w)
+        worker = Worker(pid, ready_r)
+        self.workers[pid] = worker
+        if wait and not self._wait_ready(worker, WORKER_READY_TIMEOUT):
+            return None
+        if worker.ready_fd is not None:
+            os.close(worker.ready_fd)
+            worker.ready_fd = None
+        return worker
+
+    def _wait_ready(self, worker: Worker, timeout: float) -> bool:
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline and worker.pid in self.workers:
+            ready, _, _ = select.select([worker.ready_fd], [], [], min(0.5, deadline - time.monotonic()))
+            if ready:
+                return os.read(worker.ready_fd, 1) == b'1'
+            self._reap()
+        return False
+
+    def _rolling_restart(self):
+        old_pids = list(self.workers)
+        logger.info("Rolling restart of %s workers", len(old_pids))
+        for pid in old_pids:
+            if self._stopping:
+                return
+            replacement = self._spawn(wait=True)
+            if replacement is None:
+                logger.error("Replacement worker failed to start; keeping worker %s", pid)
+                continue
+            self._stop_worker(pid)
+        logger.info("Rolling restart complete")
+
+    def _stop_worker(self, pid: int):
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            return
+        deadline = time.monotonic() + self.graceful_timeout
+        while pid in self.workers and time.monotonic() < deadline:
+            self._sleep(0.1)
+            self._reap()
+        if pid in self.workers:
+            logger.warning("Worker %s did not stop within %.0fs; killing it", pid, self.graceful_timeout)
+            os.kill(pid, signal.SIGKILL)
+            os.waitpid(pid, 0)
+            self.workers.pop(pid, None)
+
+    def _shutdown(self):
+        logger.info("Stopping %s workers", len(self.workers))
+        for pid in list(self.workers):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        deadline = time.monotonic() + self.graceful_timeout
+        while self.workers and time.monotonic() < deadline:
+            self._sleep(0.1)
+            self._reap()
+        for pid in list(self.workers):
+            logger.warning("Worker %s did not stop within %.0fs; killing it", pid, self.graceful_timeout)
+            os.kill(pid, signal.SIGKILL)
+        self.sock.close()
+
+    # -- worker --------------------------------------------------------------
+
+    def _run_worker(self, ready_fd: int, max_requests: Optional[int]):
+        signal.set_wakeup_fd(-1)
+        for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP, signal.SIGCHLD):
+            signal.signal(signum, signal.SIG_DFL)
+        os.close(self._wakeup_r)
+        os.close(self._wakeup_w)
+        random.seed()
+
+        config = uvicorn.Config(
+            self.app,
+            limit_max_requests=max_requests,
+            timeout_graceful_shutdown=self.graceful_timeout,
+            **self.uvicorn_options,
+        )
+        server = uvicorn.Server(config)
+
+        async def serve():
+            serving = asyncio.create_task(server.serve(sockets=[self.sock]))
+            while not server.started and not serving.done():
+                await asyncio.sleep(0.05)
+            if server.started:
+                try:
+                    os.write(ready_fd, b'1')
+                except OSError:
+                    pass  # master wasn't waiting for this one
+            os.close(ready_fd)
+            await serving
+
+        asyncio.run(serve())
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Pre-fork server for app.main")
+    parser.add_argument('--host', default=os.getenv('HOST', '0.0.0.0'))
+    parser.add_argument('--port', type=int, default=int(os.getenv('PORT', '8000')))
+    parser.add_argument('--workers', type=int, default=WEB_CONCURRENCY)
+    parser.add_argument('--max-requests', type=int, default=WORKER_MAX_REQUESTS,
+                        help="recycle a worker after this many requests (0 = never)")
+    parser.add_argument('--max-requests-jitter', type=int, default=WORKER_MAX_REQUESTS_JITTER)
+    parser.add_argument('--graceful-timeout', type=float, default=WORKER_GRACEFUL_TIMEOUT)
+    parser.add_argument('--no-access-log', action='store_true')
+    args = parser.parse_args(argv)
+
+    app = preload()
+    sock = bind(args.host, args.port)
+    master = Master(app, sock, workers=args.workers, max_requests=args.max_requests,
+                    max_requests_jitter=args.max_requests_jitter, graceful_timeout=args.graceful_timeout,
+                    uvicorn_options={'access_log': not args.no_access_log})
+    return master.run()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
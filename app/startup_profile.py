@@ -0,0 +1,100 @@
+# app/startup_profile.py
+"""Startup-time profile mode.
+
+Imports the application in a fresh interpreter with ``-X importtime`` and
+prints an import-time breakdown, grouped by top-level package. Exits with a
+non-zero status when the total import time exceeds the regression budget so
+it can gate deploys:
+
+    python -m app.startup_profile
+    python -m app.startup_profile --budget-ms 800 --top 25
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+from collections import defaultdict
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+
+BASE_DIR = Path(__file__).parent.parent
+
+# Default regression budget for `import app.main`, in milliseconds
+DEFAULT_BUDGET_MS = float(os.getenv('STARTUP_BUDGET_MS', '1000'))
+
+
+def run_importtime(module: str) -> List[Tuple[int, int, str]]:
+    """Import `module` in a child interpreter and return (self_us, cumulative_us, name) rows."""
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=str(BASE_DIR),
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{result.stderr}")
+
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        parts = line[len('import time:'):].split('|')
+        if len(parts) != 3:
+            continue
+        try:
+            self_us = int(parts[0])
+            cumulative_us = int(parts[1])
+        except ValueError:
+            # Header row: "self [us] | cumulative | imported package"
+            continue
+        rows.append((self_us, cumulative_us, parts[2].rstrip()))
+    return rows
+
+
+def summarize(rows: List[Tuple[int, int, str]], module: str) -> Dict[str, Any]:
+    """Aggregate self time per top-level package and find the total for `module`."""
+    by_package = defaultdict(int)
+    for self_us, _, name in rows:
+        by_package[name.strip().split('.')[0]] += self_us
+
+    total_us = next((cum for _, cum, name in rows if name.strip() == module), 0)
+    return {
+        'total_ms': total_us / 1000,
+        'packages': sorted(by_package.items(), key=lambda item: item[1], reverse=True),
+        'slowest': sorted(rows, key=lambda row: row[1], reverse=True),
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Import-time breakdown for the AIChatFlows app")
+    parser.add_argument('--module', default='app.main', help="Module to import (default: app.main)")
+    parser.add_argument('--budget-ms', type=float, default=DEFAULT_BUDGET_MS,
+                        help="Fail if total import time exceeds this many milliseconds")
+    parser.add_argument('--top', type=int, default=20, help="Number of rows to show per table")
+    args = parser.parse_args(argv)
+
+    summary = summarize(run_importtime(args.module), args.module)
+
+    print(f"Import-time breakdown for {args.module}")
+    print()
+    print("Self time by top-level package:")
+    for package, self_us in summary['packages'][:args.top]:
+        print(f"  {self_us / 1000:9.1f} ms  {package}")
+    print()
+    print("Slowest imports (cumulative):")
+    for _, cumulative_us, name in summary['slowest'][:args.top]:
+        print(f"  {cumulative_us / 1000:9.1f} ms  {name}")
+    print()
+
+    total_ms = summary['total_ms']
+    print(f"Total: {total_ms:.1f} ms (budget {args.budget_ms:.0f} ms)")
+    if total_ms > args.budget_ms:
+        print(f"FAIL: startup import time is over budget by {total_ms - args.budget_ms:.1f} ms")
+        return 1
+    print("OK: startup import time is within budget")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
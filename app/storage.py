@@ -0,0 +1,540 @@
+# app/storage.py
+"""SQLite-backed submission storage.
+
+Submissions live in one SQLite database in WAL mode instead of one JSON
+file per submission. The table schema is derived from OnboardingForm (minus
+the credential fields, which are never stored), so new form fields become
+new columns automatically. All database work runs in a thread pool: a single
+writer thread (SQLite allows one writer at a time) and a small pool of
+readers, each holding its own connection.
+
+An email ledger records which one-off emails (payment confirmations) have
+gone out for a submission, and processed Stripe webhook events are kept by
+id, so redelivered or replayed events never send anything twice.
+
+The same database keeps a content index of uploaded files (SHA-256 and
+size per business), so a client can skip re-sending bytes the server
+already holds.
+
+Legacy JSON files can be imported, and the database exported back to the
+original `submission_<name>_<timestamp>.json` layout:
+
+    python -m app.storage import submissions/
+    python -m app.storage export /tmp/submissions-export/
+"""
+
+import asyncio
+import html
+import json
+import logging
+import os
+import sqlite3
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Tuple, get_args, get_origin
+
+from .models import OnboardingForm
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = Path(__file__).parent.parent
+
+# Never persisted - credentials are emailed and then dropped
+EXCLUDED_FIELDS = {'instagram_password', 'facebook_password', 'other_platform_credentials'}
+
+# Columns that aren't part of the form itself
+EXTRA_COLUMNS = {
+    'request_id': 'TEXT',
+    'credentials_handling': 'TEXT',
+}
+
+INDEXED_COLUMNS = ('contact_email', 'plan', 'business_name', 'submission_timestamp')
+
+TABLE = 'submissions'
+UPLOADS_TABLE = 'uploaded_files'
+LEDGER_TABLE = 'email_ledger'
+EVENTS_TABLE = 'stripe_events'
+
+# Columns holding file URLs from the upload endpoints
+ATTACHMENT_COLUMNS = ('menu_upload', 'additional_docs', 'faq_upload')
+
+# Structured form fields, stored as JSON text
+JSON_COLUMNS = ('delivery_zones',)
+
+# Filters accepted by query(): exact-match columns plus a timestamp range
+FILTER_COLUMNS = ('plan', 'business_type', 'submission_method', 'contact_email', 'business_name')
+
+
+def _sqlite_type(annotation) -> str:
+    """Map a pydantic field annotation to an SQLite column type."""
+    if get_origin(annotation) is not None:
+        # Optional[X] / Literal[...]: use the first non-None argument
+        args = [arg for arg in get_args(annotation) if arg is not type(None)]
+        if args and not isinstance(args[0], str):
+            return _sqlite_type(args[0])
+        return 'TEXT'
+    if annotation is bool or annotation is int:
+        return 'INTEGER'
+    if annotation is float:
+        return 'REAL'
+    return 'TEXT'
+
+
+def schema_columns() -> Dict[str, str]:
+    """Column name -> SQLite type, derived from OnboardingForm."""
+    columns = {
+        name: _sqlite_type(field.annotation)
+        for name, field in OnboardingForm.model_fields.items()
+        if name not in EXCLUDED_FIELDS
+    }
+    columns.update(EXTRA_COLUMNS)
+    return columns
+
+
+COLUMNS = schema_columns()
+BOOLEAN_COLUMNS = {
+    name for name, field in OnboardingForm.model_fields.items()
+    if name in COLUMNS and field.annotation is bool
+}
+
+
+def _to_db(column: str, value: Any) -> Any:
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if column in BOOLEAN_COLUMNS and value is not None:
+        return int(bool(value))
+    if column in JSON_COLUMNS and value is not None:
+        return json.dumps(value, separators=(',', ':'))
+    return value
+
+
+def _from_db(row: sqlite3.Row) -> Dict[str, Any]:
+    record = dict(row)
+    for column in BOOLEAN_COLUMNS:
+        if record.get(column) is not None:
+            record[column] = bool(record[column])
+    for column in JSON_COLUMNS:
+        if record.get(column):
+            record[column] = json.loads(record[column])
+    return record
+
+
+def unescape_stored(value: str) -> str:
+    """A text field as the user sent it: the submit path HTML-escapes text, sometimes twice."""
+    plain = html.unescape(value)
+    while plain != value:
+        value, plain = plain, html.unescape(plain)
+    return plain
+
+
+def export_filename(record: Dict[str, Any]) -> str:
+    """Filename the legacy JSON writer used for a submission."""
+    timestamp = record.get('submission_timestamp') or ''
+    safe_business_name = "".join(c for c in (record.get('business_name') or '') if c.isalnum() or c in (' ', '-', '_')).rstrip()
+    return f"submission_{safe_business_name.replace(' ', '_')}_{timestamp}.json"
+
+
+class SubmissionStore:
+    """Submission repository backed by SQLite in WAL mode."""
+
+    def __init__(self, db_path: Path, read_workers: int = 4):
+        self.db_path = Path(db_path)
+        self._local = threading.local()
+        self._schema_lock = threading.Lock()
+        self._schema_ready = False
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='sqlite-writer')
+        self._readers = ThreadPoolExecutor(max_workers=read_workers, thread_name_prefix='sqlite-reader')
+
+        # Built once; sqlite3 keeps the compiled statement in its per-connection cache
+        self._insert_sql = (
+            f"INSERT INTO {TABLE} ({', '.join(COLUMNS)}) "
+            f"VALUES ({', '.join(':' + c for c in COLUMNS)})"
+        )
+
+    # -- connections -------------------------------------------------------
+
+    def _connect(self) -> sqlite3.Connection:
+        """Per-thread connection; sqlite3 caches the prepared statements on it."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            self.db_path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(str(self.db_path), timeout=10, cached_statements=64)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=10000")
+            self._ensure_schema(conn)
+            self._local.conn = conn
+        return conn
+
+    def _ensure_schema(self, conn: sqlite3.Connection):
+        with self._schema_lock:
+            if self._schema_ready:
+                return
+            column_defs = ", ".join(f"{name} {sql_type}" for name, sql_type in COLUMNS.items())
+            conn.execute(f"CREATE TABLE IF NOT EXISTS {TABLE} (id INTEGER PRIMARY KEY AUTOINCREMENT, {column_defs})")
+
+            # Add columns for form fields introduced since the table was created
+            existing = {row['name'] for row in conn.execute(f"PRAGMA table_info({TABLE})")}
+            for name, sql_type in COLUMNS.items():
+                if name not in existing:
+                    conn.execute(f"ALTER TABLE {TABLE} ADD COLUMN {name} {sql_type}")
+
+            for column in INDEXED_COLUMNS:
+                conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{TABLE}_{column} ON {TABLE} ({column})")
+            conn.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS idx_{TABLE}_request_id ON {TABLE} (request_id)")
+
+            # Content index of stored uploads; the first copy of a blob wins
+            conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {UPLOADS_TABLE} ("
+                "business_dir TEXT NOT NULL, sha256 TEXT NOT NULL, size INTEGER NOT NULL, "
+                "file_url TEXT NOT NULL, created TEXT NOT NULL, "
+                "PRIMARY KEY (business_dir, sha256, size))"
+            )
+            conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{UPLOADS_TABLE}_file_url ON {UPLOADS_TABLE} (file_url)")
+
+            conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {LEDGER_TABLE} ("
+                "submission_key TEXT NOT NULL, email_kind TEXT NOT NULL, sent_at TEXT NOT NULL, "
+                "PRIMARY KEY (submission_key, email_kind)) WITHOUT ROWID"
+            )
+            conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {EVENTS_TABLE} ("
+                "event_id TEXT PRIMARY KEY, event_type TEXT NOT NULL, submission_key TEXT, "
+                "received_at TEXT NOT NULL) WITHOUT ROWID"
+            )
+            conn.commit()
+            self._schema_ready = True
+
+    # -- synchronous API (runs on pool threads, or directly from scripts) ---
+
+    def insert(self, record: Dict[str, Any]) -> int:
+        """Insert one submission and return its row id."""
+        params = {column: _to_db(column, record.get(column)) for column in COLUMNS}
+        if not params.get('submission_timestamp'):
+            params['submission_timestamp'] = datetime.now().isoformat()
+        conn = self._connect()
+        with conn:
+            cursor = conn.execute(self._insert_sql, params)
+        return cursor.lastrowid
+
+    def get_latest(self) -> Optional[Dict[str, Any]]:
+        """Most recently stored submission."""
+        row = self._connect().execute(f"SELECT * FROM {TABLE} ORDER BY id DESC LIMIT 1").fetchone()
+        return _from_db(row) if row else None
+
+    def get_by_id(self, submission_id: int) -> Optional[Dict[str, Any]]:
+        row = self._connect().execute(f"SELECT * FROM {TABLE} WHERE id = ?", (submission_id,)).fetchone()
+        return _from_db(row) if row else None
+
+    def get_by_request_id(self, request_id: str) -> Optional[Dict[str, Any]]:
+        row = self._connect().execute(f"SELECT * FROM {TABLE} WHERE request_id = ?", (request_id,)).fetchone()
+        return _from_db(row) if row else None
+
+    def iter_all(self, batch_size: int = 500) -> Iterator[Dict[str, Any]]:
+        """Yield every submission in insertion order without loading them all."""
+        cursor = self._connect().execute(f"SELECT * FROM {TABLE} ORDER BY id")
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            for row in rows:
+                yield _from_db(row)
+
+    def count(self) -> int:
+        return self._connect().execute(f"SELECT COUNT(*) FROM {TABLE}").fetchone()[0]
+
+    @staticmethod
+    def _where(filters: Dict[str, Any]) -> Tuple[List[str], Dict[str, Any]]:
+        """Build WHERE clauses for whitelisted filters (values are always bound)."""
+        clauses, params = [], {}
+        for column in FILTER_COLUMNS:
+            if filters.get(column):
+                clauses.append(f"{column} = :{column}")
+                params[column] = filters[column]
+        if filters.get('date_from'):
+            clauses.append("submission_timestamp >= :date_from")
+            params['date_from'] = filters['date_from']
+        if filters.get('date_to'):
+            clauses.append("submission_timestamp < :date_to")
+            params['date_to'] = filters['date_to']
+        return clauses, params
+
+    def query(self, filters: Dict[str, Any], limit: int = 50, before_id: Optional[int] = None,
+              after_id: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Keyset-paginated query.
+
+        `before_id` pages newest-first (admin listing); `after_id` walks
+        oldest-first (exports). Either way each page is a bounded index
+        range scan, however deep into the table it is.
+        """
+        clauses, params = self._where(filters)
+        if before_id is not None:
+            clauses.append("id < :before_id")
+            params['before_id'] = before_id
+        if after_id is not None:
+            clauses.append("id > :after_id")
+            params['after_id'] = after_id
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        order = "ASC" if after_id is not None else "DESC"
+        params['limit'] = limit
+        rows = self._connect().execute(
+            f"SELECT * FROM {TABLE} {where} ORDER BY id {order} LIMIT :limit", params
+        ).fetchall()
+        return [_from_db(row) for row in rows]
+
+    def upload_references(self, after_id: int = 0, limit: int = 1000) -> List[Tuple[int, List[str]]]:
+        """(id, attachment URLs) for submissions after `after_id`, oldest first."""
+        rows = self._connect().execute(
+            f"SELECT id, {', '.join(ATTACHMENT_COLUMNS)} FROM {TABLE} WHERE id > ? ORDER BY id LIMIT ?",
+            (after_id, limit),
+        ).fetchall()
+        return [(row['id'], [row[column] for column in ATTACHMENT_COLUMNS if row[column]]) for row in rows]
+
+    def delivery_zones(self, after_id: int = 0, limit: int = 1000) -> List[Dict[str, Any]]:
+        """Submissions that offer delivery and drew zones, after `after_id`, oldest first."""
+        rows = self._connect().execute(
+            f"SELECT id, request_id, business_name, delivery_zones FROM {TABLE} "
+            "WHERE id > ? AND delivery_pickup IN ('Delivery', 'Both') AND delivery_zones IS NOT NULL "
+            "ORDER BY id LIMIT ?",
+            (after_id, limit),
+        ).fetchall()
+        return [_from_db(row) for row in rows]
+
+    def claim_email(self, submission_key: str, email_kind: str) -> bool:
+        """Reserve a one-off email; False if it was already sent (or is being sent)."""
+        conn = self._connect()
+        with conn:
+            cursor = conn.execute(
+                f"INSERT OR IGNORE INTO {LEDGER_TABLE} (submission_key, email_kind, sent_at) VALUES (?, ?, ?)",
+                (submission_key, email_kind, datetime.now().isoformat()),
+            )
+        return cursor.rowcount == 1
+
+    def record_event(self, event_id: str, event_type: str, submission_key: Optional[str]) -> bool:
+        """Record a webhook event; False if this event id was already processed."""
+        conn = self._connect()
+        with conn:
+            cursor = conn.execute(
+                f"INSERT OR IGNORE INTO {EVENTS_TABLE} (event_id, event_type, submission_key, received_at) "
+                "VALUES (?, ?, ?, ?)",
+                (event_id, event_type, submission_key, datetime.now().isoformat()),
+            )
+        return cursor.rowcount == 1
+
+    def has_event(self, event_id: str) -> bool:
+        """Whether a webhook event id has already been processed."""
+        row = self._connect().execute(
+            f"SELECT 1 FROM {EVENTS_TABLE} WHERE event_id = ?", (event_id,)
+        ).fetchone()
+        return row is not None
+
+    def release_email(self, submission_key: str, email_kind: str):
+        """Undo a claim after a failed send so a later attempt can retry."""
+        conn = self._connect()
+        with conn:
+            conn.execute(
+                f"DELETE FROM {LEDGER_TABLE} WHERE submission_key = ? AND email_kind = ?",
+                (submission_key, email_kind),
+            )
+
+    def record_upload(self, business_dir: str, sha256: str, size: int, file_url: str):
+        """Remember which stored file holds this content (no-op if already known)."""
+        conn = self._connect()
+        with conn:
+            conn.execute(
+                f"INSERT OR IGNORE INTO {UPLOADS_TABLE} (business_dir, sha256, size, file_url, created) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (business_dir, sha256, size, file_url, datetime.now().isoformat()),
+            )
+
+    def find_upload(self, business_dir: str, sha256: str, size: int) -> Optional[str]:
+        """File URL of a stored upload with this content, if any."""
+        row = self._connect().execute(
+            f"SELECT file_url FROM {UPLOADS_TABLE} WHERE business_dir = ? AND sha256 = ? AND size = ?",
+            (business_dir, sha256, size),
+        ).fetchone()
+        return row['file_url'] if row else None
+
+    def find_upload_hash(self, file_url: str) -> Optional[str]:
+        """SHA-256 recorded for a stored file URL, if it was indexed."""
+        row = self._connect().execute(
+            f"SELECT sha256 FROM {UPLOADS_TABLE} WHERE file_url = ? LIMIT 1", (file_url,)
+        ).fetchone()
+        return row['sha256'] if row else None
+
+    def forget_upload(self, file_url: str):
+        """Drop index entries for a file that no longer exists."""
+        conn = self._connect()
+        with conn:
+            conn.execute(f"DELETE FROM {UPLOADS_TABLE} WHERE file_url = ?", (file_url,))
+
+    # -- async API for request handlers --------------------------------------
+
+    async def save(self, record: Dict[str, Any]) -> int:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._writer, self.insert, record)
+
+    async def latest(self) -> Optional[Dict[str, Any]]:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._readers, self.get_latest)
+
+    async def remember_event(self, event_id: str, event_type: str, submission_key: Optional[str]) -> bool:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._writer, self.record_event, event_id, event_type, submission_key)
+
+    async def seen_event(self, event_id: str) -> bool:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._readers, self.has_event, event_id)
+
+    async def claim(self, submission_key: str, email_kind: str) -> bool:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._writer, self.claim_email, submission_key, email_kind)
+
+    async def release(self, submission_key: str, email_kind: str):
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self._writer, self.release_email, submission_key, email_kind)
+
+    async def find(self, submission_id: int) -> Optional[Dict[str, Any]]:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._readers, self.get_by_id, submission_id)
+
+    async def find_by_request_id(self, request_id: str) -> Optional[Dict[str, Any]]:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._readers, self.get_by_request_id, request_id)
+
+    async def remember_upload(self, business_dir: str, sha256: str, size: int, file_url: str):
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self._writer, self.record_upload, business_dir, sha256, size, file_url)
+
+    async def lookup_upload(self, business_dir: str, sha256: str, size: int) -> Optional[str]:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._readers, self.find_upload, business_dir, sha256, size)
+
+    async def upload_hash(self, file_url: str) -> Optional[str]:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._readers, self.find_upload_hash, file_url)
+
+    async def discard_upload(self, file_url: str):
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self._writer, self.forget_upload, file_url)
+
+    async def zones_page(self, after_id: int = 0, limit: int = 1000) -> List[Dict[str, Any]]:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._readers, self.delivery_zones, after_id, limit)
+
+    async def page(self, filters: Dict[str, Any], limit: int = 50,
+                   before_id: Optional[int] = None) -> List[Dict[str, Any]]:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._readers, lambda: self.query(filters, limit=limit, before_id=before_id))
+
+    async def stream(self, filters: Dict[str, Any], batch_size: int = 500) -> AsyncIterator[List[Dict[str, Any]]]:
+        """Yield matching submissions in batches, oldest first.
+
+        Each batch is a separate keyset query on a reader thread, so only one
+        batch is ever held in memory and no cursor is kept open between them.
+        """
+        loop = asyncio.get_running_loop()
+        last_id = 0
+        while True:
+            batch = await loop.run_in_executor(
+                self._readers, lambda: self.query(filters, limit=batch_size, after_id=last_id))
+            if not batch:
+                break
+            yield batch
+            last_id = batch[-1]['id']
+
+    # -- JSON import / export ------------------------------------------------
+
+    def export_json(self, dest_dir: Path) -> int:
+        """Write every submission back out in the legacy per-file JSON format."""
+        dest_dir = Path(dest_dir)
+        dest_dir.mkdir(parents=True, exist_ok=True)
+        exported = 0
+        for record in self.iter_all():
+            record.pop('id', None)
+            # The legacy writer named files with isoformat() but serialised the
+            # datetime inside them with str()
+            filename = export_filename(record)
+            if record.get('submission_timestamp'):
+                try:
+                    record['submission_timestamp'] = str(datetime.fromisoformat(record['submission_timestamp']))
+                except ValueError:
+                    pass
+            with open(dest_dir / filename, 'w') as f:
+                json.dump(record, f, indent=2, default=str)
+            exported += 1
+        return exported
+
+    def import_json(self, source_dir: Path) -> int:
+        """Load legacy submission_*.json files, skipping request IDs already stored."""
+        imported = 0
+        for path in sorted(Path(source_dir).glob("submission_*.json"), key=lambda p: p.stat().st_mtime):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    record = json.load(f)
+            except (OSError, json.JSONDecodeError) as e:
+                logger.warning("Skipping unreadable submission file %s: %s", path, e)
+                continue
+            if record.get('request_id') and self.get_by_request_id(record['request_id']):
+                continue
+            # Stored as str(datetime); native rows use isoformat(), and date filters compare text
+            if record.get('submission_timestamp'):
+                try:
+                    record['submission_timestamp'] = datetime.fromisoformat(record['submission_timestamp']).isoformat()
+                except (TypeError, ValueError):
+                    logger.warning("Unparseable submission_timestamp in %s: %r", path, record['submission_timestamp'])
+            self.insert(record)
+            imported += 1
+        return imported
+
+    def close(self):
+        self._writer.shutdown(wait=True)
+        self._readers.shutdown(wait=True)
+
+
+def submission_key(record: Dict[str, Any]) -> str:
+    """Ledger key for a submission: its request_id, or its row id for imported legacy rows."""
+    return record.get('request_id') or f"id:{record['id']}"
+
+
+def default_db_path() -> Path:
+    """SUBMISSIONS_DB, or submissions/submissions.db with a /tmp fallback."""
+    configured = os.getenv('SUBMISSIONS_DB')
+    if configured:
+        return Path(configured)
+
+    submissions_dir = BASE_DIR / "submissions"
+    try:
+        submissions_dir.mkdir(exist_ok=True, parents=True)
+        if os.access(submissions_dir, os.W_OK):
+            return submissions_dir / "submissions.db"
+    except OSError:
+        pass
+    logger.warning("No write permission for submissions directory, using temp directory")
+    return Path("/tmp") / "submissions" / "submissions.db"
+
+
+def main(argv: List[str] = None) -> int:
+    argv = sys.argv[1:] if argv is None else argv
+    if len(argv) != 2 or argv[0] not in ('import', 'export'):
+        print("usage: python -m app.storage {import|export} DIRECTORY")
+        return 2
+
+    store = SubmissionStore(default_db_path())
+    try:
+        if argv[0] == 'import':
+            print(f"Imported {store.import_json(Path(argv[1]))} submissions into {store.db_path}")
+        else:
+            print(f"Exported {store.export_json(Path(argv[1]))} submissions to {argv[1]}")
+    finally:
+        store.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,79 @@
+# app/stripe_fixtures.py
+"""Signed sample Stripe events for exercising the webhook locally.
+
+    python -m app.stripe_fixtures --request-id 1a2b3c4d
+    python -m app.stripe_fixtures --request-id 1a2b3c4d --post http://localhost:8000/api/stripe/webhook
+
+Events are signed with STRIPE_WEBHOOK_SECRET (or --secret) exactly the way
+Stripe signs real deliveries, so they pass the same verification. Without
+--post the payload and Stripe-Signature header are printed as JSON.
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+import uuid
+from typing import Any, Dict, List, Optional, Tuple
+
+from .stripe_webhook import CHECKOUT_COMPLETED, compute_signature
+
+
+def checkout_completed_event(request_id: Optional[str], email: Optional[str] = None,
+                             event_id: Optional[str] = None, payment_status: str = 'paid') -> Dict[str, Any]:
+    """A minimal checkout.session.completed event with the fields the webhook reads."""
+    return {
+        'id': event_id or f"evt_test_{uuid.uuid4().hex[:24]}",
+        'object': 'event',
+        'type': CHECKOUT_COMPLETED,
+        'created': int(time.time()),
+        'livemode': False,
+        'data': {
+            'object': {
+                'id': f"cs_test_{uuid.uuid4().hex[:24]}",
+                'object': 'checkout.session',
+                'client_reference_id': request_id,
+                'customer_details': {'email': email},
+                'payment_status': payment_status,
+                'status': 'complete',
+            },
+        },
+    }
+
+
+def sign_event(event: Dict[str, Any], secret: str, timestamp: Optional[int] = None) -> Tuple[bytes, str]:
+    """Serialize an event and build its Stripe-Signature header."""
+    payload = json.dumps(event).encode()
+    timestamp = int(time.time()) if timestamp is None else timestamp
+    return payload, f"t={timestamp},v1={compute_signature(payload, timestamp, secret)}"
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Emit a signed checkout.session.completed event")
+    parser.add_argument('--request-id', help="submission request_id (client_reference_id)")
+    parser.add_argument('--email', help="customer email, used when there is no request id")
+    parser.add_argument('--event-id', help="fixed event id, to test duplicate deliveries")
+    parser.add_argument('--secret', default=os.getenv('STRIPE_WEBHOOK_SECRET'))
+    parser.add_argument('--post', metavar='URL', help="POST the event to this webhook URL")
+    args = parser.parse_args(argv)
+
+    if not args.secret:
+        parser.error("set STRIPE_WEBHOOK_SECRET or pass --secret")
+
+    event = checkout_completed_event(args.request_id, args.email, args.event_id)
+    payload, signature = sign_event(event, args.secret)
+
+    if not args.post:
+        print(json.dumps({'headers': {'Stripe-Signature': signature}, 'payload': event}, indent=2))
+        return 0
+
+    import httpx
+    response = httpx.post(args.post, content=payload,
+                          headers={'Stripe-Signature': signature, 'Content-Type': 'application/json'})
+    print(response.status_code, response.text)
+    return 0 if response.is_success else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
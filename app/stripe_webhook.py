@@ -0,0 +1,95 @@
+# app/stripe_webhook.py
+"""Stripe webhook signature verification and event parsing.
+
+Stripe signs each webhook delivery with the endpoint's signing secret:
+
+    Stripe-Signature: t=<unix time>,v1=<hex HMAC-SHA256 of "<t>.<raw body>">
+
+`verify_signature()` checks that header in constant time and rejects
+deliveries older than the tolerance (replays), without needing the stripe
+package. Payment links carry the submission's request_id as
+`client_reference_id`, which comes back on the checkout session.
+"""
+
+import hashlib
+import hmac
+import json
+import os
+import time
+from typing import Any, Dict, Optional
+
+SIGNATURE_TOLERANCE = 300  # seconds, Stripe's own default
+MAX_PAYLOAD_SIZE = 256 * 1024
+
+CHECKOUT_COMPLETED = 'checkout.session.completed'
+# Delayed payment methods (bank debits) complete the session unpaid, then send this
+ASYNC_PAYMENT_SUCCEEDED = 'checkout.session.async_payment_succeeded'
+PAYMENT_EVENTS = (CHECKOUT_COMPLETED, ASYNC_PAYMENT_SUCCEEDED)
+
+
+class SignatureVerificationError(ValueError):
+    """The Stripe-Signature header is missing, malformed, stale or doesn't match."""
+
+
+def webhook_secret() -> Optional[str]:
+    return os.getenv('STRIPE_WEBHOOK_SECRET')
+
+
+def compute_signature(payload: bytes, timestamp: int, secret: str) -> str:
+    signed = f"{timestamp}.".encode() + payload
+    return hmac.new(secret.encode(), signed, hashlib.sha256).hexdigest()
+
+
+def verify_signature(payload: bytes, header: Optional[str], secret: str,
+                     tolerance: int = SIGNATURE_TOLERANCE, now: Optional[float] = None) -> int:
+    """Verify a Stripe-Signature header; returns its timestamp."""
+    if not header:
+        raise SignatureVerificationError("Missing Stripe-Signature header")
+
+    timestamp = None
+    signatures = []
+    for item in header.split(','):
+        key, _, value = item.strip().partition('=')
+        if key == 't':
+            try:
+                timestamp = int(value)
+            except ValueError:
+                raise SignatureVerificationError("Invalid timestamp in Stripe-Signature header")
+        elif key == 'v1':
+            signatures.append(value)
+    if timestamp is None or not signatures:
+        raise SignatureVerificationError("Stripe-Signature header has no timestamp or v1 signature")
+
+    expected = compute_signature(payload, timestamp, secret)
+    if not any(hmac.compare_digest(expected, signature) for signature in signatures):
+        raise SignatureVerificationError("Signature does not match payload")
+
+    now = time.time() if now is None else now
+    if tolerance and abs(now - timestamp) > tolerance:
+        raise SignatureVerificationError("Timestamp outside the tolerance window")
+    return timestamp
+
+
+def parse_event(payload: bytes) -> Dict[str, Any]:
+    """Decode an event body, checking the fields we rely on."""
+    try:
+        event = json.loads(payload)
+    except (UnicodeDecodeError, ValueError):
+        raise ValueError("Event body is not valid JSON")
+    if not isinstance(event, dict) or not isinstance(event.get('id'), str) or not isinstance(event.get('type'), str):
+        raise ValueError("Event is missing id or type")
+    data = event.get('data')
+    if not isinstance(data, dict) or not isinstance(data.get('object'), dict):
+        raise ValueError("Event is missing data.object")
+    return event
+
+
+def checkout_details(session: Dict[str, Any]) -> Dict[str, Optional[str]]:
+    """The fields of a checkout session used to find the submission."""
+    customer = session.get('customer_details') or {}
+    return {
+        'session_id': session.get('id'),
+        'client_reference_id': session.get('client_reference_id'),
+        'email': customer.get('email') or session.get('customer_email'),
+        'payment_status': session.get('payment_status'),
+    }
@@ -0,0 +1,430 @@
+# app/text_extraction.py
+"""Plain-text extraction from uploaded menus and FAQ documents.
+
+Submitted attachments (menu_upload, additional_docs, faq_upload) are
+turned into UTF-8 text the bot can use. PDF, DOCX, RTF and TXT are
+supported; legacy .doc and images are reported as unsupported.
+
+Parsing is CPU-bound, so it runs in a ProcessPoolExecutor (spawned
+lazily on first use, TEXT_EXTRACTION_WORKERS processes) and never on the
+event loop or under its GIL. Each extractor is a generator of text
+chunks and the worker writes them out as they come, so memory stays flat
+however long the document is: PDF pages are extracted and written one at
+a time (up to MAX_PAGES), DOCX XML is walked with iterparse and cleared
+paragraph by paragraph, and text files are decoded in 1MB chunks. RTF
+is tokenized from memory (uploads are capped at 10MB) but its text is
+still written out in 1MB pieces. Pages are separated by form feeds
+('\\f'), as pdftotext does. A job still running after
+TEXT_EXTRACTION_TIMEOUT seconds is abandoned and recorded as failed, so
+a hostile file can't hold a worker.
+
+Results are cached on disk by content hash under EXTRACTED_TEXT_DIR:
+`<sha256>.v<N>.txt` holds the text and a `.json` sidecar the outcome
+(status, pages, characters). The same bytes uploaded again, by any
+business, are never parsed twice, and bumping EXTRACTOR_VERSION makes
+every document be re-extracted by the improved code. Failures are cached
+too, so a corrupt or password-protected file isn't retried on every
+request. Concurrent requests for the same content share one extraction.
+"""
+
+import asyncio
+import codecs
+import json
+import logging
+import multiprocessing
+import os
+import re
+import signal
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, Iterator, Optional
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = Path(__file__).parent.parent
+
+EXTRACTED_TEXT_DIR = Path(os.getenv('EXTRACTED_TEXT_DIR', str(BASE_DIR / "extracted_text")))
+TEXT_EXTRACTION_WORKERS = int(os.getenv('TEXT_EXTRACTION_WORKERS', '2'))
+TEXT_EXTRACTION_TIMEOUT = float(os.getenv('TEXT_EXTRACTION_TIMEOUT', '60'))
+
+EXTRACTOR_VERSION = 1
+MAX_PAGES = 500
+MAX_CHARS = 2_000_000
+MAX_XML_SIZE = 100 * 1024 * 1024  # uncompressed DOCX body; anything bigger is a zip bomb
+MAX_TASKS_PER_CHILD = 100  # recycle workers so parser leaks can't accumulate
+READ_CHUNK_SIZE = 1024 * 1024
+PAGE_BREAK = '\f'
+TRUNCATED = object()  # yielded by an extractor that stopped at MAX_PAGES
+
+EXTRACTABLE_EXTENSIONS = {'.pdf', '.docx', '.rtf', '.txt'}
+
+
+# -- extractors (run in the worker processes) ---------------------------------
+
+def extract_pdf(path: str) -> Iterator[str]:
+    from pypdf import PdfReader
+
+    reader = PdfReader(path)
+    if reader.is_encrypted:
+        reader.decrypt('')  # owner-password-only PDFs open with an empty user password
+    for number, page in enumerate(reader.pages):
+        if number >= MAX_PAGES:
+            yield TRUNCATED
+            break
+        if number:
+            yield PAGE_BREAK
+        yield page.extract_text() or ''
+
+
+_W = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+
+
+def extract_docx(path: str) -> Iterator[str]:
+    import zipfile
+    from xml.etree import ElementTree
+
+    with zipfile.ZipFile(path) as archive:
+        info = archive.getinfo('word/document.xml')
+        if info.file_size > MAX_XML_SIZE:
+            raise ValueError(f"document.xml is {info.file_size} bytes uncompressed")
+        with archive.open(info) as xml:
+            for _, element in ElementTree.iterparse(xml, events=('end',)):
+                tag = element.tag
+                if tag == f'{_W}t':
+                    if element.text:
+                        yield element.text
+                elif tag == f'{_W}tab':
+                    yield '\t'
+                elif tag == f'{_W}br':
+                    yield PAGE_BREAK if element.get(f'{_W}type') == 'page' else '\n'
+                elif tag == f'{_W}cr':
+                    yield '\n'
+                elif tag == f'{_W}tc':
+                    yield '\t'
+                elif tag == f'{_W}p':
+                    yield '\n'
+                    element.clear()  # text already emitted; keep memory flat
+
+
+def extract_txt(path: str) -> Iterator[str]:
+    with open(path, 'rb') as f:
+        sample = f.read(READ_CHUNK_SIZE)
+        encoding = _detect_encoding(sample)
+        decoder = codecs.getincrementaldecoder(encoding)(errors='replace')
+        chunk = sample
+        while chunk:
+            yield decoder.decode(chunk)
+            chunk = f.read(READ_CHUNK_SIZE)
+        yield decoder.decode(b'', final=True)
+
+
+def _detect_encoding(sample: bytes) -> str:
+    if sample.startswith(codecs.BOM_UTF8):
+        return 'utf-8-sig'
+    if sample.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+        return 'utf-16'
+    try:
+        codecs.getincrementaldecoder('utf-8')().decode(sample)  # a split final character is fine
+        return 'utf-8'
+    except UnicodeDecodeError:
+        pass
+    try:
+        from charset_normalizer import from_bytes
+    except ImportError:
+        return 'cp1252'  # what Windows editors write
+    best = from_bytes(sample).best()
+    return best.encoding if best is not None else 'cp1252'
+
+
+_RTF_TOKEN = re.compile(
+    rb"\\([a-zA-Z]{1,32})(-?\d{1,10})? ?"   # control word with optional numeric parameter
+    rb"|\\'([0-9a-fA-F]{2})"                # hex-escaped byte in the document code page
+    rb"|\\([^a-zA-Z])"                      # control symbol
+    rb"|([{}])"                             # group start / end
+    rb"|[\r\n]+"                            # line breaks in the source are not text
+    rb"|([^\\{}\r\n]+)"                     # plain text
+)
+
+# Groups whose content is never document text
+_RTF_DESTINATIONS = {
+    'fonttbl', 'colortbl', 'stylesheet', 'info', 'pict', 'object', 'header', 'headerl', 'headerr', 'headerf',
+    'footer', 'footerl', 'footerr', 'footerf', 'listtable', 'listoverridetable', 'rsidtbl', 'generator',
+    'xmlnstbl', 'themedata', 'colorschememapping', 'datastore', 'latentstyles', 'fldinst', 'filetbl',
+    'revtbl', 'pgdsctbl', 'bkmkstart', 'bkmkend',
+}
+
+_RTF_SPECIALS = {
+    'par': '\n', 'line': '\n', 'sect': '\n', 'row': '\n', 'cell': '\t', 'tab': '\t', 'page': PAGE_BREAK,
+    'emdash': '\u2014', 'endash': '\u2013', 'bullet': '\u2022', 'lquote': '\u2018', 'rquote': '\u2019',
+    'ldblquote': '\u201c', 'rdblquote': '\u201d', 'emspace': ' ', 'enspace': ' ', 'qmspace': ' ',
+}
+
+_RTF_SYMBOLS = {'~': '\u00a0', '_': '-', '-': '', '\\': '\\', '{': '{', '}': '}', '\n': '\n', '\r': '\n'}
+
+
+def _codepage(number: int) -> str:
+    try:
+        return codecs.lookup(f'cp{number}').name
+    except LookupError:
+        return 'cp1252'
+
+
+def extract_rtf(path: str) -> Iterator[str]:
+    with open(path, 'rb') as f:
+        data = f.read()
+
+    codepage = 'cp1252'
+    skip, uc = False, 1
+    stack = []
+    pending_skip = 0  # fallback characters still to drop after a \uN
+    out = []
+    out_size = 0
+    pos = 0
+    while pos < len(data):
+        match = _RTF_TOKEN.match(data, pos)
+        if match is None:
+            pos += 1
+            continue
+        pos = match.end()
+        word, param, hex_byte, symbol, brace, text = match.groups()
+
+        if brace is not None:
+            if brace == b'{':
+                stack.append((skip, uc))
+            elif stack:
+                skip, uc = stack.pop()
+            pending_skip = 0
+            continue
+        if word is not None:
+            word = word.decode('ascii')
+            if word == 'bin' and param and int(param) > 0:
+                pos += int(param)  # raw binary payload
+            elif word in _RTF_DESTINATIONS:
+                skip = True
+            elif word == 'ansicpg' and param:
+                codepage = _codepage(int(param))
+            elif word == 'uc' and param:
+                uc = int(param)
+            elif word == 'u' and param and not skip:
+                value = int(param)
+                value = value + 65536 if value < 0 else value
+                if 0 <= value <= 0x10FFFF:
+                    out.append(chr(value))
+                pending_skip = uc
+            elif word in _RTF_SPECIALS and not skip:
+                out.append(_RTF_SPECIALS[word])
+                pending_skip = 0
+            continue
+        if symbol is not None:
+            if symbol == b'*':
+                skip = True  # \* marks a destination readers may ignore
+            elif not skip and pending_skip:
+                pending_skip -= 1
+            elif not skip:
+                out.append(_RTF_SYMBOLS.get(symbol.decode('latin-1'), ''))
+            continue
+        if skip:
+            continue
+        if hex_byte is not None:
+            if pending_skip:
+                pending_skip -= 1
+                continue
+            out.append(bytes([int(hex_byte, 16)]).decode(codepage, 'replace'))
+        elif text is not None:
+            if pending_skip:
+                dropped = min(pending_skip, len(text))
+                text, pending_skip = text[dropped:], pending_skip - dropped
+            chunk = text.decode(codepage, 'replace')
+            out.append(chunk)
+            out_size += len(chunk)
+        if out_size >= READ_CHUNK_SIZE:
+            yield ''.join(out)
+            out, out_size = [], 0
+    yield ''.join(out)
+
+
+EXTRACTORS = {
+    '.pdf': extract_pdf,
+    '.docx': extract_docx,
+    '.rtf': extract_rtf,
+    '.txt': extract_txt,
+}
+
+
+def text_path(cache_dir: Path, sha256: str) -> Path:
+    return Path(cache_dir) / sha256[:2] / f"{sha256}.v{EXTRACTOR_VERSION}.txt"
+
+
+def result_path(cache_dir: Path, sha256: str) -> Path:
+    return text_path(cache_dir, sha256).with_suffix('.json')
+
+
+def _write_json(path: Path, data: Dict[str, Any]):
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    tmp.write_text(json.dumps(data), encoding='utf-8')
+    os.replace(tmp, path)
+
+
+class ExtractionTimeout(Exception):
+    pass
+
+
+def _timed_out(signum, frame):
+    raise ExtractionTimeout(f"gave up after {TEXT_EXTRACTION_TIMEOUT:g}s")
+
+
+def _set_deadline(seconds: float):
+    # Worker processes run jobs on their main thread, where SIGALRM can interrupt a
+    # parser stuck on a hostile file; the failure is cached like any other
+    if seconds > 0 and hasattr(signal, 'setitimer') and threading.current_thread() is threading.main_thread():
+        signal.signal(signal.SIGALRM, _timed_out)
+        signal.setitimer(signal.ITIMER_REAL, seconds)
+
+
+def _clear_deadline():
+    if hasattr(signal, 'setitimer') and threading.current_thread() is threading.main_thread():
+        signal.setitimer(signal.ITIMER_REAL, 0)
+
+
+def extract_to_cache(path: str, extension: str, sha256: str, cache_dir: str) -> Dict[str, Any]:
+    """Extract one file into the cache and return its result (runs in a worker process).
+
+    Gives up with a failed result after TEXT_EXTRACTION_TIMEOUT seconds.
+    """
+    target = text_path(Path(cache_dir), sha256)
+    target.parent.mkdir(parents=True, exist_ok=True)
+    tmp = target.with_name(f"{target.name}.{os.getpid()}.tmp")
+    start = time.perf_counter()
+    pages, chars, truncated = 1, 0, False
+    _set_deadline(TEXT_EXTRACTION_TIMEOUT)
+    try:
+        with open(tmp, 'w', encoding='utf-8') as out:
+            for chunk in EXTRACTORS[extension](path):
+                if chunk is TRUNCATED:
+                    truncated = True
+                    break
+                if chars + len(chunk) > MAX_CHARS:
+                    chunk, truncated = chunk[:MAX_CHARS - chars], True
+                out.write(chunk)
+                pages += chunk.count(PAGE_BREAK)
+                chars += len(chunk)
+                if truncated:
+                    break
+        os.replace(tmp, target)
+        result = {'status': 'ok', 'pages': pages, 'chars': chars, 'truncated': truncated}
+    except FileNotFoundError:
+        # Not cached: the same content may still be uploaded again
+        tmp.unlink(missing_ok=True)
+        return {'status': 'missing', 'sha256': sha256, 'extension': extension}
+    except Exception as e:
+        tmp.unlink(missing_ok=True)
+        result = {'status': 'failed', 'error': f"{type(e).__name__}: {e}"[:300]}
+    finally:
+        _clear_deadline()
+    result.update(sha256=sha256, extension=extension, seconds=round(time.perf_counter() - start, 3))
+    _write_json(result_path(Path(cache_dir), sha256), result)
+    return result
+
+
+def _pool_context():
+    # Not fork: the app process has threads (log listener, store pools). A
+    # fork server that has imported only this module starts workers quickly
+    # and, unlike spawn, doesn't re-import the app's __main__ in each one.
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context('forkserver')
+        context.set_forkserver_preload([__name__])
+        return context
+    return multiprocessing.get_context('spawn')
+
+
+# -- event-loop side -------------------------------------------------------------
+
+class TextExtractor:
+    """Schedules extractions on the process pool and serves cached results."""
+
+    def __init__(self, cache_dir: Path = EXTRACTED_TEXT_DIR, workers: int = TEXT_EXTRACTION_WORKERS):
+        self.cache_dir = Path(cache_dir)
+        self.workers = max(1, workers)
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._in_flight: Dict[str, asyncio.Future] = {}
+        self._tasks = set()
+
+    def _executor(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=_pool_context(),
+                                             max_tasks_per_child=MAX_TASKS_PER_CHILD)
+        return self._pool
+
+    def cached(self, sha256: str) -> Optional[Dict[str, Any]]:
+        try:
+            return json.loads(result_path(self.cache_dir, sha256).read_text(encoding='utf-8'))
+        except (OSError, ValueError):
+            return None
+
+    def read_text(self, sha256: str) -> Optional[str]:
+        try:
+            return text_path(self.cache_dir, sha256).read_text(encoding='utf-8')
+        except OSError:
+            return None
+
+    async def extract(self, path: Path, sha256: Optional[str] = None) -> Dict[str, Any]:
+        """Result for a file, extracting it unless this content is already cached.
+
+        Pass the SHA-256 from the upload index when it is known; otherwise
+        the file is hashed first (on a thread).
+        """
+        extension = Path(path).suffix.lower()
+        if extension not in EXTRACTABLE_EXTENSIONS:
+            return {'status': 'unsupported', 'sha256': sha256, 'extension': extension}
+        if sha256 is None:
+            from .uploads import hash_file
+            try:
+                sha256 = await asyncio.to_thread(hash_file, path)
+            except FileNotFoundError:
+                return {'status': 'missing', 'sha256': None, 'extension': extension}
+        result = await asyncio.to_thread(self.cached, sha256)
+        if result is not None:
+            return result
+
+        future = self._in_flight.get(sha256)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            future = loop.run_in_executor(self._executor(), extract_to_cache,
+                                          str(path), extension, sha256, str(self.cache_dir))
+            self._in_flight[sha256] = future
+            future.add_done_callback(lambda done: self._extracted(sha256, done))
+        return await asyncio.shield(future)
+
+    def _extracted(self, sha256: str, future: asyncio.Future):
+        self._in_flight.pop(sha256, None)
+        if future.cancelled() or future.exception() is not None:
+            return
+        result = future.result()
+        if result['status'] == 'missing':
+            logger.warning("File for %s disappeared before its text was extracted", sha256[:12])
+        elif result['status'] == 'ok':
+            logger.info("Extracted %s chars from %s pages of %s (%s) in %.2fs", result['chars'],
+                        result['pages'], sha256[:12], result['extension'], result['seconds'])
+        else:
+            logger.warning("Text extraction failed for %s (%s): %s",
+                           sha256[:12], result['extension'], result.get('error'))
+
+    def schedule(self, path: Path, sha256: Optional[str] = None):
+        """Extract in the background; the result lands in the cache."""
+        if Path(path).suffix.lower() not in EXTRACTABLE_EXTENSIONS:
+            return
+        task = asyncio.create_task(self.extract(path, sha256))
+        self._tasks.add(task)
+        task.add_done_callback(self._finished)
+
+    def _finished(self, task: asyncio.Task):
+        self._tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error("Text extraction task failed: %s", task.exception())
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
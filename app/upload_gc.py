@@ -0,0 +1,167 @@
+# app/upload_gc.py
+"""Garbage collection for uploads no submission references.
+
+Files are written to `uploads/<business>/` as soon as they are uploaded, so
+abandoned forms and re-uploads after a validation error leave files that
+no submission ever points at. `UploadCollector.collect()` deletes files
+that are not referenced by any submission's menu_upload, additional_docs
+or faq_upload URL once they are older than a grace period.
+
+Runs are incremental:
+  - referenced files are learned from submissions newer than the last one
+    seen (a keyset query on the id), never by re-reading the whole table
+  - a business directory is only listed again when its mtime changes
+    (a file was added or removed); unreferenced files still inside the
+    grace period are remembered as candidates and re-checked by stat alone
+
+A file's mtime is its age: the upload-skip lookup touches a file when it
+hands its URL out again, which restarts the grace period.
+
+    python -m app.upload_gc [--dry-run] [--grace-seconds N]
+"""
+
+import argparse
+import logging
+import os
+import sys
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Optional, Set, Tuple
+
+from .storage import SubmissionStore, default_db_path, unescape_stored
+from .uploads import UPLOADS_DIR, file_url, url_file_key
+
+logger = logging.getLogger(__name__)
+
+ORPHAN_UPLOAD_GRACE = int(os.getenv('ORPHAN_UPLOAD_GRACE', str(48 * 3600)))
+REFERENCE_BATCH_SIZE = 1000
+
+
+@dataclass
+class CollectionResult:
+    scanned_dirs: int = 0
+    candidates: int = 0
+    removed: int = 0
+    reclaimed_bytes: int = 0
+
+
+class UploadCollector:
+    """Incremental mark-and-sweep over UPLOADS_DIR; keep one per process."""
+
+    def __init__(self, store: SubmissionStore, uploads_dir: Path = UPLOADS_DIR,
+                 grace_seconds: int = ORPHAN_UPLOAD_GRACE):
+        self.store = store
+        self.uploads_dir = Path(uploads_dir)
+        self.grace_seconds = grace_seconds
+        self._last_submission_id = 0
+        self._referenced: Set[str] = set()
+        self._dir_mtimes: Dict[str, int] = {}
+        # '<business_dir>/<filename>' -> size, for unreferenced files not yet collected
+        self._candidates: Dict[str, int] = {}
+
+    def _load_new_references(self):
+        """Mark files referenced by submissions stored since the last run."""
+        while True:
+            batch = self.store.upload_references(self._last_submission_id, REFERENCE_BATCH_SIZE)
+            for submission_id, urls in batch:
+                for url in urls:
+                    # Stored URLs are HTML-escaped like every other text field
+                    key = url_file_key(unescape_stored(url))
+                    if key:
+                        self._referenced.add(key)
+                        self._candidates.pop(key, None)
+                self._last_submission_id = submission_id
+            if len(batch) < REFERENCE_BATCH_SIZE:
+                break
+
+    def _scan_changed_dirs(self, result: CollectionResult):
+        """List business directories whose contents changed since the last run."""
+        seen = set()
+        with os.scandir(self.uploads_dir) as entries:
+            for entry in entries:
+                if not entry.is_dir(follow_symlinks=False):
+                    continue
+                seen.add(entry.name)
+                mtime = entry.stat(follow_symlinks=False).st_mtime_ns
+                if self._dir_mtimes.get(entry.name) == mtime:
+                    continue
+                self._dir_mtimes[entry.name] = mtime
+                result.scanned_dirs += 1
+
+                # Drop stale candidates for this directory, then re-list it
+                prefix = entry.name + '/'
+                for key in [k for k in self._candidates if k.startswith(prefix)]:
+                    del self._candidates[key]
+                with os.scandir(entry.path) as files:
+                    for file_entry in files:
+                        if not file_entry.is_file(follow_symlinks=False):
+                            continue
+                        key = prefix + file_entry.name
+                        if key not in self._referenced:
+                            self._candidates[key] = file_entry.stat(follow_symlinks=False).st_size
+
+        # Directories that disappeared
+        for name in set(self._dir_mtimes) - seen:
+            del self._dir_mtimes[name]
+            prefix = name + '/'
+            for key in [k for k in self._candidates if k.startswith(prefix)]:
+                del self._candidates[key]
+
+    def collect(self, now: Optional[float] = None, dry_run: bool = False) -> CollectionResult:
+        """Delete unreferenced files older than the grace period."""
+        now = time.time() if now is None else now
+        result = CollectionResult()
+        self._load_new_references()
+        self._scan_changed_dirs(result)
+        result.candidates = len(self._candidates)
+
+        removed: List[Tuple[str, int]] = []
+        for key in list(self._candidates):
+            path = self.uploads_dir / key
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                del self._candidates[key]
+                continue
+            if stat.st_mtime + self.grace_seconds > now:
+                continue
+            if not dry_run:
+                path.unlink(missing_ok=True)
+                del self._candidates[key]
+            removed.append((key, stat.st_size))
+
+        for key, size in removed:
+            result.removed += 1
+            result.reclaimed_bytes += size
+            if not dry_run:
+                business_dir, _, filename = key.partition('/')
+                self.store.forget_upload(file_url(business_dir, filename))
+
+        if result.removed:
+            logger.info(
+                "%s %s orphaned uploads (%s bytes) from %s changed directories",
+                "Would remove" if dry_run else "Removed", result.removed, result.reclaimed_bytes, result.scanned_dirs,
+            )
+        return result
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Delete uploaded files no submission references")
+    parser.add_argument('--dry-run', action='store_true', help="report what would be deleted")
+    parser.add_argument('--grace-seconds', type=int, default=ORPHAN_UPLOAD_GRACE)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    store = SubmissionStore(default_db_path())
+    try:
+        result = UploadCollector(store, grace_seconds=args.grace_seconds).collect(dry_run=args.dry_run)
+    finally:
+        store.close()
+    print(f"{'Would remove' if args.dry_run else 'Removed'} {result.removed} of {result.candidates} "
+          f"unreferenced files, {result.reclaimed_bytes} bytes")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
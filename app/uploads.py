@@ -0,0 +1,317 @@
+# app/uploads.py
+"""Upload configuration and streaming multipart ingestion.
+
+`ingest_multipart()` parses a multipart body straight off the socket.
+Text fields are collected in memory; file parts are validated from their
+headers and written directly to their final location under UPLOADS_DIR in a
+worker thread, pipelined with reading the next network chunk (no spooled
+temp file, no second copy). As soon as the first file part starts - the
+client sends text fields first - the caller is handed the complete set of
+fields so it can validate the form while file bytes are still arriving.
+
+Every stored file's SHA-256 is computed as it is written, so the upload
+can be recorded in the content index and later re-uploads of the same bytes
+skipped (see `/api/uploads/lookup`).
+"""
+
+import asyncio
+import hashlib
+import os
+import uuid
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from fastapi import HTTPException, Request
+
+try:
+    from python_multipart.multipart import MultipartParser, parse_options_header
+except ImportError:  # python-multipart < 0.0.13
+    from multipart.multipart import MultipartParser, parse_options_header
+
+# Get the parent directory (ai-coffee root)
+BASE_DIR = Path(__file__).parent.parent
+
+# File upload configuration
+UPLOADS_DIR = Path(os.getenv('UPLOAD_DIRECTORY', str(BASE_DIR / "uploads")))
+UPLOADS_DIR.mkdir(parents=True, exist_ok=True)
+MAX_FILE_SIZE = 10 * 1024 * 1024  # 10MB
+
+# Base URL for generating absolute file URLs
+BASE_URL = os.getenv('BASE_URL', 'https://aichatflows.com')
+ALLOWED_EXTENSIONS = {
+    'image': {'.jpg', '.jpeg', '.png', '.gif', '.webp'},
+    'document': {'.pdf', '.doc', '.docx', '.txt', '.rtf'},
+}
+ALLOWED_MIME_TYPES = {
+    'image/jpeg', 'image/png', 'image/gif', 'image/webp',
+    'application/pdf', 'application/msword',
+    'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
+    'text/plain', 'application/rtf'
+}
+
+# Form fields that carry file attachments on the combined submit endpoint
+ATTACHMENT_FIELDS = ('menu_upload', 'additional_docs', 'faq_upload')
+
+# Text value a client sends for an attachment field to declare that the file
+# part follows later in the body (lets the form validate before it arrives)
+ATTACHMENT_PLACEHOLDER = 'attached'
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+MAX_FIELD_SIZE = 64 * 1024  # text fields are sanitised down to 10k chars anyway
+MAX_FIELDS = 100
+
+
+def business_dir_name(business_name: str) -> str:
+    """Directory name used for a business's uploads (also part of the file URL)."""
+    name = business_name.replace(' ', '_').lower()
+    # Never let a business name escape UPLOADS_DIR
+    return name.replace('/', '_').replace('\\', '_').lstrip('.') or 'unnamed'
+
+
+def file_url(business_dir: str, filename: str) -> str:
+    """Absolute URL for email compatibility."""
+    return f"{BASE_URL}/api/files/{business_dir}/{filename}"
+
+
+def url_file_key(url: Optional[str]) -> Optional[str]:
+    """'<business_dir>/<filename>' for a file URL from file_url(), whatever host it was built with."""
+    if not url:
+        return None
+    _, marker, key = url.partition('/api/files/')
+    business_dir, _, filename = key.partition('/')
+    if not marker or not business_dir or not filename or '/' in filename \
+            or business_dir.startswith('.') or filename.startswith('.'):
+        return None
+    return key
+
+
+def path_for_url(url: str) -> Optional[Path]:
+    """Local path of a file URL produced by file_url(), or None if it isn't one."""
+    key = url_file_key(url)
+    return UPLOADS_DIR / key if key else None
+
+
+def hash_file(path: Path) -> str:
+    """SHA-256 hex digest of a file, read in 1MB chunks."""
+    hasher = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def validate_file_metadata(filename: Optional[str], content_type: Optional[str],
+                           size: Optional[int] = None) -> Tuple[bool, str]:
+    """Validate an upload's size, MIME type and extension."""
+    if size is not None and size > MAX_FILE_SIZE:
+        return False, f"File size exceeds maximum allowed size of {MAX_FILE_SIZE // (1024*1024)}MB"
+
+    if content_type not in ALLOWED_MIME_TYPES:
+        return False, f"File type '{content_type}' is not allowed"
+
+    file_ext = Path(filename or '').suffix.lower()
+    allowed_exts = set()
+    for ext_group in ALLOWED_EXTENSIONS.values():
+        allowed_exts.update(ext_group)
+
+    if file_ext not in allowed_exts:
+        return False, f"File extension '{file_ext}' is not allowed"
+
+    return True, "File is valid"
+
+
+class IngestedFile:
+    """One file part being written to disk while the body streams in."""
+
+    def __init__(self, field: str, filename: str, content_type: str, path: Path, url: str):
+        self.field = field
+        self.filename = filename
+        self.content_type = content_type
+        self.path = path
+        self.url = url
+        self.size = 0
+        self.business_dir = path.parent.name
+        self.pending: List[bytes] = []
+        self._hasher = hashlib.sha256()
+        self._handle = open(path, 'wb')
+        self._write: Optional[asyncio.Future] = None
+
+    def _write_chunks(self, chunks: List[bytes]):
+        for chunk in chunks:
+            self._handle.write(chunk)
+            self._hasher.update(chunk)
+
+    @property
+    def sha256(self) -> str:
+        return self._hasher.hexdigest()
+
+    async def flush(self, loop: asyncio.AbstractEventLoop):
+        """Hand pending chunks to a worker thread, keeping at most one write in flight."""
+        if not self.pending:
+            return
+        chunks, self.pending = self.pending, []
+        if self._write is not None:
+            await self._write
+        self._write = loop.run_in_executor(None, self._write_chunks, chunks)
+
+    async def close(self):
+        if self._write is not None:
+            await self._write
+            self._write = None
+        self._handle.close()
+
+    def discard(self):
+        self._handle.close()
+        self.path.unlink(missing_ok=True)
+
+
+class _PartState:
+    def __init__(self):
+        self.headers: Dict[bytes, bytes] = {}
+        self.header_field = b''
+        self.header_value = b''
+        self.name: Optional[str] = None
+        self.is_file = False
+        self.data = bytearray()
+        self.file: Optional[IngestedFile] = None
+
+
+async def ingest_multipart(
+    request: Request,
+    on_fields_ready: Callable[[Dict[str, str]], Awaitable[None]],
+    file_fields=ATTACHMENT_FIELDS,
+    check: Optional[Callable[[], None]] = None,
+) -> Tuple[Dict[str, str], List[IngestedFile]]:
+    """Stream a multipart/form-data body to disk.
+
+    Returns the text fields (with each attachment field set to its file URL)
+    and the written files. `on_fields_ready` is awaited with the text fields
+    once, either when the first file part begins or at the end of the body.
+    `check`, if given, is called after every chunk from then on; an
+    exception it raises stops reading the body and is re-raised. On any
+    error every file written so far is deleted.
+    """
+    content_type, params = parse_options_header(request.headers.get('content-type', ''))
+    boundary = params.get(b'boundary')
+    if content_type != b'multipart/form-data' or not boundary:
+        raise HTTPException(status_code=400, detail="Expected multipart/form-data")
+
+    loop = asyncio.get_running_loop()
+    fields: Dict[str, str] = {}
+    files: List[IngestedFile] = []
+    state = _PartState()
+    errors: List[HTTPException] = []
+    fields_ready = False
+
+    def fail(status_code: int, detail: str):
+        if not errors:
+            errors.append(HTTPException(status_code=status_code, detail=detail))
+
+    def on_part_begin():
+        state.__init__()
+
+    def on_header_field(data, start, end):
+        state.header_field += data[start:end]
+
+    def on_header_value(data, start, end):
+        state.header_value += data[start:end]
+
+    def on_header_end():
+        state.headers[state.header_field.lower()] = state.header_value
+        state.header_field = b''
+        state.header_value = b''
+
+    def on_headers_finished():
+        _, disposition = parse_options_header(state.headers.get(b'content-disposition', b''))
+        state.name = disposition.get(b'name', b'').decode('utf-8', 'replace')
+        filename = disposition.get(b'filename')
+        if filename is None:
+            if len(fields) >= MAX_FIELDS:
+                fail(400, "Too many form fields")
+            return
+
+        state.is_file = True
+        if state.name not in file_fields:
+            fail(400, f"Unexpected file field '{state.name}'")
+            return
+        filename = filename.decode('utf-8', 'replace')
+        if not filename:
+            return  # empty file input
+        part_type = state.headers.get(b'content-type', b'').decode('latin-1').split(';')[0].strip()
+        is_valid, message = validate_file_metadata(filename, part_type)
+        if not is_valid:
+            fail(400, message)
+            return
+        if not fields.get('business_name'):
+            fail(400, "business_name must be sent before file fields")
+            return
+
+        business_dir = business_dir_name(fields['business_name'])
+        (UPLOADS_DIR / business_dir).mkdir(exist_ok=True)
+        unique_filename = f"{uuid.uuid4()}{Path(filename).suffix.lower()}"
+        state.file = IngestedFile(state.name, filename, part_type,
+                                  UPLOADS_DIR / business_dir / unique_filename,
+                                  file_url(business_dir, unique_filename))
+        files.append(state.file)
+
+    def on_part_data(data, start, end):
+        if state.file is not None:
+            state.file.size += end - start
+            if state.file.size > MAX_FILE_SIZE:
+                fail(413, f"File size exceeds maximum allowed size of {MAX_FILE_SIZE // (1024*1024)}MB")
+                return
+            state.file.pending.append(bytes(data[start:end]))
+        elif not state.is_file and state.name is not None:
+            state.data += data[start:end]
+            if len(state.data) > MAX_FIELD_SIZE:
+                fail(413, f"Form field '{state.name}' is too large")
+
+    def on_part_end():
+        if state.file is not None:
+            fields[state.name] = state.file.url
+        elif state.name and not state.is_file:
+            fields[state.name] = state.data.decode('utf-8', 'replace')
+
+    parser = MultipartParser(boundary, {
+        'on_part_begin': on_part_begin,
+        'on_header_field': on_header_field,
+        'on_header_value': on_header_value,
+        'on_header_end': on_header_end,
+        'on_headers_finished': on_headers_finished,
+        'on_part_data': on_part_data,
+        'on_part_end': on_part_end,
+    })
+
+    try:
+        async for chunk in request.stream():
+            parser.write(chunk)
+            if errors:
+                raise errors[0]
+            if files and not fields_ready:
+                # Text fields precede files, so the form is complete - validate it
+                # while the rest of the file bytes stream in
+                fields_ready = True
+                await on_fields_ready(dict(fields))
+            if fields_ready and check is not None:
+                check()
+            for ingested in files:
+                await ingested.flush(loop)
+        parser.finalize()
+        if errors:
+            raise errors[0]
+        for ingested in files:
+            await ingested.flush(loop)
+            await ingested.close()
+        if not fields_ready:
+            await on_fields_ready(dict(fields))
+        return fields, files
+    except BaseException:
+        for ingested in files:
+            if ingested._write is not None:
+                try:
+                    await ingested._write
+                except Exception:
+                    pass
+            ingested.discard()
+        raise
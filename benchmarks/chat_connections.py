@@ -0,0 +1,163 @@
+# benchmarks/chat_connections.py
+"""How many idle chat sockets one gateway process holds, and what each costs.
+
+    python -m benchmarks.chat_connections --connections 1000,5000,10000
+    python -m benchmarks.chat_connections --connections 20000 --asks 50
+
+Starts `python run.py` (one uvicorn process with the gateway's socket
+settings) against a fake OpenAI server, then opens WebSocket connections
+in steps and leaves them idle. At each step it reads the server's
+RSS/PSS from /proc, works out the memory per connection over the
+no-connection baseline, and checks that held sockets are still served:
+a sample of connections sends an application ping, and --asks sends real
+questions through the bot path while everything else stays connected.
+
+One client address can only open about 28k connections to one port
+(the ephemeral port range), so connections are spread over 127.0.0.x
+source addresses. Both processes raise their open-file limit to the hard
+limit; past that, `ulimit -n` needs raising first. Linux only.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import List
+
+from websockets.asyncio.client import connect
+
+from .stubs import FakeLLMServer, free_port, wait_for_port
+from .worker_memory import smaps_rollup
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+CONNECTIONS_PER_SOURCE = 20000
+OPEN_CONCURRENCY = 200
+PING_SAMPLE = 100
+
+
+def raise_fd_limit() -> int:
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))  # inherited by the server
+    return hard
+
+
+def percentile(values: List[float], pct: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))] if ordered else 0.0
+
+
+async def open_connections(url: str, count: int, start_index: int) -> list:
+    gate = asyncio.Semaphore(OPEN_CONCURRENCY)
+
+    async def open_one(index: int):
+        source = f'127.0.0.{2 + index // CONNECTIONS_PER_SOURCE}'
+        async with gate:
+            ws = await connect(url, compression=None, ping_interval=None, open_timeout=30,
+                               local_addr=(source, 0))
+            ready = json.loads(await ws.recv())
+            assert ready['type'] == 'ready', ready
+            return ws
+
+    return await asyncio.gather(*(open_one(start_index + n) for n in range(count)))
+
+
+async def round_trip(ws, message: dict, expect: str) -> float:
+    start = time.perf_counter()
+    await ws.send(json.dumps(message))
+    reply = json.loads(await ws.recv())
+    if reply['type'] != expect:
+        raise RuntimeError(f"Expected {expect}, got {reply}")
+    return time.perf_counter() - start
+
+
+async def run(args, server_pid: int, url: str):
+    await asyncio.sleep(1.0)
+    baseline = smaps_rollup(server_pid)
+    print(f"Baseline: RSS {baseline['Rss'] / 1024:.1f}MB, PSS {baseline['Pss'] / 1024:.1f}MB")
+    print(f"\n{'connections':>12s} {'open s':>8s} {'RSS MB':>8s} {'PSS MB':>8s} {'KB/conn':>8s} "
+          f"{'ping p50':>9s} {'ping p99':>9s} {'ask p50':>8s} {'ask p99':>8s}")
+
+    held = []
+    try:
+        for target in args.connections:
+            start = time.perf_counter()
+            held += await open_connections(url, target - len(held), len(held))
+            opened = time.perf_counter() - start
+            await asyncio.sleep(args.settle)
+            memory = smaps_rollup(server_pid)
+            per_connection = (memory['Pss'] - baseline['Pss']) / max(len(held), 1)
+
+            sample = random.sample(held, min(PING_SAMPLE, len(held)))
+            pings = await asyncio.gather(*(round_trip(ws, {'type': 'ping'}, 'pong') for ws in sample))
+            asks = []
+            if args.asks:
+                askers = random.sample(held, min(args.asks, len(held)))
+                asks = await asyncio.gather(*(round_trip(ws, {'type': 'ask', 'question': 'Do you have oat milk?'},
+                                                         'answer') for ws in askers))
+            print(f"{len(held):12d} {opened:8.1f} {memory['Rss'] / 1024:8.1f} {memory['Pss'] / 1024:8.1f} "
+                  f"{per_connection:8.1f} {statistics.median(pings) * 1000:7.1f}ms "
+                  f"{percentile(pings, 99) * 1000:7.1f}ms"
+                  + (f" {statistics.median(asks) * 1000:6.0f}ms {percentile(asks, 99) * 1000:6.0f}ms" if asks else ""))
+    finally:
+        await asyncio.gather(*(ws.close() for ws in held), return_exceptions=True)
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Idle WebSocket connections one chat gateway process can hold")
+    parser.add_argument('--connections', default='1000,5000,10000',
+                        type=lambda value: sorted(int(n) for n in value.split(',')),
+                        help="comma-separated connection counts to step through")
+    parser.add_argument('--asks', type=int, default=20, help="questions sent through the bot at each step")
+    parser.add_argument('--llm-latency', type=float, default=0.2)
+    parser.add_argument('--settle', type=float, default=2.0, help="seconds to wait before measuring")
+    args = parser.parse_args(argv)
+
+    if not Path('/proc/self/smaps_rollup').exists():
+        print("/proc/<pid>/smaps_rollup is not available; this benchmark needs Linux 4.14+", file=sys.stderr)
+        return 2
+    limit = raise_fd_limit()
+    if args.connections[-1] + 100 > limit:
+        print(f"Open-file limit is {limit}; raise `ulimit -n` to hold {args.connections[-1]} connections",
+              file=sys.stderr)
+        return 2
+
+    workdir = Path(tempfile.mkdtemp(prefix='aichatflows-chat-'))
+    llm = FakeLLMServer(latency=args.llm_latency).start()
+    port = free_port()
+    env = dict(os.environ, SUBMISSIONS_DB=str(workdir / 'submissions.db'), LOG_LEVEL='WARNING',
+               OPENAI_API_BASE=llm.api_base, OPENAI_API_KEY='sk-loadtest',
+               CHAT_MAX_CONNECTIONS=str(args.connections[-1] + 1000), CHAT_MESSAGES_PER_MINUTE='600')
+    log_path = workdir / 'server.log'
+    with open(log_path, 'wb') as log:
+        server = subprocess.Popen([sys.executable, 'run.py', '--host', '127.0.0.1', '--port', str(port),
+                                   '--no-access-log'], cwd=REPO_ROOT, env=env, stdout=log, stderr=subprocess.STDOUT)
+    try:
+        wait_for_port(port, process=server)
+        asyncio.run(run(args, server.pid, f'ws://127.0.0.1:{port}/ws'))
+        print(f"\nfake LLM answered {llm.requests} questions")
+    except Exception:
+        print(log_path.read_text(errors='replace')[-4000:], file=sys.stderr)
+        raise
+    finally:
+        server.terminate()
+        try:
+            server.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            server.kill()
+        llm.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,330 @@
+# benchmarks/loadtest.py
+"""End-to-end load test: the app under uvicorn, with local SMTP and LLM stand-ins.
+
+    python -m benchmarks.loadtest --concurrency 1,5,10,20 --duration 30
+    python -m benchmarks.loadtest --concurrency 10 --funnels 200 --smtp-latency 0.3
+    python -m benchmarks.loadtest --workers 2 --chat --json results.json
+
+Boots an SMTP sink, a fake OpenAI server and `uvicorn app.main:app` (plus
+`run:app` with --chat) on free local ports, with a throwaway submissions
+database and upload directory. Nothing leaves the machine.
+
+Each virtual user walks the signup funnel the browser does:
+
+    GET /  ->  GET /start  ->  POST /api/uploads/lookup (the menu's SHA-256)
+           ->  POST /api/submit-onboarding-multipart (form fields, then the
+               menu unless the lookup found it already stored)
+           ->  POST /api/stripe/webhook (signed checkout.session.completed,
+               as Stripe sends after payment)
+           ->  GET /thank-you  [->  POST /ask on run:app with --chat]
+
+then starts over as a new signup. Concurrency is closed-loop: N users,
+each starting its next funnel as soon as the last one finishes.
+Concurrency levels given as a list run one after another, so one run
+shows where throughput stops growing and p99 takes off.
+
+Every funnel comes from its own client IP (X-Forwarded-For, which uvicorn
+trusts from 127.0.0.1), so the per-IP rate limits behave as they would
+for real, distinct visitors instead of throttling the whole test.
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from collections import Counter, defaultdict
+from contextlib import ExitStack
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, List, Optional
+from urllib.parse import parse_qs, urlparse
+
+import httpx
+
+from app.stripe_fixtures import checkout_completed_event, sign_event
+from app.uploads import ATTACHMENT_PLACEHOLDER
+
+from .payloads import REALISTIC_FORM
+from .stubs import FakeLLMServer, SmtpSink, free_port, wait_for_port
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+WEBHOOK_SECRET = 'whsec_loadtest'
+
+# A small but valid PDF, padded to a typical one-page menu size
+MENU_PDF = (
+    b"%PDF-1.4\n1 0 obj<</Type/Catalog/Pages 2 0 R>>endobj\n"
+    b"2 0 obj<</Type/Pages/Kids[3 0 R]/Count 1>>endobj\n"
+    b"3 0 obj<</Type/Page/Parent 2 0 R/MediaBox[0 0 612 792]>>endobj\n"
+    + b"% menu padding\n" * 3000
+    + b"trailer<</Root 1 0 R>>\n%%EOF\n"
+)
+MENU_SHA256 = hashlib.sha256(MENU_PDF).hexdigest()
+
+
+@dataclass
+class RouteStats:
+    latencies: List[float] = field(default_factory=list)
+    statuses: Counter = field(default_factory=Counter)
+
+    def record(self, seconds: float, status: str):
+        self.latencies.append(seconds)
+        self.statuses[status] += 1
+
+    @property
+    def errors(self) -> int:
+        return sum(count for status, count in self.statuses.items() if not status.startswith(('2', '3')))
+
+
+@dataclass
+class LevelResult:
+    concurrency: int
+    elapsed: float = 0.0
+    funnels: int = 0
+    failed_funnels: int = 0
+    routes: Dict[str, RouteStats] = field(default_factory=lambda: defaultdict(RouteStats))
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, int(round(pct / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[rank]
+
+
+class Funnel:
+    """One signup walked through the app, recording each request."""
+
+    _ips = 0
+
+    def __init__(self, client: httpx.AsyncClient, result: LevelResult, chat_client: Optional[httpx.AsyncClient],
+                 think_time: float):
+        Funnel._ips += 1
+        n = Funnel._ips
+        self.headers = {'X-Forwarded-For': f'10.{(n >> 16) & 255}.{(n >> 8) & 255}.{n & 255}'}
+        self.client = client
+        self.chat_client = chat_client
+        self.result = result
+        self.think_time = think_time
+        self.business_name = f"Loadtest Cafe {uuid.uuid4().hex[:10]}"
+
+    async def request(self, route: str, method: str, url: str, client: Optional[httpx.AsyncClient] = None,
+                      **kwargs) -> httpx.Response:
+        headers = dict(self.headers, **kwargs.pop('headers', {}))
+        start = time.perf_counter()
+        try:
+            response = await (client or self.client).request(method, url, headers=headers, **kwargs)
+        except httpx.HTTPError as e:
+            self.result.routes[route].record(time.perf_counter() - start, type(e).__name__)
+            raise
+        self.result.routes[route].record(time.perf_counter() - start, str(response.status_code))
+        response.raise_for_status()
+        if self.think_time:
+            await asyncio.sleep(self.think_time)
+        return response
+
+    async def run(self):
+        await self.request('GET /', 'GET', '/')
+        await self.request('GET /start', 'GET', '/start')
+
+        lookup = await self.request('POST /api/uploads/lookup', 'POST', '/api/uploads/lookup', json={
+            'business_name': self.business_name, 'filename': 'menu.pdf', 'content_type': 'application/pdf',
+            'size': len(MENU_PDF), 'sha256': MENU_SHA256,
+        })
+        menu_url = lookup.json().get('file_url')
+
+        # Text fields first, then the menu's bytes unless the server already has them
+        form = dict(REALISTIC_FORM, business_name=self.business_name, menu_upload=menu_url or ATTACHMENT_PLACEHOLDER,
+                    has_faqs='false', faq_upload=None, additional_docs=None)
+        files = None if menu_url else {'menu_upload': ('menu.pdf', MENU_PDF, 'application/pdf')}
+        submitted = await self.request(
+            'POST /api/submit-onboarding-multipart', 'POST', '/api/submit-onboarding-multipart',
+            data={key: value for key, value in form.items() if value is not None}, files=files,
+        )
+
+        stripe_url = submitted.json().get('stripe_url') or ''
+        request_id = parse_qs(urlparse(stripe_url).query).get('client_reference_id', [None])[0]
+        payload, signature = sign_event(checkout_completed_event(request_id, email=form['contact_email']),
+                                        WEBHOOK_SECRET)
+        await self.request('POST /api/stripe/webhook', 'POST', '/api/stripe/webhook', content=payload,
+                           headers={'Stripe-Signature': signature, 'Content-Type': 'application/json'})
+
+        await self.request('GET /thank-you', 'GET', '/thank-you')
+
+        if self.chat_client is not None:
+            await self.request('POST /ask', 'POST', '/ask', client=self.chat_client,
+                               data={'question': form['common_customer_question']})
+
+
+async def run_level(base_url: str, chat_url: Optional[str], concurrency: int, duration: Optional[float],
+                    funnels: Optional[int], think_time: float, timeout: float) -> LevelResult:
+    result = LevelResult(concurrency)
+    limits = httpx.Limits(max_connections=concurrency * 2, max_keepalive_connections=concurrency * 2)
+    started = 0
+    deadline = time.perf_counter() + duration if duration else None
+
+    def more() -> bool:
+        nonlocal started
+        if funnels is not None and started >= funnels:
+            return False
+        if deadline is not None and time.perf_counter() >= deadline:
+            return False
+        started += 1
+        return True
+
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=timeout) as client, \
+            httpx.AsyncClient(base_url=chat_url or base_url, limits=limits, timeout=timeout) as chat:
+
+        async def user():
+            while more():
+                try:
+                    await Funnel(client, result, chat if chat_url else None, think_time).run()
+                    result.funnels += 1
+                except (httpx.HTTPError, KeyError, ValueError):
+                    result.failed_funnels += 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*(user() for _ in range(concurrency)))
+        result.elapsed = time.perf_counter() - start
+    return result
+
+
+def report(result: LevelResult) -> Dict:
+    """Print one concurrency level's table and return it as a dict."""
+    print(f"\n== concurrency {result.concurrency}: {result.funnels} signups "
+          f"({result.failed_funnels} failed) in {result.elapsed:.1f}s, "
+          f"{result.funnels / result.elapsed if result.elapsed else 0:.2f} signups/s")
+    print(f"{'route':40s} {'reqs':>6s} {'req/s':>7s} {'p50 ms':>8s} {'p90 ms':>8s} {'p99 ms':>8s} "
+          f"{'max ms':>8s} {'err %':>6s}  statuses")
+    routes = {}
+    for route, stats in result.routes.items():
+        latencies = sorted(stats.latencies)
+        row = {
+            'requests': len(latencies),
+            'rps': len(latencies) / result.elapsed if result.elapsed else 0.0,
+            'p50_ms': percentile(latencies, 50) * 1000,
+            'p90_ms': percentile(latencies, 90) * 1000,
+            'p99_ms': percentile(latencies, 99) * 1000,
+            'max_ms': latencies[-1] * 1000 if latencies else 0.0,
+            'error_rate': stats.errors / len(latencies) if latencies else 0.0,
+            'statuses': dict(stats.statuses),
+        }
+        routes[route] = row
+        print(f"{route:40s} {row['requests']:6d} {row['rps']:7.2f} {row['p50_ms']:8.1f} {row['p90_ms']:8.1f} "
+              f"{row['p99_ms']:8.1f} {row['max_ms']:8.1f} {row['error_rate'] * 100:6.1f}  "
+              f"{' '.join(f'{k}:{v}' for k, v in sorted(stats.statuses.items()))}")
+    return {
+        'concurrency': result.concurrency,
+        'elapsed_s': result.elapsed,
+        'signups': result.funnels,
+        'failed_signups': result.failed_funnels,
+        'signups_per_s': result.funnels / result.elapsed if result.elapsed else 0.0,
+        'routes': routes,
+    }
+
+
+def start_server(target: str, port: int, env: Dict[str, str], workers: int, log_path: Path) -> subprocess.Popen:
+    command = [sys.executable, '-m', 'uvicorn', target, '--host', '127.0.0.1', '--port', str(port),
+               '--no-access-log', '--log-level', 'warning']
+    if workers > 1:
+        command += ['--workers', str(workers)]
+    log = open(log_path, 'wb')
+    process = subprocess.Popen(command, cwd=REPO_ROOT, env=env, stdout=log, stderr=subprocess.STDOUT)
+    log.close()
+    try:
+        wait_for_port(port, process=process)
+    except (RuntimeError, TimeoutError):
+        process.kill()
+        print(log_path.read_text(errors='replace')[-4000:], file=sys.stderr)
+        raise
+    return process
+
+
+def stop_server(process: subprocess.Popen):
+    process.terminate()
+    try:
+        process.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Signup-funnel load test against a local uvicorn")
+    parser.add_argument('--concurrency', default='1,5,10', help="virtual users, or a comma-separated sweep")
+    parser.add_argument('--duration', type=float, default=20.0, help="seconds per concurrency level")
+    parser.add_argument('--funnels', type=int, help="signups per level instead of a fixed duration")
+    parser.add_argument('--think-time', type=float, default=0.0, help="pause between a user's requests")
+    parser.add_argument('--timeout', type=float, default=30.0, help="per-request client timeout")
+    parser.add_argument('--workers', type=int, default=1, help="uvicorn worker processes")
+    parser.add_argument('--smtp-latency', type=float, default=0.2, help="seconds the SMTP sink takes per message")
+    parser.add_argument('--llm-latency', type=float, default=1.0, help="seconds the fake LLM takes per reply")
+    parser.add_argument('--chat', action='store_true', help="also boot run:app and ask it a question per funnel")
+    parser.add_argument('--json', metavar='PATH', help="write results as JSON")
+    parser.add_argument('--keep', action='store_true', help="keep the temporary data directory and server logs")
+    args = parser.parse_args(argv)
+
+    levels = [int(level) for level in args.concurrency.split(',') if level.strip()]
+    workdir = Path(tempfile.mkdtemp(prefix='aichatflows-loadtest-'))
+
+    with ExitStack() as stack:
+        smtp = SmtpSink(args.smtp_latency).start()
+        stack.callback(smtp.stop)
+        llm = FakeLLMServer(args.llm_latency).start()
+        stack.callback(llm.stop)
+        if not args.keep:
+            stack.callback(shutil.rmtree, workdir, True)
+
+        env = dict(
+            os.environ,
+            SMTP_SERVER='127.0.0.1', SMTP_PORT=str(smtp.port),
+            SMTP_USERNAME='loadtest', SMTP_PASSWORD='loadtest',
+            ADMIN_EMAIL='admin@loadtest.invalid', FROM_EMAIL='noreply@loadtest.invalid',
+            STRIPE_WEBHOOK_SECRET=WEBHOOK_SECRET,
+            OPENAI_API_BASE=llm.api_base, OPENAI_API_KEY='sk-loadtest',
+            SUBMISSIONS_DB=str(workdir / 'submissions.db'),
+            UPLOAD_DIRECTORY=str(workdir / 'uploads'),
+            RESUMABLE_UPLOAD_DIR=str(workdir / 'uploads_partial'),
+            UPLOAD_GC_INTERVAL='0',
+            LOG_LEVEL=os.getenv('LOG_LEVEL', 'WARNING'),
+        )
+        env.pop('REDIS_URL', None)
+        env.pop('RATE_LIMIT_STORAGE_URL', None)
+
+        port = free_port()
+        stack.callback(stop_server, start_server('app.main:app', port, env, args.workers, workdir / 'app.log'))
+        chat_url = None
+        if args.chat:
+            chat_port = free_port()
+            stack.callback(stop_server, start_server('run:app', chat_port, env, args.workers, workdir / 'chat.log'))
+            chat_url = f'http://127.0.0.1:{chat_port}'
+
+        print(f"app on :{port} ({args.workers} worker(s)), SMTP sink on :{smtp.port} "
+              f"({args.smtp_latency}s/message), fake LLM on :{llm.port} ({args.llm_latency}s/reply)")
+        print(f"data in {workdir}")
+
+        results = []
+        for level in levels:
+            result = asyncio.run(run_level(f'http://127.0.0.1:{port}', chat_url, level,
+                                           None if args.funnels else args.duration, args.funnels,
+                                           args.think_time, args.timeout))
+            results.append(report(result))
+        print(f"\nSMTP sink received {smtp.messages} messages; fake LLM served {llm.requests} completions")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'workers': args.workers, 'smtp_latency': args.smtp_latency,
+                       'llm_latency': args.llm_latency, 'levels': results,
+                       'smtp_messages': smtp.messages, 'llm_requests': llm.requests}, f, indent=2)
+        print(f"Wrote {args.json}")
+    return 1 if any(level['failed_signups'] for level in results) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
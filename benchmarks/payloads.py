@@ -0,0 +1,70 @@
+# benchmarks/payloads.py
+"""Realistic and adversarial inputs for the onboarding hot path."""
+
+import copy
+
+# A typical "Submit through this page" onboarding submission, as the browser sends it
+REALISTIC_FORM = {
+    'business_name': "Bean & Leaf Coffee Co.",
+    'instagram_handle': "@beanandleaf",
+    'other_platforms': "TikTok: @beanandleaf, Facebook: Bean & Leaf",
+    'business_type': "Coffee Shop",
+    'other_business_type': None,
+    'common_customer_question': "What time do you open on Sundays, and do you have oat milk?",
+    'product_service_description': (
+        "Specialty coffee roaster and cafe. Espresso drinks, pour-overs, cold brew on tap, "
+        "seasonal lattes, fresh pastries from a local bakery and a small brunch menu on weekends."
+    ),
+    'delivery_pickup': "Both",
+    'delivery_services': "Uber Eats, DoorDash",
+    'delivery_other': "",
+    'pickup_method': "Counter pickup",
+    'pickup_details': "Order ahead in the app, pickup shelf by the door.",
+    'menu_upload': "https://aichatflows.com/api/files/bean_&_leaf_coffee_co./5f1c8f0e-menu.pdf",
+    'menu_text': "Espresso 3.25\nLatte 4.75\nCold brew 4.50\nCroissant 3.50",
+    'additional_docs': "",
+    'plan': "Pro",
+    'submission_method': "Submit through this page",
+    'instagram_email': "owner@beanandleaf.com",
+    'instagram_password': "correct horse battery staple",
+    'facebook_email': "owner@beanandleaf.com",
+    'facebook_password': "another long passphrase",
+    'other_platform_credentials': "TikTok owner@beanandleaf.com / passphrase",
+    'has_faqs': "true",
+    'faq_upload': "https://aichatflows.com/api/files/bean_&_leaf_coffee_co./9a7e-faq.txt",
+    'consent_to_share': "true",
+    'confirm_accurate': "true",
+    'consent_automation': "true",
+    'contact_email': "owner@beanandleaf.com",
+    'submission_timestamp': "2026-10-19T10:00:00Z",
+}
+
+# Every free-text field at the 10 KB sanitize limit, full of markup to strip
+_HOSTILE_CHUNK = '<script>alert(1)</script><img src=x onerror=alert(1)>javascript:void(0) &amp; '
+_TEN_KB = (_HOSTILE_CHUNK * (10240 // len(_HOSTILE_CHUNK) + 1))[:10240]
+
+LARGE_FIELDS_FORM = dict(REALISTIC_FORM, **{
+    key: _TEN_KB for key in (
+        'other_platforms', 'common_customer_question', 'product_service_description',
+        'pickup_details', 'menu_text', 'other_platform_credentials',
+    )
+})
+
+
+def nested(depth: int, leaf: str = "<b>x</b> onload=y") -> dict:
+    """Dicts and lists nested `depth` levels deep (sanitize_input recurses into both)."""
+    value = leaf
+    for level in range(depth):
+        value = {'level': level, 'items': [value, leaf]} if level % 2 else [value, {'k': leaf}]
+    return {'payload': value}
+
+
+DEEP_NESTED = nested(200)
+
+
+def processed(form: dict) -> dict:
+    """A form as it looks after process_form_data (booleans parsed, credentials kept)."""
+    result = copy.deepcopy(form)
+    for key in ('has_faqs', 'consent_to_share', 'confirm_accurate', 'consent_automation'):
+        result[key] = str(result[key]).lower() == 'true'
+    return {k: (None if v == "" else v) for k, v in result.items()}
@@ -0,0 +1,261 @@
+# benchmarks/run.py
+"""Microbenchmarks for the onboarding hot path.
+
+    python -m benchmarks.run                              # run and print
+    python -m benchmarks.run --save benchmarks/baseline.json
+    python -m benchmarks.run --compare benchmarks/baseline.json --tolerance 0.15
+    python -m benchmarks.run -k sanitize                  # only matching cases
+
+Each case is timed like timeit: the loop count is calibrated to take about
+0.2s, then repeated; the best repeat is the number that is compared (it
+is the least noisy), the median is reported alongside. `--compare` exits
+1 if any case got slower than baseline * (1 + tolerance). Baselines are
+machine specific, so keep them out of git and record one per machine.
+
+SMTP is never contacted: the EmailService cases build complete MIME
+messages and stop at the point where the message would be sent.
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+from typing import Callable, Dict, List, Tuple
+
+# Keep the app quiet and its side effects out of the repo before importing it
+os.environ.setdefault('LOG_LEVEL', 'ERROR')
+os.environ.setdefault('SUBMISSIONS_DB', os.path.join(tempfile.gettempdir(), 'aichatflows-bench.db'))
+os.environ.setdefault('UPLOAD_GC_INTERVAL', '0')
+os.environ.setdefault('SMTP_USERNAME', 'bench@example.com')
+os.environ.setdefault('SMTP_PASSWORD', 'bench')
+
+from . import payloads
+
+CASES: Dict[str, Callable[[], Callable[[], object]]] = {}
+
+
+def case(name: str):
+    """Register a setup function that returns the zero-argument callable to time."""
+    def register(setup):
+        CASES[name] = setup
+        return setup
+    return register
+
+
+@case("sanitize_input.realistic_field")
+def _():
+    from app.main import sanitize_input
+    value = payloads.REALISTIC_FORM['product_service_description']
+    return lambda: sanitize_input(value)
+
+
+@case("sanitize_input.10kb_hostile_field")
+def _():
+    from app.main import sanitize_input
+    value = payloads.LARGE_FIELDS_FORM['menu_text']
+    return lambda: sanitize_input(value)
+
+
+@case("sanitize_input.deep_nesting")
+def _():
+    from app.main import sanitize_input
+    return lambda: sanitize_input(payloads.DEEP_NESTED)
+
+
+@case("process_form_data.realistic")
+def _():
+    from app.main import process_form_data
+    return lambda: process_form_data(payloads.REALISTIC_FORM)
+
+
+@case("process_form_data.10kb_fields")
+def _():
+    from app.main import process_form_data
+    return lambda: process_form_data(payloads.LARGE_FIELDS_FORM)
+
+
+@case("OnboardingForm.validate")
+def _():
+    from app.models import OnboardingForm
+    data = payloads.processed(payloads.REALISTIC_FORM)
+    return lambda: OnboardingForm(**data)
+
+
+@case("OnboardingForm.validate_10kb_fields")
+def _():
+    from app.models import OnboardingForm
+    data = payloads.processed(payloads.LARGE_FIELDS_FORM)
+    return lambda: OnboardingForm(**data)
+
+
+@case("mask_sensitive_data")
+def _():
+    from app.main import mask_sensitive_data
+    return lambda: mask_sensitive_data(payloads.REALISTIC_FORM)
+
+
+def _offline_email_service():
+    """An EmailService that builds every message but never opens a socket."""
+    from app.email_service import EmailService
+    service = EmailService()
+    service._deliver = lambda to_email, msg: msg.as_string()
+    return service
+
+
+def _storage_record():
+    record = payloads.processed(payloads.REALISTIC_FORM)
+    for key in ('instagram_password', 'facebook_password', 'other_platform_credentials'):
+        record.pop(key)
+    record['credentials_handling'] = 'Sent via secure email'
+    return record
+
+
+@case("EmailService.user_confirmation")
+def _():
+    service, record = _offline_email_service(), _storage_record()
+    return lambda: service.send_user_confirmation(record['contact_email'], record)
+
+
+@case("EmailService.admin_notification")
+def _():
+    service, record = _offline_email_service(), _storage_record()
+    return lambda: service.send_admin_notification(record)
+
+
+@case("EmailService.secure_credentials")
+def _():
+    service, record = _offline_email_service(), payloads.processed(payloads.REALISTIC_FORM)
+    return lambda: service.send_secure_credentials(record['contact_email'], record)
+
+
+@case("EmailService.payment_confirmation")
+def _():
+    service = _offline_email_service()
+    return lambda: service.send_payment_confirmation('owner@beanandleaf.com', 'Bean & Leaf Coffee Co.', 'Pro')
+
+
+@case("EmailService.admin_payment_confirmation")
+def _():
+    service = _offline_email_service()
+    return lambda: service.send_admin_payment_confirmation('Bean & Leaf Coffee Co.', 'Pro', 'owner@beanandleaf.com')
+
+
+@case("validate_file")
+def _():
+    from starlette.datastructures import Headers, UploadFile
+    from app.main import validate_file
+    upload = UploadFile(file=None, size=2 * 1024 * 1024, filename="Menu Spring 2026.PDF",
+                        headers=Headers({'content-type': 'application/pdf'}))
+    return lambda: validate_file(upload)
+
+
+def _template_case(template_name: str):
+    def setup():
+        from app.main import templates
+        template = templates.env.get_template(template_name)
+        return lambda: template.render(request=None)
+    return setup
+
+
+for _template in ("index.html", "start.html", "thank-you.html", "legal.html"):
+    case(f"template_render.{_template}")(_template_case(_template))
+
+
+def measure(func: Callable[[], object], repeat: int = 5, target: float = 0.2) -> Dict[str, float]:
+    """Per-call time in seconds: best and median of `repeat` calibrated loops."""
+    func()  # warm caches, lazy imports and compiled regexes
+    loops = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(loops):
+            func()
+        elapsed = time.perf_counter() - start
+        if elapsed >= target / 10 or loops >= 1_000_000:
+            break
+        loops *= 10
+    loops = max(1, int(loops * target / max(elapsed, 1e-9)))
+
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(loops):
+            func()
+        timings.append((time.perf_counter() - start) / loops)
+    return {'best': min(timings), 'median': statistics.median(timings), 'loops': loops}
+
+
+def run(pattern: str = '', repeat: int = 5) -> Dict[str, Dict[str, float]]:
+    results = {}
+    for name, setup in CASES.items():
+        if pattern and pattern not in name:
+            continue
+        results[name] = measure(setup(), repeat=repeat)
+        print(f"{name:45s} {format_time(results[name]['best']):>10s}  "
+              f"(median {format_time(results[name]['median'])}, {results[name]['loops']} loops)")
+    return results
+
+
+def format_time(seconds: float) -> str:
+    for unit, scale in (('s', 1), ('ms', 1e-3), ('us', 1e-6)):
+        if seconds >= scale:
+            return f"{seconds / scale:.2f}{unit}"
+    return f"{seconds / 1e-9:.0f}ns"
+
+
+def compare(results: Dict[str, Dict[str, float]], baseline: Dict[str, Dict[str, float]],
+            tolerance: float) -> List[Tuple[str, float]]:
+    """Cases slower than baseline by more than `tolerance`, with their ratio."""
+    print(f"\n{'case':45s} {'baseline':>10s} {'now':>10s} {'change':>8s}")
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            print(f"{name:45s} {'-':>10s} {format_time(result['best']):>10s}      new")
+            continue
+        ratio = result['best'] / baseline[name]['best']
+        flag = ''
+        if ratio > 1 + tolerance:
+            regressions.append((name, ratio))
+            flag = '  REGRESSION'
+        print(f"{name:45s} {format_time(baseline[name]['best']):>10s} {format_time(result['best']):>10s} "
+              f"{(ratio - 1) * 100:+7.1f}%{flag}")
+    return regressions
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Onboarding hot-path microbenchmarks")
+    parser.add_argument('-k', dest='pattern', default='', help="only run cases containing this text")
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--save', metavar='PATH', help="write results as a JSON baseline")
+    parser.add_argument('--compare', metavar='PATH', help="compare against a JSON baseline")
+    parser.add_argument('--tolerance', type=float, default=0.15, help="allowed slowdown, e.g. 0.15 = 15%%")
+    args = parser.parse_args(argv)
+
+    results = run(args.pattern, args.repeat)
+
+    if args.save:
+        with open(args.save, 'w', encoding='utf-8') as f:
+            json.dump({
+                'created': datetime.now().isoformat(),
+                'python': sys.version.split()[0],
+                'platform': platform.platform(),
+                'results': results,
+            }, f, indent=2)
+        print(f"\nSaved baseline to {args.save}")
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)['results']
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} case(s) slower than baseline by more than {args.tolerance:.0%}")
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,239 @@
+# benchmarks/stubs.py
+"""Local stand-ins for Gmail SMTP and the OpenAI API, for load testing.
+
+Both run on daemon threads on 127.0.0.1, accept everything, count what
+they receive and can add a fixed delay to mimic the real service:
+
+- `SmtpSink` speaks enough ESMTP for smtplib: EHLO, STARTTLS (with a
+  throwaway self-signed certificate; smtplib does not verify it), AUTH
+  PLAIN, MAIL/RCPT/DATA. Messages are counted, not kept.
+- `FakeLLMServer` answers POST .../chat/completions with a canned
+  chat.completion, so openai clients pointed at it via OPENAI_API_BASE
+  work unchanged.
+"""
+
+import json
+import shutil
+import socket
+import socketserver
+import ssl
+import subprocess
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+
+def self_signed_context(directory: Path) -> ssl.SSLContext:
+    """Server TLS context with a one-day certificate for localhost (needs openssl)."""
+    if shutil.which('openssl') is None:
+        raise RuntimeError("openssl is required to generate the SMTP sink's STARTTLS certificate")
+    cert, key = directory / 'sink.crt', directory / 'sink.key'
+    subprocess.run(
+        ['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '1',
+         '-subj', '/CN=localhost', '-keyout', str(key), '-out', str(cert)],
+        check=True, capture_output=True,
+    )
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(str(cert), str(key))
+    return context
+
+
+class _SmtpHandler(socketserver.BaseRequestHandler):
+    server: '_SmtpServer'
+
+    def handle(self):
+        conn = self.request
+        reader = conn.makefile('rb')
+        tls = False
+
+        def reply(line: str):
+            conn.sendall(line.encode('ascii') + b'\r\n')
+
+        reply('220 localhost ESMTP load-test sink')
+        while True:
+            line = reader.readline()
+            if not line:
+                return
+            command = line.decode('ascii', 'replace').strip()
+            verb = command.split(' ', 1)[0].upper()
+
+            if verb == 'EHLO':
+                extensions = ['AUTH PLAIN LOGIN', '8BITMIME', 'SIZE 36700160']
+                if not tls:
+                    extensions.insert(0, 'STARTTLS')
+                reply('250-localhost')
+                for extension in extensions[:-1]:
+                    reply(f'250-{extension}')
+                reply(f'250 {extensions[-1]}')
+            elif verb == 'STARTTLS' and not tls:
+                reply('220 Ready to start TLS')
+                conn = self.server.tls_context.wrap_socket(conn, server_side=True)
+                reader = conn.makefile('rb')
+                tls = True
+            elif verb == 'AUTH':
+                if len(command.split()) == 2:  # no initial response: prompt for it
+                    reply('334 ')
+                    reader.readline()
+                reply('235 Authentication succeeded')
+            elif verb == 'DATA':
+                reply('354 End data with <CR><LF>.<CR><LF>')
+                size = 0
+                for data_line in iter(reader.readline, b''):
+                    if data_line in (b'.\r\n', b'.\n'):
+                        break
+                    size += len(data_line)
+                if self.server.latency:
+                    time.sleep(self.server.latency)
+                self.server.record(size)
+                reply('250 OK: queued')
+            elif verb == 'QUIT':
+                reply('221 Bye')
+                return
+            elif verb in ('HELO', 'MAIL', 'RCPT', 'RSET', 'NOOP'):
+                reply('250 OK')
+            else:
+                reply('502 Command not implemented')
+
+
+class _SmtpServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, tls_context: ssl.SSLContext, latency: float):
+        super().__init__(address, _SmtpHandler)
+        self.tls_context = tls_context
+        self.latency = latency
+        self.messages = 0
+        self.bytes = 0
+        self._lock = threading.Lock()
+
+    def record(self, size: int):
+        with self._lock:
+            self.messages += 1
+            self.bytes += size
+
+
+class SmtpSink:
+    """Accept-everything SMTP server on a free local port."""
+
+    def __init__(self, latency: float = 0.0):
+        self._certs = tempfile.TemporaryDirectory(prefix='smtp-sink-')
+        self._server = _SmtpServer(('127.0.0.1', 0), self_signed_context(Path(self._certs.name)), latency)
+        self.port = self._server.server_address[1]
+
+    @property
+    def messages(self) -> int:
+        return self._server.messages
+
+    def start(self) -> 'SmtpSink':
+        threading.Thread(target=self._server.serve_forever, name='smtp-sink', daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self._certs.cleanup()
+
+
+class _LLMHandler(BaseHTTPRequestHandler):
+    server: '_LLMServer'
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if not self.path.rstrip('/').endswith('/chat/completions'):
+            self._send(404, {'error': {'message': f'Unknown path {self.path}', 'type': 'invalid_request_error'}})
+            return
+        try:
+            request = json.loads(body or b'{}')
+        except ValueError:
+            self._send(400, {'error': {'message': 'Invalid JSON', 'type': 'invalid_request_error'}})
+            return
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        self.server.record()
+        self._send(200, {
+            'id': 'chatcmpl-loadtest',
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': request.get('model', 'gpt-4o'),
+            'choices': [{
+                'index': 0,
+                'message': {'role': 'assistant', 'content': self.server.reply},
+                'finish_reason': 'stop',
+            }],
+            'usage': {'prompt_tokens': 42, 'completion_tokens': 24, 'total_tokens': 66},
+        })
+
+    def _send(self, status: int, payload: dict):
+        data = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class _LLMServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, latency: float, reply: str):
+        super().__init__(address, _LLMHandler)
+        self.latency = latency
+        self.reply = reply
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    def record(self):
+        with self._lock:
+            self.requests += 1
+
+
+class FakeLLMServer:
+    """OpenAI-compatible chat completions endpoint on a free local port."""
+
+    def __init__(self, latency: float = 0.0,
+                 reply: str = "We open at 8am on Sundays, and yes, oat milk is available at no extra charge."):
+        self._server = _LLMServer(('127.0.0.1', 0), latency, reply)
+        self.port = self._server.server_address[1]
+
+    @property
+    def api_base(self) -> str:
+        return f'http://127.0.0.1:{self.port}/v1'
+
+    @property
+    def requests(self) -> int:
+        return self._server.requests
+
+    def start(self) -> 'FakeLLMServer':
+        threading.Thread(target=self._server.serve_forever, name='fake-llm', daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+def wait_for_port(port: int, timeout: float = 20.0, process=None):
+    """Block until something accepts connections on 127.0.0.1:port."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError(f"Server exited with code {process.returncode} before listening on {port}")
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise TimeoutError(f"Nothing listening on 127.0.0.1:{port} after {timeout}s")
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
@@ -0,0 +1,150 @@
+# benchmarks/worker_memory.py
+"""Per-worker memory: pre-forked workers versus independently started ones.
+
+    python -m benchmarks.worker_memory --workers 4
+    python -m benchmarks.worker_memory --workers 4 --requests 200
+
+Starts `python -m app.server` with N workers, sends some traffic so the
+workers have touched their pages, and reads /proc/<pid>/smaps_rollup for
+the master and every worker. Then does the same for N separate
+`uvicorn app.main:app` processes. RSS counts shared pages once per
+process, so it overstates pre-forked workers; PSS splits each shared page
+between the processes mapping it, so the PSS totals are the memory the
+two layouts really use. Linux only.
+"""
+
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from pathlib import Path
+from typing import Dict, List
+
+from .stubs import free_port, wait_for_port
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+FIELDS = ('Rss', 'Pss', 'Shared_Clean', 'Shared_Dirty', 'Private_Clean', 'Private_Dirty')
+WARM_PATHS = ('/', '/start', '/legal', '/thank-you')
+
+
+def smaps_rollup(pid: int) -> Dict[str, int]:
+    """Memory totals for a process in KiB."""
+    totals = {}
+    with open(f'/proc/{pid}/smaps_rollup', encoding='ascii') as f:
+        for line in f:
+            name, _, rest = line.partition(':')
+            if name in FIELDS:
+                totals[name] = int(rest.split()[0])
+    return totals
+
+
+def children(pid: int) -> List[int]:
+    with open(f'/proc/{pid}/task/{pid}/children', encoding='ascii') as f:
+        return [int(child) for child in f.read().split()]
+
+
+def warm(port: int, requests: int):
+    for n in range(requests):
+        path = WARM_PATHS[n % len(WARM_PATHS)]
+        request = urllib.request.Request(f'http://127.0.0.1:{port}{path}',
+                                         headers={'X-Forwarded-For': f'10.1.{n >> 8 & 255}.{n & 255}'})
+        try:
+            urllib.request.urlopen(request, timeout=10).read()
+        except OSError:
+            pass
+
+
+def wait_for_workers(master: int, count: int, timeout: float = 30.0) -> List[int]:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        pids = children(master)
+        if len(pids) >= count:
+            return pids
+        time.sleep(0.2)
+    raise TimeoutError(f"Only {len(children(master))} of {count} workers started")
+
+
+def print_table(title: str, rows: Dict[str, Dict[str, int]]):
+    print(f"\n{title}")
+    print(f"{'process':18s}" + ''.join(f"{field:>15s}" for field in FIELDS))
+    for name, values in rows.items():
+        print(f"{name:18s}" + ''.join(f"{values.get(field, 0) / 1024:13.1f}MB" for field in FIELDS))
+    total = {field: sum(values.get(field, 0) for values in rows.values()) for field in FIELDS}
+    print(f"{'total':18s}" + ''.join(f"{total[field] / 1024:13.1f}MB" for field in FIELDS))
+    return total
+
+
+def stop(processes: List[subprocess.Popen]):
+    for process in processes:
+        process.terminate()
+    for process in processes:
+        try:
+            process.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Compare pre-forked and independent worker memory")
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--requests', type=int, default=100, help="warm-up requests per layout")
+    parser.add_argument('--settle', type=float, default=2.0, help="seconds to wait before measuring")
+    args = parser.parse_args(argv)
+
+    if not Path('/proc/self/smaps_rollup').exists():
+        print("/proc/<pid>/smaps_rollup is not available; this benchmark needs Linux 4.14+", file=sys.stderr)
+        return 2
+
+    workdir = Path(tempfile.mkdtemp(prefix='aichatflows-memory-'))
+    env = dict(os.environ, SUBMISSIONS_DB=str(workdir / 'submissions.db'), UPLOAD_DIRECTORY=str(workdir / 'uploads'),
+               UPLOAD_GC_INTERVAL='0', LOG_LEVEL='WARNING', WORKER_MAX_REQUESTS='0')
+    try:
+        port = free_port()
+        master = subprocess.Popen(
+            [sys.executable, '-m', 'app.server', '--host', '127.0.0.1', '--port', str(port),
+             '--workers', str(args.workers), '--no-access-log'],
+            cwd=REPO_ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        try:
+            wait_for_port(port, process=master)
+            workers = wait_for_workers(master.pid, args.workers)
+            warm(port, args.requests)
+            time.sleep(args.settle)
+            rows = {f'master {master.pid}': smaps_rollup(master.pid)}
+            rows.update({f'worker {pid}': smaps_rollup(pid) for pid in workers})
+        finally:
+            stop([master])
+        forked = print_table(f"Pre-forked: 1 master + {args.workers} workers (python -m app.server)", rows)
+
+        processes, ports = [], []
+        try:
+            for _ in range(args.workers):
+                ports.append(free_port())
+                processes.append(subprocess.Popen(
+                    [sys.executable, '-m', 'uvicorn', 'app.main:app', '--host', '127.0.0.1', '--port', str(ports[-1]),
+                     '--no-access-log', '--log-level', 'warning'],
+                    cwd=REPO_ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                ))
+            for process, process_port in zip(processes, ports):
+                wait_for_port(process_port, process=process)
+                warm(process_port, args.requests // args.workers or 1)
+            time.sleep(args.settle)
+            rows = {f'uvicorn {process.pid}': smaps_rollup(process.pid) for process in processes}
+        finally:
+            stop(processes)
+        independent = print_table(f"Independent: {args.workers} x uvicorn app.main:app", rows)
+
+        saved = independent['Pss'] - forked['Pss']
+        print(f"\nPSS: pre-forked {forked['Pss'] / 1024:.1f}MB vs independent {independent['Pss'] / 1024:.1f}MB "
+              f"({saved / 1024:+.1f}MB saved, {saved / max(independent['Pss'], 1):.0%})")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
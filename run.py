@@ -1,37 +1,104 @@
+import argparse
+import asyncio
 import os
-from fastapi import FastAPI, Request, Form
+import re
+import uuid
+from typing import Dict, List, Optional
+from fastapi import FastAPI, Request, Form, WebSocket
 from fastapi.responses import HTMLResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
-import openai
 from dotenv import load_dotenv
 
 load_dotenv()
-openai.api_key = os.getenv("OPENAI_API_KEY")
+
+from app.chat_gateway import ChatGateway, uvicorn_options
+from app.conversations import ConversationStore
+from app.delivery_zones import DeliveryZones
+from app.storage import SubmissionStore, default_db_path
 
 app = FastAPI()
 app.mount("/static", StaticFiles(directory="static"), name="static")
 templates = Jinja2Templates(directory="templates")
+delivery_zones = DeliveryZones(SubmissionStore(default_db_path()))
+conversations = ConversationStore()
+
+SESSION_COOKIE = "ask_session"
+SESSION_ID = re.compile(r"[0-9a-f]{32}")
+
+async def delivery_context(lat: float, lng: float) -> str:
+    """What the bot should know about delivery to the customer's location."""
+    index = await delivery_zones.index()
+    names = [match["business_name"] for match in index.query(lng, lat)]
+    if not names:
+        return "No business delivers to the customer's location."
+    return "Businesses that deliver to the customer's location: " + ", ".join(names)
 
-def ask_menu_bot(question: str) -> str:
+def ask_menu_bot(question: str, context: Optional[str] = None,
+                 history: Optional[List[Dict[str, str]]] = None) -> str:
+    # openai is slow to import and only needed once someone asks a question
+    import openai
+    openai.api_key = os.getenv("OPENAI_API_KEY")
+    messages = [{"role":"system","content":"You are AI Coffee, a friendly chatbot for coffee menus."}]
+    if context:
+        messages.append({"role":"system","content":context})
+    # Earlier turns of this conversation, already trimmed to the token budget
+    messages.extend(history or [])
+    messages.append({"role":"user","content":question})
     resp = openai.ChatCompletion.create(
         model="gpt-4o",
-        messages=[
-            {"role":"system","content":"You are AI Coffee, a friendly chatbot for coffee menus."},
-            {"role":"user","content":question}
-        ],
+        messages=messages,
         temperature=0.7,
     )
     return resp.choices[0].message.content.strip()
 
+async def answer_question(session: str, question: str, lat: Optional[float], lng: Optional[float]) -> str:
+    context = await delivery_context(lat, lng) if lat is not None and lng is not None else None
+    history = conversations.history(session, question)
+    answer = await asyncio.to_thread(ask_menu_bot, question, context, history)
+    conversations.record(session, question, answer)
+    return answer
+
+# Gateway sessions last as long as their socket, so their history goes with it
+gateway = ChatGateway(answer_question, on_close=conversations.forget)
+
+@app.on_event("startup")
+async def start_gateway():
+    gateway.start()
+
+@app.on_event("shutdown")
+async def stop_gateway():
+    await gateway.stop()
+
+@app.websocket("/ws")
+async def chat_socket(websocket: WebSocket):
+    await gateway.serve(websocket)
+
 @app.get("/", response_class=HTMLResponse)
 async def index(request: Request):
     return templates.TemplateResponse("index.html", {"request": request, "answer": None})
 
 @app.post("/ask", response_class=HTMLResponse)
-async def ask(request: Request, question: str = Form(...)):
-    answer = ask_menu_bot(question)
-    return templates.TemplateResponse(
+async def ask(request: Request, question: str = Form(...),
+              lat: Optional[float] = Form(None), lng: Optional[float] = Form(None)):
+    # The page may send the customer's location so delivery questions get a real answer
+    session = request.cookies.get(SESSION_COOKIE, "")
+    if not SESSION_ID.fullmatch(session):
+        session = uuid.uuid4().hex
+    answer = await answer_question(session, question, lat, lng)
+    response = templates.TemplateResponse(
         "index.html",
         {"request": request, "answer": answer, "question": question}
     )
+    response.set_cookie(SESSION_COOKIE, session, httponly=True, samesite="lax")
+    return response
+
+if __name__ == "__main__":
+    # python run.py --port 8001: uvicorn tuned for many idle chat sockets
+    import uvicorn
+    parser = argparse.ArgumentParser(description="Menu bot with the WebSocket chat gateway")
+    parser.add_argument("--host", default=os.getenv("HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT", "8001")))
+    parser.add_argument("--no-access-log", action="store_true")
+    args = parser.parse_args()
+    uvicorn.run(app, host=args.host, port=args.port, access_log=not args.no_access_log, **uvicorn_options())